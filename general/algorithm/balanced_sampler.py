@@ -0,0 +1,89 @@
+import numpy as np
+
+class BalancedSampler(object):
+    """
+    Samples integer window indices so that each class makes up a target fraction of every draw.
+
+    Optionally weights windows by how recent the iteration they were collected in is,
+    and draws an independent resample for each bootstrap. Everything is done with
+    array operations: set_data is O(N), sample is O(num * log N).
+    """
+
+    def __init__(self, class_pcts, recency_decay=None):
+        """
+        :param class_pcts: target fraction of each class, indexed by class label (e.g. [1 - pct_coll, pct_coll])
+        :param recency_decay: if not None, a window from iteration itr has weight recency_decay ** (max_itr - itr)
+        """
+        self._class_pcts = np.array(class_pcts, dtype=np.float64)
+        assert(np.all(self._class_pcts >= 0) and self._class_pcts.sum() > 0)
+        self._recency_decay = recency_decay
+        self._class_idxs = [np.zeros(0, dtype=np.int64) for _ in self._class_pcts]
+        self._class_cdfs = [None for _ in self._class_pcts]
+
+    @staticmethod
+    def window_collisions(output, starts, T):
+        """
+        :param output: (length x ...) collision labels of one trajectory
+        :param starts: start index of each window
+        :return: 1 for each window containing a collision, else 0
+        """
+        output_sum = np.reshape(output, (len(output), -1)).sum(axis=1)
+        cumsum = np.concatenate(([0], np.cumsum(output_sum)))
+        starts = np.asarray(starts, dtype=np.int64)
+        return (cumsum[starts + T] - cumsum[starts] >= 1).astype(np.int64)
+
+    def __len__(self):
+        return sum(len(idxs) for idxs in self._class_idxs)
+
+    def set_data(self, classes, itrs=None):
+        """
+        :param classes: class label of each window
+        :param itrs: iteration each window was collected in (only used with recency_decay)
+        """
+        classes = np.asarray(classes)
+        self._class_idxs = [np.flatnonzero(classes == c) for c in xrange(len(self._class_pcts))]
+        if self._recency_decay is not None and itrs is not None and len(classes) > 0:
+            itrs = np.asarray(itrs)
+            weights = np.power(float(self._recency_decay), itrs.max() - itrs)
+            self._class_cdfs = [np.cumsum(weights[idxs]) for idxs in self._class_idxs]
+        else:
+            self._class_cdfs = [None for _ in self._class_pcts]
+
+    def class_counts(self, num):
+        """
+        Splits num between the classes that have data, as close to the target fractions as possible
+        :return: number of windows to draw from each class
+        """
+        present = np.array([len(idxs) > 0 for idxs in self._class_idxs])
+        if not present.any():
+            raise Exception('BalancedSampler has no data')
+        pcts = self._class_pcts * present
+        if pcts.sum() == 0:
+            pcts = present.astype(np.float64)
+        pcts /= pcts.sum()
+
+        counts = np.floor(pcts * num).astype(np.int64)
+        # largest remainders get the leftover windows
+        remainders = np.where(present, pcts * num - counts, -1.)
+        counts[np.argsort(-remainders, kind='mergesort')[:num - counts.sum()]] += 1
+        return counts
+
+    def sample(self, num, num_bootstrap=None):
+        """
+        Samples with replacement
+        :return: indices into the data, (num,) or (num_bootstrap x num) with an independent draw per bootstrap
+        """
+        num_draws = 1 if num_bootstrap is None else num_bootstrap
+        idxs = []
+        for class_idxs, cdf, count in zip(self._class_idxs, self._class_cdfs, self.class_counts(num)):
+            if count == 0:
+                continue
+            if cdf is None:
+                local_idxs = np.random.randint(0, len(class_idxs), size=(num_draws, count))
+            else:
+                local_idxs = np.searchsorted(cdf, np.random.uniform(0, cdf[-1], size=(num_draws, count)), side='right')
+                local_idxs = np.minimum(local_idxs, len(class_idxs) - 1)
+            idxs.append(class_idxs[local_idxs])
+        idxs = np.concatenate(idxs, axis=1)
+
+        return idxs[0] if num_bootstrap is None else idxs
@@ -0,0 +1,136 @@
+import os
+import glob
+import time
+import threading
+import tensorflow as tf
+
+class CheckpointWriter(object):
+    """
+    Writes the checkpoints of a training run off the training thread.
+
+    save copies every variable into a snapshot variable on the device (the only part the
+    training thread waits for) and a background thread saves the snapshot under the original
+    variable names, so the checkpoints restore with a normal Saver. Only one write is in flight,
+    a save while the previous write is still running waits for it. save and wait can be called
+    from different threads (training and planning). on_written of a save is called
+    by the writer with the checkpoint once it is written (e.g. to publish it).
+
+    Retention: checkpoints are named <number>.ckpt, the newest keep_last and every number
+    divisible by keep_every are kept, the others are deleted (None keeps all).
+    """
+
+    def __init__(self, sess, checkpoints_dir, logger, background=True, keep_last=None, keep_every=None,
+                 telemetry=None):
+        self._sess = sess
+        self._checkpoints_dir = checkpoints_dir
+        self._logger = logger
+        self._background = background
+        self._keep_last = keep_last
+        self._keep_every = keep_every
+        self._telemetry = telemetry
+
+        variables = tf.global_variables()
+        with tf.name_scope('checkpoint_snapshot'):
+            # not in any collection, so not initialized, saved or trained with the model
+            snapshots = [tf.Variable(tf.zeros(var.get_shape(), dtype=var.dtype.base_dtype),
+                                     trainable=False,
+                                     collections=[],
+                                     name=var.op.name.replace('/', '_'))
+                         for var in variables]
+            self._snapshot = tf.group(*[tf.assign(snapshot, var) for var, snapshot in zip(variables, snapshots)])
+        self._saver = tf.train.Saver(
+            dict([(var.op.name, snapshot) for var, snapshot in zip(variables, snapshots)]),
+            max_to_keep=None)
+
+        # guards _thread and _error, held while waiting for the write so a save never starts
+        # while another thread joins the previous one
+        self._lock = threading.Lock()
+        self._thread = None
+        self._error = None
+        self.last_model_file = None
+        self.last_bytes = 0
+        self.total_bytes = 0
+        self.total_stall = 0.
+
+    def save(self, model_file, on_written=None):
+        """
+        :param on_written: called with model_file once it is written
+        :return: seconds the caller was stalled
+        """
+        start = time.time()
+        with self._lock:
+            self._wait()
+            self._sess.run(self._snapshot)
+            self.last_model_file = model_file
+            if self._background:
+                self._thread = threading.Thread(target=self._write, args=(model_file, on_written))
+                self._thread.daemon = True
+                self._thread.start()
+            else:
+                self._write(model_file, on_written)
+        stall = time.time() - start
+        self.total_stall += stall
+        return stall
+
+    def wait(self):
+        """ Blocks until the pending write (if any) is done """
+        with self._lock:
+            self._wait()
+
+    def _wait(self):
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise error
+
+    def _write(self, model_file, on_written=None):
+        start = time.time()
+        try:
+            self._saver.save(self._sess, model_file, write_meta_graph=False)
+            num_bytes = sum([os.path.getsize(fname) for fname in self._checkpoint_files(model_file)])
+            if on_written is not None:
+                on_written(model_file)
+            self._apply_retention(model_file)
+        except Exception as e:
+            self._error = e
+            return
+        self.last_bytes = num_bytes
+        self.total_bytes += num_bytes
+        write_time = time.time() - start
+        self._logger.debug('Wrote checkpoint {0} ({1:.1f} MB in {2:.2f}s)'.format(
+            os.path.basename(model_file), num_bytes / 1e6, write_time))
+        if self._telemetry is not None:
+            self._telemetry.write('checkpoint_write', bytes=num_bytes, time=write_time)
+
+    @staticmethod
+    def _checkpoint_files(model_file):
+        # <model_file> for the V1 format, <model_file>.index and .data-* for V2
+        return [fname for fname in glob.glob(model_file + '*')
+                if fname == model_file or os.path.basename(fname).startswith(os.path.basename(model_file) + '.')]
+
+    @staticmethod
+    def _checkpoint_num(model_file):
+        return int(os.path.splitext(os.path.basename(model_file))[0])
+
+    def _apply_retention(self, model_file):
+        """ Deletes the checkpoints not kept and records the kept ones in the checkpoint state """
+        ckpt = tf.train.get_checkpoint_state(self._checkpoints_dir)
+        model_files = list(ckpt.all_model_checkpoint_paths) if ckpt is not None else []
+        if model_file not in model_files:
+            model_files.append(model_file)
+        model_files = sorted(set(model_files), key=CheckpointWriter._checkpoint_num)
+
+        if self._keep_last is None:
+            kept = model_files
+        else:
+            kept = [fname for i, fname in enumerate(model_files)
+                    if i >= len(model_files) - self._keep_last or
+                    (self._keep_every is not None and CheckpointWriter._checkpoint_num(fname) % self._keep_every == 0)]
+            for fname in model_files:
+                if fname not in kept:
+                    for ckpt_fname in self._checkpoint_files(fname):
+                        os.remove(ckpt_fname)
+
+        tf.train.update_checkpoint_state(self._checkpoints_dir, model_file, all_model_checkpoint_paths=kept)
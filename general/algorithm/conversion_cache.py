@@ -0,0 +1,137 @@
+import os
+import json
+import hashlib
+import tempfile
+
+class ConversionCache(object):
+    """
+    Persistent record of which sample files were converted into which tfrecords.
+
+    Entries are keyed by the model hash and the md5 of the sample file. The md5 of each
+    sample file is memoized by its (size, mtime), so a file that was already converted
+    is found with a stat and a dictionary lookup instead of being read again.
+    """
+
+    def __init__(self, cache_dir, model_hash, logger):
+        self._cache_dir = cache_dir
+        self._model_hash = model_hash
+        self._logger = logger
+        if not os.path.exists(self._entries_dir):
+            os.makedirs(self._entries_dir)
+
+        if os.path.exists(self._checksums_fname):
+            with open(self._checksums_fname, 'r') as f:
+                self._checksums = json.load(f)
+        else:
+            self._checksums = dict()
+
+    #############
+    ### Files ###
+    #############
+
+    @property
+    def _entries_dir(self):
+        return os.path.join(self._cache_dir, 'entries')
+
+    @property
+    def _checksums_fname(self):
+        return os.path.join(self._cache_dir, 'checksums.json')
+
+    def _entry_fname(self, model_hash, checksum):
+        return os.path.join(self._entries_dir, '{0}_{1}.json'.format(model_hash, checksum))
+
+    @staticmethod
+    def _write_json(fname, d):
+        # write then rename so a crash never leaves a partial file, the temporary file is unique
+        # because every process of an experiment (planner, trainer, workers) writes to the cache
+        fd, tmp_fname = tempfile.mkstemp(dir=os.path.dirname(fname), prefix=os.path.basename(fname), suffix='.tmp')
+        with os.fdopen(fd, 'w') as f:
+            json.dump(d, f)
+        os.rename(tmp_fname, fname)
+
+    #################
+    ### Checksums ###
+    #################
+
+    @staticmethod
+    def _source_files(fname):
+        """ Sample archives are directories """
+        if os.path.isdir(fname):
+            return [os.path.join(fname, fn) for fn in sorted(os.listdir(fname))]
+        return [fname]
+
+    @staticmethod
+    def _stat_key(fname):
+        stats = [os.stat(fn) for fn in ConversionCache._source_files(fname)]
+        return [sum(s.st_size for s in stats), max([s.st_mtime for s in stats] + [0])]
+
+    def checksum(self, fname):
+        fname = os.path.abspath(fname)
+        stat_key = ConversionCache._stat_key(fname)
+        memo = self._checksums.get(fname, None)
+        if memo is not None and memo['stat'] == stat_key:
+            return memo['md5']
+
+        md5 = hashlib.md5()
+        for fn in ConversionCache._source_files(fname):
+            with open(fn, 'rb') as f:
+                for chunk in iter(lambda: f.read(1 << 20), b''):
+                    md5.update(chunk)
+        checksum = md5.hexdigest()
+        self._checksums[fname] = {'stat': stat_key, 'md5': checksum}
+        ConversionCache._write_json(self._checksums_fname, self._checksums)
+        return checksum
+
+    ###############
+    ### Entries ###
+    ###############
+
+    def lookup(self, fname):
+        """
+        :return: conversion stats if fname was converted with the current model hash, else None
+        """
+        entry_fname = self._entry_fname(self._model_hash, self.checksum(fname))
+        if not os.path.exists(entry_fname):
+            return None
+        with open(entry_fname, 'r') as f:
+            stats = json.load(f)
+        if not all(os.path.exists(fn) for fn in stats['files']):
+            return None
+        return stats
+
+    def add(self, fname, stats):
+        ConversionCache._write_json(self._entry_fname(self._model_hash, self.checksum(fname)), stats)
+
+    def collect_garbage(self, remove_other_hashes=False):
+        """
+        Removes entries whose tfrecords are missing and checksums of sample files that no longer exist
+        :param remove_other_hashes: also remove the entries of other model hashes and their tfrecords,
+            which other configs of the experiment may still use (main.py collect_conversions)
+        """
+        num_removed = 0
+        for entry_fn in os.listdir(self._entries_dir):
+            if not entry_fn.endswith('.json'):
+                continue
+            entry_fname = os.path.join(self._entries_dir, entry_fn)
+            with open(entry_fname, 'r') as f:
+                stats = json.load(f)
+            stale = remove_other_hashes and not entry_fn.startswith(self._model_hash + '_')
+            missing = not all(os.path.exists(fn) for fn in stats['files'])
+            if stale or missing:
+                if stale:
+                    for fn in stats['files']:
+                        if os.path.exists(fn):
+                            os.remove(fn)
+                os.remove(entry_fname)
+                num_removed += 1
+
+        missing_sources = [fname for fname in self._checksums.keys() if not os.path.exists(fname)]
+        for fname in missing_sources:
+            self._checksums.pop(fname)
+        if len(missing_sources) > 0:
+            ConversionCache._write_json(self._checksums_fname, self._checksums)
+
+        if num_removed > 0 or len(missing_sources) > 0:
+            self._logger.info('Conversion cache removed {0} stale entries and {1} missing sources'.format(
+                num_removed, len(missing_sources)))
+        return num_removed
@@ -0,0 +1,91 @@
+import time
+import multiprocessing
+
+# Set while the pool forks so workers inherit the model instead of pickling it
+_converter_model = None
+
+def _convert_file(npz_fname):
+    return _converter_model._convert_file(npz_fname)
+
+class DataConverter(object):
+    """
+    Streams sample files into tfrecords, one file per task.
+    Each file is converted into its own shard, so at most num_processes files are in memory at once.
+
+    The worker processes are forked by start, which must be called before the model creates its
+    tf session: forking a process with a live session and queue runner threads is not safe.
+    Without start (or with one process) files are converted in this process.
+    """
+
+    def __init__(self, probcoll_model, num_processes=1, logger=None):
+        self._probcoll_model = probcoll_model
+        self._num_processes = max(1, num_processes)
+        self._logger = logger if logger is not None else probcoll_model._logger
+        self._pool = None
+
+    def start(self):
+        global _converter_model
+
+        if self._num_processes > 1 and self._pool is None:
+            _converter_model = self._probcoll_model
+            try:
+                # workers are kept, a replaced worker would be forked from the process with the session
+                self._pool = multiprocessing.Pool(processes=self._num_processes)
+            finally:
+                _converter_model = None
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.close()
+            self._pool.join()
+            self._pool = None
+
+    def convert(self, npz_fnames):
+        """
+        :param npz_fnames: sample files to convert
+        :return: list of conversion stats for each file
+        """
+        start = time.time()
+        all_stats = []
+        num_processes = min(self._num_processes, len(npz_fnames)) if self._pool is not None else 1
+        if num_processes > 1:
+            for stats in self._pool.imap_unordered(_convert_file, npz_fnames, chunksize=1):
+                self._log_stats(stats)
+                all_stats.append(stats)
+        else:
+            for npz_fname in npz_fnames:
+                stats = self._probcoll_model._convert_file(npz_fname)
+                self._log_stats(stats)
+                all_stats.append(stats)
+
+        elapsed = time.time() - start
+        num_records = sum(DataConverter.num_records(stats) for stats in all_stats)
+        num_bytes = sum(stats['bytes'] for stats in all_stats)
+        self._logger.info('Converted {0} files into {1} records ({2:.1f} MB) in {3:.1f}s using {4} processes'.format(
+            len(all_stats),
+            num_records,
+            num_bytes / 1e6,
+            elapsed,
+            max(num_processes, 1)))
+        self._logger.info("Size of no collision data: {0}".format(
+            sum(stats['no_coll_train'] + stats['no_coll_val'] for stats in all_stats)))
+        self._logger.info("Size of collision data: {0}".format(
+            sum(stats['coll_train'] + stats['coll_val'] for stats in all_stats)))
+
+        return all_stats
+
+    @staticmethod
+    def num_records(stats):
+        return stats['no_coll_train'] + stats['no_coll_val'] + stats['coll_train'] + stats['coll_val']
+
+    def _log_stats(self, stats):
+        num_records = DataConverter.num_records(stats)
+        elapsed = max(stats['time'], 1e-6)
+        self._logger.info('\t{0}: {1} trajectories -> {2} records ({3:.1f} MB) in {4:.2f}s ({5:.0f} records/s, {6:.1f} MB/s)'.format(
+            stats['fname'],
+            stats['num_trajectories'],
+            num_records,
+            stats['bytes'] / 1e6,
+            stats['time'],
+            num_records / elapsed,
+            stats['bytes'] / 1e6 / elapsed))
@@ -0,0 +1,208 @@
+import os
+import mmap
+import time
+import numpy as np
+
+class GradientExchange(object):
+    """
+    Averages gradients between the processes of one host through a shared memory file.
+
+    Rank 0 (the chief) runs train, the other ranks (workers) only compute gradients on their own
+    batches. Every step each worker writes its flattened gradients into its slot and publishes
+    the step id, the chief waits for all of them, writes the mean into slot 0 and publishes
+    the step id of the mean. Every process then applies the same mean with its own optimizer,
+    so the variables stay identical.
+
+    A train call of the chief is an epoch: resume writes all variables (weights and optimizer
+    state) for the workers to load and pause cancels the step the workers are waiting for.
+    """
+    EPOCH, MEAN_STEP, STOP_STEP, START_STEP = range(4)
+    NUM_FIXED = 4
+    NO_STOP = 2**62
+    POLL = 1e-4
+    MAX_POLL = 1e-2
+
+    def __init__(self, fname, grad_shapes, weight_shapes, num_workers, rank, dtype=np.float32):
+        """
+        :param grad_shapes: shapes of the gradients, same order in every process
+        :param weight_shapes: shapes of the variables broadcast by resume
+        :param num_workers: number of processes including the chief
+        """
+        assert(0 <= rank < num_workers)
+        self._fname = fname
+        self._grad_shapes = [tuple(shape) for shape in grad_shapes]
+        self._weight_shapes = [tuple(shape) for shape in weight_shapes]
+        self._num_workers = num_workers
+        self._rank = rank
+        self._dtype = np.dtype(dtype)
+
+        # header: fixed fields, step pushed by each rank, epoch acknowledged by each rank
+        self._num_header = GradientExchange.NUM_FIXED + 2 * num_workers
+        self._num_grads = sum([int(np.prod(shape)) for shape in self._grad_shapes])
+        self._num_weights = sum([int(np.prod(shape)) for shape in self._weight_shapes])
+        header_bytes = 8 * self._num_header
+        self._size = header_bytes + self._dtype.itemsize * (self._num_weights + num_workers * self._num_grads)
+
+        self._mmap = None
+        self._header = None
+        self._weights = None
+        self._slots = None
+        self._step = 0
+        self._epoch = 0
+
+    @property
+    def is_chief(self):
+        return self._rank == 0
+
+    def _pushed(self, rank):
+        return GradientExchange.NUM_FIXED + rank
+
+    def _acked(self, rank):
+        return GradientExchange.NUM_FIXED + self._num_workers + rank
+
+    def open(self, alive=None):
+        """
+        The chief creates a zeroed file, workers wait for it
+        :return: False if alive returned False first
+        """
+        if self.is_chief:
+            with open(self._fname, 'w+b') as f:
+                f.truncate(self._size)
+        elif not self._wait(lambda: os.path.exists(self._fname) and os.path.getsize(self._fname) == self._size,
+                            alive, poll=0.1):
+            return False
+
+        fd = os.open(self._fname, os.O_RDWR)
+        try:
+            self._mmap = mmap.mmap(fd, self._size)
+        finally:
+            os.close(fd)
+        self._header = np.frombuffer(self._mmap, dtype=np.int64, count=self._num_header)
+        offset = 8 * self._num_header
+        self._weights = np.frombuffer(self._mmap, dtype=self._dtype, count=self._num_weights, offset=offset)
+        offset += self._dtype.itemsize * self._num_weights
+        self._slots = np.frombuffer(self._mmap, dtype=self._dtype, count=self._num_workers * self._num_grads,
+                                    offset=offset).reshape(self._num_workers, self._num_grads)
+        if self.is_chief:
+            self._header[GradientExchange.STOP_STEP] = 0
+        return True
+
+    def close(self):
+        if self._mmap is not None:
+            self._header = self._weights = self._slots = None
+            self._mmap.close()
+            self._mmap = None
+        if self.is_chief and os.path.exists(self._fname):
+            os.remove(self._fname)
+
+    @staticmethod
+    def _wait(condition, alive=None, poll=POLL, max_poll=MAX_POLL):
+        """
+        Polls every poll seconds at first, doubling up to max_poll, so a short wait (a step) returns
+        quickly and a long one (the chief validating or saving) does not keep a cpu busy
+        :return: True once condition is True, False if alive returns False first
+        """
+        while not condition():
+            if alive is not None and not alive():
+                return False
+            time.sleep(poll)
+            poll = min(2 * poll, max(max_poll, poll))
+        return True
+
+    @staticmethod
+    def _flatten(arrays, out=None):
+        flat = np.concatenate([np.asarray(arr).ravel() for arr in arrays])
+        if out is None:
+            return flat
+        out[:] = flat
+        return out
+
+    @staticmethod
+    def _unflatten(flat, shapes):
+        arrays = []
+        offset = 0
+        for shape in shapes:
+            num = int(np.prod(shape))
+            arrays.append(np.array(flat[offset:offset+num]).reshape(shape))
+            offset += num
+        return arrays
+
+    #############
+    ### Chief ###
+    #############
+
+    def resume(self, weights, alive=None):
+        """
+        Starts an epoch, the workers load weights before their first step
+        :return: False if alive returned False first
+        """
+        assert(self.is_chief)
+        epoch = int(self._header[GradientExchange.EPOCH])
+        # workers still reading the weights of the last epoch
+        if not self._wait(lambda: all([self._header[self._acked(r)] == epoch for r in xrange(1, self._num_workers)]),
+                          alive):
+            return False
+        GradientExchange._flatten(weights, out=self._weights)
+        # workers may have pushed the step cancelled by pause, never reuse it
+        self._step = max(self._step, int(self._header[GradientExchange.STOP_STEP])) + 1
+        self._header[GradientExchange.START_STEP] = self._step
+        self._header[GradientExchange.STOP_STEP] = GradientExchange.NO_STOP
+        self._header[GradientExchange.EPOCH] = epoch + 1
+        return True
+
+    def pause(self):
+        """ Ends the epoch, workers waiting for the next step go back to waiting for resume """
+        assert(self.is_chief)
+        self._header[GradientExchange.STOP_STEP] = self._step
+
+    ###############
+    ### Workers ###
+    ###############
+
+    def wait_resume(self, alive=None):
+        """
+        :return: weights of the next epoch, None if alive returned False first
+        """
+        assert(not self.is_chief)
+        if not self._wait(lambda: self._header[GradientExchange.EPOCH] != self._epoch, alive, poll=0.01):
+            return None
+        self._epoch = int(self._header[GradientExchange.EPOCH])
+        self._step = int(self._header[GradientExchange.START_STEP])
+        weights = GradientExchange._unflatten(self._weights, self._weight_shapes)
+        self._header[self._acked(self._rank)] = self._epoch
+        return weights
+
+    ###########
+    ### All ###
+    ###########
+
+    def allreduce(self, grads, alive=None):
+        """
+        :param grads: gradients in grad_shapes order
+        :return: mean gradients of all ranks, None if the step was cancelled (workers)
+                 or alive returned False first
+        """
+        step = self._step
+        if self.is_chief:
+            if not self._wait(lambda: all([self._header[self._pushed(r)] >= step for r in xrange(1, self._num_workers)]),
+                              alive):
+                return None
+            mean = GradientExchange._flatten(grads).astype(self._dtype)
+            for r in xrange(1, self._num_workers):
+                mean += self._slots[r]
+            mean /= self._num_workers
+            self._slots[0] = mean
+            self._header[GradientExchange.MEAN_STEP] = step
+        else:
+            GradientExchange._flatten(grads, out=self._slots[self._rank])
+            self._header[self._pushed(self._rank)] = step
+            epoch = self._epoch
+            cancelled = lambda: self._header[GradientExchange.EPOCH] != epoch or \
+                                self._header[GradientExchange.STOP_STEP] <= step
+            if not self._wait(lambda: self._header[GradientExchange.MEAN_STEP] >= step or cancelled(), alive):
+                return None
+            if self._header[GradientExchange.MEAN_STEP] < step:
+                return None
+            mean = self._slots[0]
+        self._step += 1
+        return GradientExchange._unflatten(mean, self._grad_shapes)
@@ -0,0 +1,110 @@
+import os
+import json
+import tensorflow as tf
+from tensorflow.python.ops import variable_scope
+
+class GraphCache(object):
+    """
+    Exported MetaGraphs, so a process can import a graph instead of building it again.
+
+    Next to <key>.meta a json file maps the python attributes that held graph elements
+    to their names, nested dicts/lists/tuples are kept. The json file is written last,
+    so a graph is only imported if both files are complete.
+    """
+
+    def __init__(self, cache_dir, key):
+        self._cache_dir = cache_dir
+        self._key = key
+
+    @property
+    def _meta_fname(self):
+        return os.path.join(self._cache_dir, '{0}.meta'.format(self._key))
+
+    @property
+    def _handles_fname(self):
+        return os.path.join(self._cache_dir, '{0}.json'.format(self._key))
+
+    def exists(self):
+        return os.path.exists(self._handles_fname)
+
+    def export(self, handles):
+        """
+        Exports the default graph
+        :param handles: dict from name to graph elements (or nested dicts/lists/tuples of them)
+        """
+        if not os.path.exists(self._cache_dir):
+            os.makedirs(self._cache_dir)
+        encoded = dict([(name, GraphCache._encode(value)) for name, value in handles.items()])
+        pid = os.getpid()
+        tmp_meta_fname = '{0}.{1}.tmp'.format(self._meta_fname, pid)
+        tf.train.export_meta_graph(filename=tmp_meta_fname)
+        os.rename(tmp_meta_fname, self._meta_fname)
+        tmp_handles_fname = '{0}.{1}.tmp'.format(self._handles_fname, pid)
+        with open(tmp_handles_fname, 'w') as f:
+            json.dump(encoded, f)
+        os.rename(tmp_handles_fname, self._handles_fname)
+
+    def load(self):
+        """
+        Imports the graph into the (empty) default graph
+        :return: dict from name to graph elements, as passed to export
+        """
+        with open(self._handles_fname, 'r') as f:
+            encoded = json.load(f)
+        tf.train.import_meta_graph(self._meta_fname)
+
+        variables = dict()
+        for var in tf.global_variables() + tf.local_variables() + tf.get_collection(tf.GraphKeys.MODEL_VARIABLES):
+            variables[var.op.name] = var
+        # tf.get_variable(reuse=True) only finds variables created by tf.get_variable in this process
+        store = variable_scope._get_default_variable_store()
+        for name, var in variables.items():
+            store._vars.setdefault(name, var)
+
+        graph = tf.get_default_graph()
+        return dict([(str(name), GraphCache._decode(value, graph, variables)) for name, value in encoded.items()])
+
+    @staticmethod
+    def _encode(value):
+        if isinstance(value, tf.Variable):
+            return {'variable': value.op.name}
+        elif isinstance(value, tf.Tensor):
+            return {'tensor': value.name}
+        elif isinstance(value, tf.Operation):
+            return {'operation': value.name}
+        elif isinstance(value, tf.QueueBase):
+            return {'queue': value.queue_ref.name,
+                    'dtypes': [dtype.name for dtype in value.dtypes]}
+        elif isinstance(value, dict):
+            return {'dict': [[k, GraphCache._encode(v)] for k, v in value.items()]}
+        elif isinstance(value, list):
+            return {'list': [GraphCache._encode(v) for v in value]}
+        elif isinstance(value, tuple):
+            return {'tuple': [GraphCache._encode(v) for v in value]}
+        elif value is None or isinstance(value, (bool, int, long, float, str)):
+            return {'value': value}
+        else:
+            raise Exception('{0} can not be cached with the graph'.format(type(value)))
+
+    @staticmethod
+    def _decode(value, graph, variables):
+        kind, v = [(k, v) for k, v in value.items() if k != 'dtypes'][0]
+        if kind == 'variable':
+            return variables[v]
+        elif kind == 'tensor':
+            return graph.get_tensor_by_name(v)
+        elif kind == 'operation':
+            return graph.get_operation_by_name(v)
+        elif kind == 'queue':
+            return tf.QueueBase([tf.as_dtype(str(dtype)) for dtype in value['dtypes']], None, None,
+                                graph.get_tensor_by_name(v))
+        elif kind == 'dict':
+            return dict([(str(k), GraphCache._decode(e, graph, variables)) for k, e in v])
+        elif kind == 'list':
+            return [GraphCache._decode(e, graph, variables) for e in v]
+        elif kind == 'tuple':
+            return tuple([GraphCache._decode(e, graph, variables) for e in v])
+        elif kind == 'value':
+            return str(v) if isinstance(v, unicode) else v
+        else:
+            raise Exception('{0} is not a valid cached graph element'.format(kind))
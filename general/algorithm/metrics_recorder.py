@@ -0,0 +1,153 @@
+import os
+import sys
+import csv
+import json
+import argparse
+import subprocess
+import numpy as np
+from collections import OrderedDict
+
+class GrowableBuffer(object):
+    """ Appends in amortized constant time by doubling the capacity """
+
+    def __init__(self, dim, capacity=256, dtype=np.float64):
+        self._data = np.empty((capacity, dim), dtype=dtype)
+        self._size = 0
+
+    def append(self, row):
+        if self._size == len(self._data):
+            data = np.empty((2 * len(self._data), self._data.shape[1]), dtype=self._data.dtype)
+            data[:self._size] = self._data[:self._size]
+            self._data = data
+        self._data[self._size] = row
+        self._size += 1
+
+    def __len__(self):
+        return self._size
+
+    @property
+    def data(self):
+        """ :return: view of the appended rows """
+        return self._data[:self._size]
+
+class MetricsRecorder(object):
+    """
+    Records training and validation curves without plotting.
+
+    Points are kept in growable buffers and appended to a csv file (kind, name, samples, value)
+    on flush, only the points not flushed yet. Figures are drawn with MLPlotter from the csv
+    file, either offline (python -m general.algorithm.metrics_recorder <csv>) or with plot, which
+    runs the same command in a new process (forking the training process with its tf session
+    is not safe). The title and subplots are saved next to the csv file for the command.
+    """
+
+    def __init__(self, fname, title, subplot_dicts):
+        """
+        :param subplot_dicts: as for MLPlotter
+        """
+        self._fname = fname
+        self._title = title
+        self._subplot_dicts = subplot_dicts
+        self._buffers = OrderedDict()
+        self._flushed = dict()
+        self._plot_process = None
+        # a new run of the same file starts over
+        with open(self._fname, 'w') as f:
+            csv.writer(f).writerow(['kind', 'name', 'samples', 'value'])
+        with open(layout_fname(self._fname), 'w') as f:
+            json.dump({'title': title, 'subplot_dicts': subplot_dicts}, f)
+
+    def _buffer(self, kind, name):
+        if (kind, name) not in self._buffers:
+            self._buffers[(kind, name)] = GrowableBuffer(2)
+            self._flushed[(kind, name)] = 0
+        return self._buffers[(kind, name)]
+
+    def add_train(self, name, training_samples, value):
+        self._buffer('train', name).append((training_samples, value))
+
+    def add_val(self, name, value):
+        """ Recorded at the number of training samples of the last training point """
+        train = self._buffer('train', name)
+        self._buffer('val', name).append((train.data[-1, 0] if len(train) > 0 else 0, value))
+
+    def get(self, kind, name):
+        """ :return: samples, values """
+        data = self._buffer(kind, name).data
+        return data[:, 0], data[:, 1]
+
+    def flush(self):
+        with open(self._fname, 'a') as f:
+            writer = csv.writer(f)
+            for (kind, name), buffer in self._buffers.items():
+                for samples, value in buffer.data[self._flushed[(kind, name)]:]:
+                    writer.writerow([kind, name, samples, value])
+                self._flushed[(kind, name)] = len(buffer)
+
+    def plot(self, save_dir, suffix='', skip_busy=True):
+        """
+        Flushes and draws the figure in another process, so the caller never waits on matplotlib.
+        :param skip_busy: skip if the previous figure is still being drawn, else wait for it
+        :return: True if a figure is drawn
+        """
+        self.flush()
+        if self._plot_process is not None and self._plot_process.poll() is None:
+            if skip_busy:
+                return False
+            self._plot_process.wait()
+        root_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), '../..'))
+        self._plot_process = subprocess.Popen(
+            [sys.executable, '-m', 'general.algorithm.metrics_recorder', os.path.abspath(self._fname),
+             '--out', os.path.abspath(save_dir), '--suffix', suffix],
+            cwd=root_dir)
+        return True
+
+def layout_fname(fname):
+    """ :return: json file with the title and subplots of the metrics csv file fname """
+    return os.path.splitext(fname)[0] + '_layout.json'
+
+def read_metrics(fname):
+    """ :return: dict from (kind, name) to (samples, values) """
+    points = OrderedDict()
+    with open(fname, 'r') as f:
+        for row in csv.DictReader(f):
+            points.setdefault((row['kind'], row['name']), []).append((float(row['samples']), float(row['value'])))
+    return OrderedDict([(key, tuple(np.array(v).T)) for key, v in points.items()])
+
+def plot_metrics(fname, title, subplot_dicts, save_dir, suffix=''):
+    # imported here so processes that only record never load matplotlib
+    from general.algorithm.mlplotter import MLPlotter
+
+    plotter = MLPlotter(title, subplot_dicts)
+    for (kind, name), (samples, values) in read_metrics(fname).items():
+        if name not in subplot_dicts:
+            continue
+        if kind == 'train':
+            plotter.set_train(name, samples, values)
+        else:
+            plotter.set_val(name, samples, values)
+    plotter.save(save_dir, suffix=suffix)
+    plotter.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Plot recorded training metrics')
+    parser.add_argument('metrics', type=str, help='metrics csv file')
+    parser.add_argument('--out', type=str, default=None, help='folder for the figure (default: folder of metrics)')
+    parser.add_argument('--suffix', type=str, default=None, help='figure name suffix (default: name of metrics)')
+    args = parser.parse_args()
+
+    if os.path.exists(layout_fname(args.metrics)):
+        with open(layout_fname(args.metrics), 'r') as f:
+            layout = json.load(f)
+        title = str(layout['title'])
+        subplot_dicts = dict([(str(name), dict([(str(k), str(v) if isinstance(v, unicode) else v)
+                                                for k, v in subplot.items()]))
+                              for name, subplot in layout['subplot_dicts'].items()])
+    else:
+        names = sorted(set(name for _, name in read_metrics(args.metrics).keys()))
+        title = args.metrics
+        subplot_dicts = dict([(name, {'title': name, 'subplot': i, 'color': 'k'}) for i, name in enumerate(names)])
+    out = args.out if args.out is not None else os.path.dirname(os.path.abspath(args.metrics))
+    suffix = args.suffix if args.suffix is not None else os.path.splitext(os.path.basename(args.metrics))[0]
+    plot_metrics(args.metrics, title, subplot_dicts, out, suffix=suffix)
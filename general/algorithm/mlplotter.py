@@ -50,6 +50,9 @@ class MLPlotter:
         xdata = np.concatenate((xdata, [new_x]))
         ydata = np.concatenate((ydata, [new_y]))
 
+        self._set_line(line, xdata, ydata)
+
+    def _set_line(self, line, xdata, ydata):
         line.set_xdata(xdata)
         line.set_ydata(ydata)
 
@@ -65,6 +68,13 @@ class MLPlotter:
         xdata = self.train_lines[name].get_xdata()
         self._update_line(self.val_lines[name], xdata[-1] if len(xdata) > 0 else 0, value)
 
+    def set_train(self, name, training_samples, values):
+        """ Sets the whole line at once (e.g. from MetricsRecorder) """
+        self._set_line(self.train_lines[name], training_samples, values)
+
+    def set_val(self, name, training_samples, values):
+        self._set_line(self.val_lines[name], training_samples, values)
+
     def plot(self):
         self.f.canvas.draw()
         plt.pause(0.01)
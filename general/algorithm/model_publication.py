@@ -0,0 +1,166 @@
+import os
+import sys
+import time
+import shutil
+import signal
+import subprocess
+import threading
+import tensorflow as tf
+from general.algorithm.checkpoint_writer import CheckpointWriter
+
+TMP_PREFIX = '.tmp_'
+CKPT_NAME = 'model.ckpt'
+
+def published_versions(published_dir):
+    """ :return: sorted versions that are completely published """
+    if not os.path.exists(published_dir):
+        return []
+    return sorted(int(fname) for fname in os.listdir(published_dir) if fname.isdigit())
+
+def published_checkpoint(published_dir, version):
+    return os.path.join(published_dir, '{0:08d}'.format(version), CKPT_NAME)
+
+class ModelPublisher(object):
+    """
+    Publishes versioned checkpoints for other processes to load.
+    A version is reserved when the checkpoint is saved and published once the checkpoint is
+    written, by linking its files (copying if they can not be linked) into a temporary folder
+    that is then renamed to the version number, so a version folder is always complete.
+    Only the newest few versions are kept.
+    """
+
+    def __init__(self, published_dir, keep=5):
+        self._published_dir = published_dir
+        self._keep = keep
+        if not os.path.exists(self._published_dir):
+            os.makedirs(self._published_dir)
+        versions = published_versions(self._published_dir)
+        self._version = versions[-1] if len(versions) > 0 else -1
+
+    @property
+    def version(self):
+        return self._version
+
+    def reserve(self):
+        """ :return: version of the next publish """
+        self._version += 1
+        return self._version
+
+    def publish(self, model_file, version):
+        """
+        :param model_file: written checkpoint
+        :param version: reserved version
+        """
+        tmp_dir = os.path.join(self._published_dir, '{0}{1:08d}'.format(TMP_PREFIX, version))
+        if os.path.exists(tmp_dir):
+            shutil.rmtree(tmp_dir)
+        os.makedirs(tmp_dir)
+        for fname in CheckpointWriter._checkpoint_files(model_file):
+            # <model_file> for the V1 format, <model_file>.index and .data-* for V2
+            published_fname = os.path.join(tmp_dir, CKPT_NAME + os.path.basename(fname)[len(os.path.basename(model_file)):])
+            try:
+                # a link stays valid when the checkpoint is deleted by the retention
+                os.link(fname, published_fname)
+            except OSError:
+                shutil.copyfile(fname, published_fname)
+        os.rename(tmp_dir, os.path.dirname(published_checkpoint(self._published_dir, version)))
+
+        # readers only load the newest version, so older ones can go
+        for old_version in published_versions(self._published_dir)[:-self._keep]:
+            shutil.rmtree(os.path.dirname(published_checkpoint(self._published_dir, old_version)),
+                          ignore_errors=True)
+        return version
+
+class ModelSubscriber(object):
+    """
+    Polls for newly published versions and reads them in a background thread.
+    The values are only assigned to the variables when pop is called, so the caller decides when.
+    """
+
+    def __init__(self, published_dir, logger, poll_interval=1.):
+        self._published_dir = published_dir
+        self._logger = logger
+        self._poll_interval = poll_interval
+        self._lock = threading.Lock()
+        self._pending = None
+        self._version = -1
+        self._stop = threading.Event()
+        self._thread = None
+
+    @property
+    def version(self):
+        return self._version
+
+    def start(self):
+        self._thread = threading.Thread(target=self._poll_loop)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def close(self):
+        self._stop.set()
+
+    def pop(self):
+        """
+        :return: version, dict from variable name to value of the newest version not popped yet, else None, None
+        """
+        with self._lock:
+            pending, self._pending = self._pending, None
+        if pending is None:
+            return None, None
+        return pending
+
+    def _poll_loop(self):
+        while not self._stop.is_set():
+            versions = published_versions(self._published_dir)
+            if len(versions) > 0 and versions[-1] > self._version:
+                version = versions[-1]
+                try:
+                    values = self._read(published_checkpoint(self._published_dir, version))
+                except Exception as e:
+                    # e.g. removed by the publisher while reading, the next poll reads a newer one
+                    self._logger.debug('Could not read published version {0}: {1}'.format(version, e))
+                else:
+                    with self._lock:
+                        self._pending = (version, values)
+                    self._version = version
+            self._stop.wait(self._poll_interval)
+
+    def _read(self, checkpoint):
+        reader = tf.train.NewCheckpointReader(checkpoint)
+        return dict([(name, reader.get_tensor(name)) for name in reader.get_variable_to_shape_map().keys()])
+
+class TrainerProcess(object):
+    """ Runs main.py trainer (or command) for robot in its own process (own interpreter, GIL and tf session) """
+
+    def __init__(self, robot, yaml_path, logger, command='trainer', args=()):
+        self._robot = robot
+        self._yaml_path = yaml_path
+        self._logger = logger
+        self._command = command
+        self._args = list(args)
+        self._process = None
+
+    @property
+    def _main_file(self):
+        return os.path.abspath(os.path.join(os.path.dirname(__file__), '../../main.py'))
+
+    def start(self):
+        command = [sys.executable, self._main_file, self._command, self._robot,
+                   '-yaml', os.path.abspath(self._yaml_path), '-parent_pid', str(os.getpid())] + self._args
+        self._process = subprocess.Popen(command)
+        self._logger.info('Started {0} process {1}'.format(self._command, self._process.pid))
+
+    def is_alive(self):
+        return self._process is not None and self._process.poll() is None
+
+    def stop(self, timeout=10.):
+        if not self.is_alive():
+            return
+        self._process.send_signal(signal.SIGINT)
+        start = time.time()
+        while self.is_alive() and time.time() - start < timeout:
+            time.sleep(0.1)
+        if self.is_alive():
+            self._process.kill()
+        self._process.wait()
+        self._logger.info('Stopped {0} process'.format(self._command))
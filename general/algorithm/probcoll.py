@@ -6,6 +6,8 @@ from config import params
 
 from general.utility.logger import get_logger
 from general.state_info.sample import Sample
+from general.state_info import sample_archive
+
 class Probcoll:
     __metaclass__ = abc.ABCMeta
 
@@ -135,8 +137,8 @@ class Probcoll:
         init_data_folder = params['probcoll'].get('init_data', None)
         if init_data_folder is not None:
             self._logger.info('Adding initial data')
-            ext = os.path.splitext(self._itr_samples_file(0))[-1]
-            fnames = [fname for fname in os.listdir(init_data_folder) if ext in fname]
+            exts = (os.path.splitext(self._itr_samples_file(0))[-1], sample_archive.EXT)
+            fnames = [fname for fname in os.listdir(init_data_folder) if os.path.splitext(fname)[-1] in exts]
             for fname in fnames:
                 self._logger.info('\t{0}'.format(fname))
             self._probcoll_model.add_data([os.path.join(init_data_folder, fname) for fname in fnames])
@@ -198,8 +200,11 @@ class Probcoll:
                 x0 = self._conditions.get_cond(cond, rep=rep)
                 sample_T = Sample(meta_data=params, T=T)
                 sample_T.set_X(x0, t=0)
+                self._mpc_policy.reset()
                 
                 for t in xrange(T):
+                    # newest weights from the training process, if any
+                    self._probcoll_model.swap_published()
                     self._update_world(sample_T, t)
 
                     x0 = sample_T.get_X(t=t)
@@ -247,10 +252,11 @@ class Probcoll:
 
                 assert(samples[-1].isfinite())
                 elapsed = time.time() - start
-                self._logger.info('\t\t\tFinished cond {0} rep {1} ({2:.1f}s, {3:.3f}x real-time)'.format(cond,
+                self._logger.info('\t\t\tFinished cond {0} rep {1} ({2:.1f}s, {3:.3f}x real-time, {4:.1f} steps/s)'.format(cond,
                                                                                                          rep,
                                                                                                          elapsed,
-                                                                                                         t*params['dt']/elapsed))
+                                                                                                         t*params['dt']/elapsed,
+                                                                                                         (t + 1)/elapsed))
                 rep += 1
 
         self._itr_save_samples(itr, samples)
@@ -6,22 +6,47 @@ import itertools
 import shutil
 from collections import defaultdict
 import hashlib
+import json
+import glob
 import numpy as np
 import tensorflow as tf
 import sys
 import copy
+import yaml
+import multiprocessing
 import rospy
 
 from general.tf import tf_utils
 from general.tf.nn.fc_nn import fcnn
 from general.tf.nn.conv_nn import convnn
 from general.tf.nn.rnn import rnn
+from general.tf.nn import ensemble
 from general.utility.logger import get_logger
 from general.state_info.sample import Sample
-from general.algorithm.mlplotter import MLPlotter
+from general.algorithm.metrics_recorder import MetricsRecorder
+from general.algorithm.data_converter import DataConverter
+from general.algorithm.conversion_cache import ConversionCache
+from general.algorithm.shard_manifest import ShardManifest
+from general.algorithm.record_schema import RecordSchema, convert_tfrecords
+from general.algorithm.replay_buffer import ReplayData
+from general.algorithm.validation_cache import ValidationCache
+from general.algorithm.model_publication import ModelPublisher, ModelSubscriber, TrainerProcess
+from general.algorithm.shared_weights import SharedWeights
+from general.algorithm.telemetry import Telemetry
+from general.algorithm.training_scheduler import TrainingScheduler
+from general.algorithm.checkpoint_writer import CheckpointWriter
+from general.algorithm.data_parallel import GradientExchange
+from general.algorithm.graph_cache import GraphCache
 from config import params
 
 
+def _int64list_feature(value):
+    return tf.train.Feature(int64_list=tf.train.Int64List(value=value))
+
+def _bytes_feature(value):
+    return tf.train.Feature(bytes_list=tf.train.BytesList(value=[value]))
+
+
 class ProbcollModel:
     __metaclass__ = abc.ABCMeta
 
@@ -48,6 +73,23 @@ class ProbcollModel:
         self.dO = len(self.O_idxs())
         self.doutput = len(self.output_idxs())
         self.dtype = tf_utils.str_to_dtype(params["model"]["dtype"])
+        self._record_schema = RecordSchema(params['model'].get('record_dtypes', None))
+        self.data_source = params['model'].get('data_source', 'queue')
+        self.pct_coll = params['model'].get('pct_coll', 0.5)
+        self.bootstrap_mode = params['model'].get('bootstrap_mode', 'resample')
+        self.bootstrap_weights = params['model'].get('bootstrap_weights', 'poisson')
+        self.val_mode = params['model'].get('val_mode', 'queue')
+        self.ensemble_mode = params['model'].get('ensemble_mode', 'separate')
+        if self.ensemble_mode not in ('separate', 'fused'):
+            raise Exception('{0} is not valid ensemble mode'.format(self.ensemble_mode))
+        self.shared_trunk = params['model'].get('shared_trunk', False)
+        self.data_parallel_workers = params['model'].get('data_parallel_workers', 1)
+        self.data_parallel_rank = params['model'].get('data_parallel_rank', 0)
+
+        self._conversion_cache = ConversionCache(self._conversion_cache_dir, self._hash, self._logger)
+        self._conversion_cache.collect_garbage()
+        self._shard_manifest = ShardManifest(self._shard_manifest_fname)
+        self._validate_shard_manifest()
 
         self.tfrecords_train_fnames = [
                 self.tfrecords_no_coll_train_fnames,
@@ -61,6 +103,22 @@ class ProbcollModel:
                 
         self.preprocess_fnames = []
         self.threads = []
+        self._publisher = None
+        self._subscriber = None
+        self._trainer_process = None
+        self._shared_weights = None
+        self._session_model_file = None
+        self._data_parallel = None
+        self._data_parallel_processes = []
+        self._parent_pid = None
+        self._val_cache = None
+        self.publish_transport = params['model'].get('publish_transport', 'shm')
+        # data parallel workers (rank > 0) would only repeat the records of the chief
+        self._telemetry = Telemetry(
+            os.path.join(self.save_dir, 'telemetry.jsonl'),
+            enabled=params['model'].get('telemetry', True) and self.data_parallel_rank == 0)
+        self.telemetry_trace_steps = params['model'].get('telemetry_trace_steps', 100)
+        self._scheduler = TrainingScheduler(self.steps, self._logger, **params['model'].get('train_schedule', {}))
 
         self._control_width = np.array(self.control_range["upper"]) - \
             np.array(self.control_range["lower"])
@@ -75,6 +133,14 @@ class ProbcollModel:
             self._logger.info('Creating NEW graph')
             shutil.copyfile(self._this_file, self._code_file)
         self.tf_debug = {}
+        self._data_converter = DataConverter(
+            self,
+            num_processes=params['model'].get('convert_processes', 1) if self.data_parallel_rank == 0 else 1,
+            logger=self._logger)
+        if not read_only:
+            # forks the converter processes, before there is a tf session. A read only model
+            # (analysis, the training process, ...) does not add data, so it does not keep idle ones
+            self._data_converter.start()
         self._graph_setup()
 
     #############
@@ -86,34 +152,36 @@ class ProbcollModel:
     def _this_file(self):
         raise NotImplementedError('Implement in subclass')
 
+    @property
+    def _robot(self):
+        """ Robot name for main.py, needed to start worker processes """
+        raise NotImplementedError('Implement in subclass')
+
+    def _rank_shard(self, fnames):
+        """ With data parallel training each rank trains on its own files (all if there are too few) """
+        if self.data_parallel_workers <= 1 or len(fnames) < self.data_parallel_workers:
+            return fnames
+        return fnames[self.data_parallel_rank::self.data_parallel_workers]
     
     @property
     def tfrecords_no_coll_train_fnames(self):
-        return [
-                os.path.join(self._no_coll_train_tfrecords_dir, fn)
-                    for fn in os.listdir(self._no_coll_train_tfrecords_dir)
-            ]
+        return self._rank_shard(self._shard_manifest.fnames('no_coll_train'))
 
     @property
     def tfrecords_coll_train_fnames(self):
-        return [
-                os.path.join(self._coll_train_tfrecords_dir, fn)
-                    for fn in os.listdir(self._coll_train_tfrecords_dir)
-            ]
+        return self._rank_shard(self._shard_manifest.fnames('coll_train'))
     
     @property
     def tfrecords_no_coll_val_fnames(self):
-        return [
-                os.path.join(self._no_coll_val_tfrecords_dir, fn)
-                    for fn in os.listdir(self._no_coll_val_tfrecords_dir)
-            ]
+        return self._shard_manifest.fnames('no_coll_val')
 
     @property
     def tfrecords_coll_val_fnames(self):
-        return [
-                os.path.join(self._coll_val_tfrecords_dir, fn)
-                    for fn in os.listdir(self._coll_val_tfrecords_dir)
-            ]
+        return self._shard_manifest.fnames('coll_val')
+
+    @property
+    def _shard_manifest_fname(self):
+        return os.path.join(self.save_dir, 'shard_manifest_{0}.jsonl'.format(self._hash))
 
     @property
     def _code_file(self):
@@ -122,11 +190,17 @@ class ProbcollModel:
     @property
     def _hash(self):
         """ Anything that if changed, need to re-save the data """
+        return self._data_hash(params['model'].get('record_dtypes', None))
+
+    def _data_hash(self, record_dtypes):
+        """ _hash of the data saved with record_dtypes """
         d = {}
 
         pm_params = params['model']
         for key in ('T', 'num_bootstrap', 'val_pct', 'X_order', 'U_order', 'O_order', 'output_order', 'save_type'):
             d[key] = pm_params[key]
+        if record_dtypes is not None:
+            d['record_dtypes'] = record_dtypes
 
         for key in ('X', 'U', 'O'):
             d[key] = params[key]
@@ -136,7 +210,30 @@ class ProbcollModel:
 
         return hashlib.md5(str(d)).hexdigest()
 
+    @property
+    def _graph_cache_key(self):
+        """ Anything that if changed, the graph needs to be built again (params and code) """
+        d = {'tf': tf.__version__}
+        d['model'] = dict([(k, v) for k, v in params['model'].items()
+                           if k not in ('data_parallel_rank', 'graph_cache')])
+        for key in ('X', 'U', 'O'):
+            d[key] = params[key]
+
+        code_hash = hashlib.md5()
+        general_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+        # every module _graph_build adds ops with (this one, record_schema, replay_buffer, ...)
+        fnames = sorted(glob.glob(os.path.join(general_dir, 'tf', '*', '*.py')) +
+                        glob.glob(os.path.join(general_dir, 'tf', '*.py')) +
+                        glob.glob(os.path.join(general_dir, 'algorithm', '*.py')))
+        for fname in fnames + [self._this_file]:
+            with open(fname, 'r') as f:
+                code_hash.update(f.read())
+        d['code'] = code_hash.hexdigest()
+
+        return hashlib.md5(json.dumps(d, sort_keys=True)).hexdigest()
+
     def _next_model_file(self):
+        self._checkpoint_writer.wait()
         latest_file = tf.train.latest_checkpoint(
             self._checkpoints_dir)
         if latest_file is None:
@@ -160,6 +257,34 @@ class ProbcollModel:
             os.makedirs(dir)
         return dir
 
+    @property
+    def _published_dir(self):
+        return os.path.join(self.save_dir, "model_published")
+
+    @property
+    def _shared_weights_fname(self):
+        return os.path.join(
+            SharedWeights.shared_dir(),
+            'probcoll_weights_{0}'.format(hashlib.md5(os.path.abspath(self.save_dir)).hexdigest()))
+
+    @property
+    def _gradient_exchange_fname(self):
+        return os.path.join(
+            SharedWeights.shared_dir(),
+            'probcoll_grads_{0}'.format(hashlib.md5(os.path.abspath(self.save_dir)).hexdigest()))
+
+    @property
+    def _data_parallel_params_fname(self):
+        return os.path.join(self.save_dir, 'data_parallel_params.yaml')
+
+    @property
+    def _trainer_params_fname(self):
+        return os.path.join(self.save_dir, 'trainer_params.yaml')
+
+    @property
+    def _graph_cache_dir(self):
+        return os.path.join(self.save_dir, "graph_cache")
+
     @property
     def _plots_dir(self):
         dir = os.path.join(self.save_dir, "plots") 
@@ -167,6 +292,13 @@ class ProbcollModel:
             os.makedirs(dir)
         return dir
     
+    @property
+    def _conversion_cache_dir(self):
+        dir = os.path.join(self.save_dir, "conversion_cache")
+        if not os.path.exists(dir):
+            os.makedirs(dir)
+        return dir
+
     @property
     def _no_coll_train_tfrecords_dir(self):
         dir = os.path.join(self.save_dir, "no_coll_train_tfrecords") 
@@ -235,66 +367,131 @@ class ProbcollModel:
         """
         return [sample]
 
-    def _load_samples(self, npz_fnames):
+    def _load_samples_file(self, npz_fname):
         """
-        :param npz_fnames: pkl files names containing Samples
-        :return: no_coll_data, coll_data 
+        :param npz_fname: file name containing Samples
+        :return: no_coll_data, coll_data
         """
 
         no_coll_data = {"X": [], "U": [], "O": [], "output": [], "len": []}
         coll_data = {"X": [], "U": [], "O": [], "output": [], "len": []}
 
-        random.shuffle(npz_fnames)
-        for npz_fname in npz_fnames:
-            ### load samples
-            self._logger.debug('\tOpening {0}'.format(npz_fname))
-
-            samples = Sample.load(npz_fname)
-            # Shuffle the data so validation and training data is shuffled
-            random.shuffle(samples)
-            ### add to data
-            for og_sample in samples:
-                for sample in self._modify_sample(og_sample):
-                    s_params = sample._meta_data
-                    X = sample.get_X()[:, self.X_idxs(p=s_params)]
-                    U = sample.get_U()[:, self.U_idxs(p=s_params)]
-                    O = sample.get_O()[:, self.O_idxs(p=s_params)]
-                    output = sample.get_O()[:, self.output_idxs(p=s_params)].astype(np.uint8)
-                    buffer_len = 1
-                    if len(X) < 1 + buffer_len: # used to be self.T, but now we are extending
-                        continue
-                    
-                    for arr in (X, U, O, output):
-                        assert(np.all(np.isfinite(arr)))
-                        assert(not np.any(np.isnan(arr)))
-
-                    if output[-1, 0] == 1:
-                        # For collision data extend collision by T-1 (and buffer)
-                        extend_u = np.zeros((self.T - 1 - buffer_len, U.shape[1]))
-                        U_coll = np.vstack((U[-self.T:], extend_u))
-
-                        X_coll = np.vstack((X[-self.T:], np.tile([X[-1]], (self.T - 1 - buffer_len, 1))))
-                        O_coll = np.vstack((O[-self.T:], np.tile([O[-1]], (self.T - 1 - buffer_len, 1))))
-                        output_coll = np.vstack((output[-self.T:], np.tile([output[-1]], (self.T - 1 - buffer_len, 1))))
-                        coll_data["X"].append(X_coll)
-                        coll_data["U"].append(U_coll)
-                        coll_data["O"].append(O_coll)
-                        coll_data["output"].append(output_coll)
-                        # For noncollision data remove the collision
-                        X = X[:-1]
-                        U = U[:-1]
-                        O = O[:-1]
-                        output = output[:-1]
-                   
-                    # Only add if non-collision part is long enough
-                    if len(X) >= self.T:
-                        no_coll_data["X"].append(X)
-                        no_coll_data["U"].append(U)
-                        no_coll_data["O"].append(O)
-                        no_coll_data["output"].append(output)
+        ### load samples
+        self._logger.debug('\tOpening {0}'.format(npz_fname))
+
+        samples = Sample.load(npz_fname)
+        # Shuffle the data so validation and training data is shuffled
+        random.shuffle(samples)
+        ### add to data
+        for og_sample in samples:
+            for sample in self._modify_sample(og_sample):
+                s_params = sample._meta_data
+                X = sample.get_X()[:, self.X_idxs(p=s_params)]
+                U = sample.get_U()[:, self.U_idxs(p=s_params)]
+                O = sample.get_O()[:, self.O_idxs(p=s_params)]
+                output = sample.get_O()[:, self.output_idxs(p=s_params)].astype(np.uint8)
+                buffer_len = 1
+                if len(X) < 1 + buffer_len: # used to be self.T, but now we are extending
+                    continue
+                
+                for arr in (X, U, O, output):
+                    assert(np.all(np.isfinite(arr)))
+                    assert(not np.any(np.isnan(arr)))
+
+                if output[-1, 0] == 1:
+                    # For collision data extend collision by T-1 (and buffer)
+                    extend_u = np.zeros((self.T - 1 - buffer_len, U.shape[1]))
+                    U_coll = np.vstack((U[-self.T:], extend_u))
+
+                    X_coll = np.vstack((X[-self.T:], np.tile([X[-1]], (self.T - 1 - buffer_len, 1))))
+                    O_coll = np.vstack((O[-self.T:], np.tile([O[-1]], (self.T - 1 - buffer_len, 1))))
+                    output_coll = np.vstack((output[-self.T:], np.tile([output[-1]], (self.T - 1 - buffer_len, 1))))
+                    coll_data["X"].append(X_coll)
+                    coll_data["U"].append(U_coll)
+                    coll_data["O"].append(O_coll)
+                    coll_data["output"].append(output_coll)
+                    # For noncollision data remove the collision
+                    X = X[:-1]
+                    U = U[:-1]
+                    O = O[:-1]
+                    output = output[:-1]
+               
+                # Only add if non-collision part is long enough
+                if len(X) >= self.T:
+                    no_coll_data["X"].append(X)
+                    no_coll_data["U"].append(U)
+                    no_coll_data["O"].append(O)
+                    no_coll_data["output"].append(output)
 
         return no_coll_data, coll_data 
 
+    def _count_records(self, tfrecords):
+        """ Number of windows in tfrecords """
+        if self.save_type == 'window':
+            # a record is a trajectory with the starts of its windows
+            return sum(len(tf.train.Example.FromString(serialized).features.feature['starts'].int64_list.value)
+                       for serialized in tf.python_io.tf_record_iterator(tfrecords))
+        return sum(1 for _ in tf.python_io.tf_record_iterator(tfrecords))
+
+    @staticmethod
+    def _shard_name(npz_fname):
+        """ Manifest name of the shard converted from npz_fname, the prefix of its tfrecords basenames """
+        return os.path.splitext(os.path.basename(npz_fname))[0]
+
+    def _tfrecords_dirs(self):
+        """ :return: tfrecords folders in ShardManifest.KEYS order """
+        return (self._no_coll_train_tfrecords_dir,
+                self._coll_train_tfrecords_dir,
+                self._no_coll_val_tfrecords_dir,
+                self._coll_val_tfrecords_dir)
+
+    def _register_shards(self):
+        """ Adds the tfrecords of this hash that are not in the shard manifest """
+        suffix = '_{0}.tfrecord'.format(self._hash)
+        shard_files = defaultdict(dict)
+        for key, tfdir in zip(ShardManifest.KEYS, self._tfrecords_dirs()):
+            for fn in os.listdir(tfdir):
+                if fn.endswith(suffix):
+                    shard_files[fn[:-len(suffix)]][key] = os.path.join(tfdir, fn)
+        for name, files in sorted(shard_files.items()):
+            if len(files) == len(ShardManifest.KEYS) and name not in self._shard_manifest:
+                self._logger.debug('Adding {0} to shard manifest'.format(name))
+                counts = dict([(key, self._count_records(fname)) for key, fname in files.items()])
+                self._shard_manifest.add(name, files, counts)
+
+    def _validate_shard_manifest(self):
+        ### register tfrecords saved before there was a manifest
+        if len(self._shard_manifest) == 0:
+            self._register_shards()
+
+        ### drop shards whose files were removed
+        missing = [shard['shard'] for shard in self._shard_manifest.shards()
+                   if not all(os.path.exists(fname) for fname in shard['files'].values())]
+        if len(missing) > 0:
+            self._logger.info('Removing {0} shards with missing files from manifest'.format(len(missing)))
+            self._shard_manifest.remove(missing)
+
+        ### drop shards registered twice for the same files (older manifests used the npz path as name)
+        shards_by_files = defaultdict(list)
+        for shard in self._shard_manifest.shards():
+            shards_by_files[tuple(sorted(shard['files'].values()))].append(shard['shard'])
+        duplicates = [name for names in shards_by_files.values() for name in names[:-1]]
+        if len(duplicates) > 0:
+            self._logger.info('Removing {0} duplicate shards from manifest'.format(len(duplicates)))
+            self._shard_manifest.remove(duplicates)
+
+    def _window_length(self, output_window):
+        """ Number of valid timesteps in a window (up to and including the first collision) """
+        output_list = np.ravel(output_window)
+        index = np.argmax(output_list)
+        max_value = output_list[index]
+        if max_value == 0:
+            length = self.T
+        else:
+            length = index + 1
+        assert(length != 0)
+        return length
+
     def _save_tfrecords(
             self,
             tfrecords,
@@ -302,16 +499,22 @@ class ProbcollModel:
             U_by_sample,
             O_by_sample,
             output_by_sample):
+        if self.save_type == 'fixedlen':
+            save_tfrecords = self._save_tfrecords_fixedlen
+        elif self.save_type == 'window':
+            save_tfrecords = self._save_tfrecords_window
+        else:
+            raise Exception('{0} is not valid save type'.format(self.save_type))
 
-        def _floatlist_feature(value):
-            return tf.train.Feature(float_list=tf.train.FloatList(value=value))
-
-        def _int64list_feature(value):
-            return tf.train.Feature(int64_list=tf.train.Int64List(value=value))
-
-        def _bytes_feature(value):
-            return tf.train.Feature(bytes_list=tf.train.BytesList(value=[value]))
+        save_tfrecords(tfrecords, X_by_sample, U_by_sample, O_by_sample, output_by_sample)
 
+    def _save_tfrecords_fixedlen(
+            self,
+            tfrecords,
+            X_by_sample,
+            U_by_sample,
+            O_by_sample,
+            output_by_sample):
         writer = tf.python_io.TFRecordWriter(tfrecords)
 
         record_num = 0
@@ -321,26 +524,49 @@ class ProbcollModel:
                 feature = {
                     'fname': _bytes_feature(os.path.splitext(os.path.basename(tfrecords))[0] + '_{0}'.format(record_num)),
                 }
-                feature['X'] = _floatlist_feature(np.ravel(X[j:j+self.T]).tolist())
-                feature['U'] = _floatlist_feature(np.ravel(U[j:j+self.T]).tolist())
-                # TODO figure out how to keep types properly
-                feature['O'] = _floatlist_feature(np.ravel(O[j]).tolist())
+                feature['X'] = self._record_schema.encode('X', X[j:j+self.T])
+                feature['U'] = self._record_schema.encode('U', U[j:j+self.T])
+                feature['O'] = self._record_schema.encode('O', O[j])
                 output_list = np.ravel(output[j:j+self.T])
                 feature['output'] = _bytes_feature(output_list.tostring())
-                index = np.argmax(output_list)
-                max_value = output_list[index]
-                if max_value == 0:
-                    length = self.T
-                else:
-                    length = index + 1
-                assert(length != 0)
-                feature['len'] = _int64list_feature([length])
+                feature['len'] = _int64list_feature([self._window_length(output_list)])
                 example = tf.train.Example(features=tf.train.Features(feature=feature))
                 writer.write(example.SerializeToString())
                 record_num += 1
 
         writer.close()
 
+    def _save_tfrecords_window(
+            self,
+            tfrecords,
+            X_by_sample,
+            U_by_sample,
+            O_by_sample,
+            output_by_sample):
+        """
+        Saves every trajectory once with the starts of its windows, windows are sliced out in the input pipeline.
+        """
+        writer = tf.python_io.TFRecordWriter(tfrecords)
+
+        for i, (X, U, O, output) in enumerate(zip(X_by_sample, U_by_sample, O_by_sample, output_by_sample)):
+            assert(len(X) >= self.T)
+            starts = np.arange(len(X) - self.T + 1)
+            lens = [self._window_length(output[j:j+self.T]) for j in starts]
+            feature = {
+                'fname': _bytes_feature(os.path.splitext(os.path.basename(tfrecords))[0] + '_{0}'.format(i)),
+            }
+            feature['length'] = _int64list_feature([len(X)])
+            feature['X'] = self._record_schema.encode('X', X)
+            feature['U'] = self._record_schema.encode('U', U)
+            feature['O'] = self._record_schema.encode('O', O)
+            feature['output'] = _bytes_feature(np.ravel(output).tostring())
+            feature['starts'] = _int64list_feature(starts.tolist())
+            feature['len'] = _int64list_feature(lens)
+            example = tf.train.Example(features=tf.train.Features(feature=feature))
+            writer.write(example.SerializeToString())
+
+        writer.close()
+
     def _get_tfrecords_fnames(self, fname, create=True):
         def _file_creator(coll, val):
             if coll:
@@ -353,10 +579,8 @@ class ProbcollModel:
                     tfdir = self._no_coll_val_tfrecords_dir
                 else:
                     tfdir = self._no_coll_train_tfrecords_dir
-            sample_fname = fname.split("/")[-1]
-            tffname = os.path.join(tfdir, sample_fname.replace(
-                ".npz",
-                "_{0}.tfrecord".format(self._hash)))
+            sample_fname = os.path.splitext(fname.split("/")[-1])[0]
+            tffname = os.path.join(tfdir, "{0}_{1}.tfrecord".format(sample_fname, self._hash))
             return tffname
         coll_train_fname = _file_creator(True, False) 
         no_coll_train_fname = _file_creator(False, False)
@@ -369,46 +593,148 @@ class ProbcollModel:
                 no_coll_val_fname
             ]
 
-    def add_data(self, npz_fnames):
-        tfrecords = self._get_tfrecords_fnames(npz_fnames[-1]) 
+    def _read_tfrecords_windows(self, tfrecords):
+        """
+        Parses tfrecords of either save type in numpy
+        :return: dict of X, U, O, output, len for every window, None if there are none
+        """
+        windows = {'X': [], 'U': [], 'O': [], 'output': [], 'len': []}
+        for serialized in tf.python_io.tf_record_iterator(tfrecords):
+            feature = tf.train.Example.FromString(serialized).features.feature
+            X = self._record_schema.to_numpy('X', feature['X'])
+            U = self._record_schema.to_numpy('U', feature['U'])
+            O = self._record_schema.to_numpy('O', feature['O'])
+            output = np.fromstring(feature['output'].bytes_list.value[0], dtype=np.uint8)
+            lens = np.array(feature['len'].int64_list.value, dtype=np.int64)
+            if self.save_type == 'fixedlen':
+                windows['X'].append(X.reshape(1, self.T, self.dX))
+                windows['U'].append(U.reshape(1, self.T, self.dU))
+                windows['O'].append(O.reshape(1, self.dO))
+                windows['output'].append(output.reshape(1, self.T, self.doutput))
+            elif self.save_type == 'window':
+                length = feature['length'].int64_list.value[0]
+                starts = np.array(feature['starts'].int64_list.value, dtype=np.int64)
+                window_idxs = starts[:, None] + np.arange(self.T)[None, :]
+                windows['X'].append(X.reshape(length, self.dX)[window_idxs])
+                windows['U'].append(U.reshape(length, self.dU)[window_idxs])
+                windows['O'].append(O.reshape(length, self.dO)[starts])
+                windows['output'].append(output.reshape(length, self.doutput)[window_idxs])
+            else:
+                raise Exception('{0} is not valid save type'.format(self.save_type))
+            windows['len'].append(lens)
+
+        if len(windows['X']) == 0:
+            return None
+        return dict([(k, np.concatenate(v)) for k, v in windows.items()])
+
+    def _convert_file(self, npz_fname):
+        """
+        Converts one samples file into its own train/val, coll/no coll tfrecords
+        :return: dict of conversion stats
+        """
+        start = time.time()
         tfrecords_coll_train, tfrecords_no_coll_train, \
-            tfrecords_coll_val, tfrecords_no_coll_val = tfrecords
+            tfrecords_coll_val, tfrecords_no_coll_val = self._get_tfrecords_fnames(npz_fname)
+        no_coll_data, coll_data = self._load_samples_file(npz_fname)
+
+        stats = {
+            'fname': npz_fname,
+            'num_trajectories': len(no_coll_data["X"]) + len(coll_data["X"]),
+            'bytes': 0,
+            'tfrecords': {},
+            'files': []
+        }
+        for name, data, tfrecords_train, tfrecords_val in (
+                ('no_coll', no_coll_data, tfrecords_no_coll_train, tfrecords_no_coll_val),
+                ('coll', coll_data, tfrecords_coll_train, tfrecords_coll_val)):
+            num_val = int(len(data["X"]) * self.val_pct)
+            for split, tfrecords, data_slice in (
+                    ('train', tfrecords_train, slice(num_val, None)),
+                    ('val', tfrecords_val, slice(None, num_val))):
+                self._save_tfrecords(
+                    tfrecords,
+                    data["X"][data_slice],
+                    data["U"][data_slice],
+                    data["O"][data_slice],
+                    data["output"][data_slice])
+                key = '{0}_{1}'.format(name, split)
+                stats['tfrecords'][key] = tfrecords
+                stats[key] = sum([len(output) - self.T + 1 for output in data["output"][data_slice]])
+                stats['files'].append(tfrecords)
+                stats['bytes'] += os.path.getsize(tfrecords)
+
+        stats['time'] = time.time() - start
+        return stats
+
+    def add_data(self, npz_fnames):
         self._logger.info('Saving tfrecords')
-        no_coll_data, coll_data = self._load_samples(npz_fnames)
-        no_coll_len = len(no_coll_data["X"])
-        coll_len = len(coll_data["X"])
-        tot_coll = sum([np.argmax(coll_data["output"][i]) + 1 for i in range(coll_len)])
-        tot_no = sum([len(no_coll_data["output"][i]) - self.T + 1 for i in range(no_coll_len)])
-        self._logger.info("Size of no collision data: {0}".format(tot_no))
-        self._logger.info("Size of collision data: {0}".format(tot_coll))
-
-        self._save_tfrecords(
-            tfrecords_no_coll_train, 
-            no_coll_data["X"][int(no_coll_len * self.val_pct):],
-            no_coll_data["U"][int(no_coll_len * self.val_pct):],
-            no_coll_data["O"][int(no_coll_len * self.val_pct):],
-            no_coll_data["output"][int(no_coll_len * self.val_pct):])
-
-        self._save_tfrecords(
-            tfrecords_coll_train, 
-            coll_data["X"][int(coll_len * self.val_pct):],
-            coll_data["U"][int(coll_len * self.val_pct):],
-            coll_data["O"][int(coll_len * self.val_pct):],
-            coll_data["output"][int(coll_len * self.val_pct):])
-
-        self._save_tfrecords(
-            tfrecords_no_coll_val, 
-            no_coll_data["X"][:int(no_coll_len * self.val_pct)],
-            no_coll_data["U"][:int(no_coll_len * self.val_pct)],
-            no_coll_data["O"][:int(no_coll_len * self.val_pct)],
-            no_coll_data["output"][:int(no_coll_len * self.val_pct)])
-
-        self._save_tfrecords(
-            tfrecords_coll_val, 
-            coll_data["X"][:int(coll_len * self.val_pct)],
-            coll_data["U"][:int(coll_len * self.val_pct)],
-            coll_data["O"][:int(coll_len * self.val_pct)],
-            coll_data["output"][:int(coll_len * self.val_pct)])
+        cached_stats, new_npz_fnames = [], []
+        for npz_fname in npz_fnames:
+            stats = self._conversion_cache.lookup(npz_fname)
+            if stats is None:
+                new_npz_fnames.append(npz_fname)
+            else:
+                cached_stats.append(stats)
+        if len(cached_stats) > 0:
+            self._logger.info('Skipping {0} already converted files'.format(len(cached_stats)))
+
+        new_stats = self._data_converter.convert(new_npz_fnames)
+        for stats in new_stats:
+            self._conversion_cache.add(stats['fname'], stats)
+
+        for stats in cached_stats + new_stats:
+            name = self._shard_name(stats['fname'])
+            if stats in new_stats or name not in self._shard_manifest:
+                self._shard_manifest.add(name, stats['tfrecords'], stats)
+
+        return cached_stats + new_stats
+
+    def convert_records(self, src_dtypes):
+        """
+        Converts the tfrecords saved with record_dtypes src_dtypes (None for float lists) in this
+        experiment into the record schema of this model, saved under its hash next to the originals
+        and added to its shard manifest
+        :return: number of converted tfrecords
+        """
+        src_hash = self._data_hash(src_dtypes)
+        if src_hash == self._hash:
+            return 0
+        src_suffix = '_{0}.tfrecord'.format(src_hash)
+        suffix = '_{0}.tfrecord'.format(self._hash)
+        src_schema = RecordSchema(src_dtypes)
+
+        num_converted = 0
+        for tfdir in self._tfrecords_dirs():
+            for fn in sorted(os.listdir(tfdir)):
+                if not fn.endswith(src_suffix):
+                    continue
+                tfrecords = os.path.join(tfdir, fn)
+                new_tfrecords = os.path.join(tfdir, fn[:-len(src_suffix)] + suffix)
+                if os.path.exists(new_tfrecords):
+                    continue
+                start = time.time()
+                # the rename makes the tfrecords visible to _register_shards only once complete
+                num_records = convert_tfrecords(tfrecords, new_tfrecords + '.tmp', src_schema, self._record_schema)
+                os.rename(new_tfrecords + '.tmp', new_tfrecords)
+                self._logger.info('{0} -> {1}: {2} records, {3:.1f} MB -> {4:.1f} MB in {5:.2f}s'.format(
+                    tfrecords,
+                    new_tfrecords,
+                    num_records,
+                    os.path.getsize(tfrecords) / 1e6,
+                    os.path.getsize(new_tfrecords) / 1e6,
+                    time.time() - start))
+                num_converted += 1
+
+        self._register_shards()
+        return num_converted
+
+    def collect_conversions(self):
+        """
+        Deletes the tfrecords converted with other data params (model hashes) of this experiment.
+        Never called implicitly, other configs of the experiment may still use them
+        :return: number of removed conversions
+        """
+        return self._conversion_cache.collect_garbage(remove_other_hashes=True)
 
     #############
     ### Graph ###
@@ -417,38 +743,81 @@ class ProbcollModel:
     def _graph_inputs_outputs_from_file(self, name):
         if self.save_type == 'fixedlen':
             graph_inputs_outputs_from_file = self._graph_inputs_outputs_from_file_fixedlen
+        elif self.save_type == 'window':
+            graph_inputs_outputs_from_file = self._graph_inputs_outputs_from_file_window
         else:
             raise Exception('{0} is not valid save type'.format(self.save_type))
 
         return graph_inputs_outputs_from_file(name)
 
+    @property
+    def _num_reads(self):
+        """ Online bootstrapping reads each batch once and shares it between the bootstraps """
+        if self.bootstrap_mode == 'resample':
+            return self.num_bootstrap
+        elif self.bootstrap_mode == 'online':
+            return 1
+        else:
+            raise Exception('{0} is not valid bootstrap mode'.format(self.bootstrap_mode))
+
+    def _reads_to_bootstraps(self, read_inputs):
+        assert(len(read_inputs) == self._num_reads)
+        return list(read_inputs) * (self.num_bootstrap // self._num_reads)
+
+    def _graph_filename_queues(self, name):
+        filename_vars = (
+                tf.get_variable(
+                    name + '_no_coll_fnames',
+                    initializer=tf.constant([], dtype=tf.string),
+                    validate_shape=False,
+                    trainable=False),
+                tf.get_variable(
+                    name + '_coll_fnames',
+                    initializer=tf.constant([], dtype=tf.string),
+                    validate_shape=False,
+                    trainable=False)
+            )
+        ### create file queues
+        filename_queues = (
+                tf.train.string_input_producer(
+                    filename_vars[0],
+                    num_epochs=None,
+                    capacity=10*self.batch_size,
+                    shuffle=True),
+                tf.train.string_input_producer(
+                    filename_vars[1],
+                    num_epochs=None,
+                    capacity=10*self.batch_size,
+                    shuffle=True)
+            )
+        return filename_queues, filename_vars
+
+    def _graph_batch_join(self, inputs):
+        """
+        :param inputs: for no coll and coll, tuple of (fname, X_r..., U_r..., O_r..., output_r..., len_r...)
+                       for each of the self._num_reads reads
+        """
+        shuffled = tf.train.shuffle_batch_join(
+            inputs,
+            batch_size=self.batch_size,
+            capacity=10*self.batch_size + 3 * self.batch_size,
+            min_after_dequeue=10*self.batch_size,
+            )
+
+        fname_batch = shuffled[0]
+        bootstrap_X_inputs = shuffled[1:1+self._num_reads]
+        bootstrap_U_inputs = shuffled[1+self._num_reads:1+2*self._num_reads]
+        bootstrap_O_inputs = shuffled[1+2*self._num_reads:1+3*self._num_reads]
+        bootstrap_outputs = shuffled[1+3*self._num_reads:1+4*self._num_reads]
+        bootstrap_lens = shuffled[1+4*self._num_reads:1+5*self._num_reads]
+
+        return fname_batch, self._reads_to_bootstraps(bootstrap_X_inputs), self._reads_to_bootstraps(bootstrap_U_inputs), \
+               self._reads_to_bootstraps(bootstrap_O_inputs), self._reads_to_bootstraps(bootstrap_outputs), \
+               self._reads_to_bootstraps(bootstrap_lens)
+
     def _graph_inputs_outputs_from_file_fixedlen(self, name):
         with tf.name_scope(name + '_file_input'):
-            filename_vars = ( 
-                    tf.get_variable(
-                        name + '_no_coll_fnames',
-                        initializer=tf.constant([], dtype=tf.string),
-                        validate_shape=False,
-                        trainable=False),
-                    tf.get_variable(
-                        name + '_coll_fnames',
-                        initializer=tf.constant([], dtype=tf.string),
-                        validate_shape=False,
-                        trainable=False)
-                )
-            ### create file queues
-            filename_queues = (
-                    tf.train.string_input_producer(
-                        filename_vars[0],
-                        num_epochs=None,
-                        capacity=10*self.batch_size,
-                        shuffle=True),
-                    tf.train.string_input_producer(
-                        filename_vars[1],
-                        num_epochs=None,
-                        capacity=10*self.batch_size,
-                        shuffle=True)
-                )
+            filename_queues, filename_vars = self._graph_filename_queues(name)
 
             ### read and decode
             readers = [tf.TFRecordReader(), tf.TFRecordReader()]
@@ -457,49 +826,154 @@ class ProbcollModel:
                 'fname': tf.FixedLenFeature([], tf.string)
             }
 
-            features['X'] = tf.FixedLenFeature([self.dX * self.T], tf.float32)
-            features['U'] = tf.FixedLenFeature([self.dU * self.T], tf.float32)
-            features['O'] = tf.FixedLenFeature([self.dO], tf.float32)
+            features['X'] = self._record_schema.feature('X', self.dX * self.T)
+            features['U'] = self._record_schema.feature('U', self.dU * self.T)
+            features['O'] = self._record_schema.feature('O', self.dO)
             features['output'] = tf.FixedLenFeature([], tf.string)
             features['len'] = tf.FixedLenFeature([], tf.int64)
             # Figure out how to do arbitrary split across batchsize
             inputs = [None, None]
             for i, fq in enumerate(filename_queues):
-                serialized_examples = [readers[(b+i)%2].read(fq)[1] for b in xrange(self.num_bootstrap)]
+                serialized_examples = [readers[(b+i)%2].read(fq)[1] for b in xrange(self._num_reads)]
                 parsed_example = [
                         tf.parse_single_example(serialized_examples[b], features=features)
-                        for b in xrange(self.num_bootstrap)
+                        for b in xrange(self._num_reads)
                     ]
 
                 fname = parsed_example[0]['fname']
-                bootstrap_X_input = [tf.reshape(parsed_example[b]['X'], (self.T, self.dX))
-                                     for b in xrange(self.num_bootstrap)]
-                bootstrap_U_input = [tf.reshape(parsed_example[b]['U'], (self.T, self.dU))
-                                     for b in xrange(self.num_bootstrap)]
-                bootstrap_O_input = [tf.reshape(parsed_example[b]['O'], (self.dO,))
-                                     for b in xrange(self.num_bootstrap)]
-                bootstrap_output = [tf.reshape(tf.decode_raw(parsed_example[b]['output'], tf.uint8), (self.T, self.doutput))  for b in xrange(self.num_bootstrap)]
+                bootstrap_X_input = [self._record_schema.decode('X', parsed_example[b]['X'], (self.T, self.dX))
+                                     for b in xrange(self._num_reads)]
+                bootstrap_U_input = [self._record_schema.decode('U', parsed_example[b]['U'], (self.T, self.dU))
+                                     for b in xrange(self._num_reads)]
+                bootstrap_O_input = [self._record_schema.decode('O', parsed_example[b]['O'], (self.dO,))
+                                     for b in xrange(self._num_reads)]
+                bootstrap_output = [tf.reshape(tf.decode_raw(parsed_example[b]['output'], tf.uint8), (self.T, self.doutput))  for b in xrange(self._num_reads)]
                 bootstrap_len = [tf.reshape(parsed_example[b]['len'], ())
-                                 for b in xrange(self.num_bootstrap)]
+                                 for b in xrange(self._num_reads)]
                 inputs[i] = (fname,) + tuple(bootstrap_X_input + bootstrap_U_input + bootstrap_O_input + bootstrap_output + bootstrap_len)
 
-            shuffled = tf.train.shuffle_batch_join(
-                inputs,
-                batch_size=self.batch_size,
-                capacity=10*self.batch_size + 3 * self.batch_size,
-                min_after_dequeue=10*self.batch_size,
-                )
-            
-            fname_batch = shuffled[0]
-            bootstrap_X_inputs = shuffled[1:1+self.num_bootstrap]
-            bootstrap_U_inputs = shuffled[1+self.num_bootstrap:1+2*self.num_bootstrap]
-            bootstrap_O_inputs = shuffled[1+2*self.num_bootstrap:1+3*self.num_bootstrap]
-            bootstrap_outputs = shuffled[1+3*self.num_bootstrap:1+4*self.num_bootstrap]
-            bootstrap_lens = shuffled[1+4*self.num_bootstrap:1+5*self.num_bootstrap]
+            fname_batch, bootstrap_X_inputs, bootstrap_U_inputs, bootstrap_O_inputs, bootstrap_outputs, \
+                bootstrap_lens = self._graph_batch_join(inputs)
 
         return fname_batch, bootstrap_X_inputs, bootstrap_U_inputs, bootstrap_O_inputs, bootstrap_outputs,\
                bootstrap_lens, filename_queues, filename_vars
 
+    def _graph_inputs_outputs_from_file_window(self, name):
+        with tf.name_scope(name + '_file_input'):
+            filename_queues, filename_vars = self._graph_filename_queues(name)
+
+            ### read and decode whole trajectories
+            readers = [tf.TFRecordReader(), tf.TFRecordReader()]
+
+            features = {
+                'fname': tf.FixedLenFeature([], tf.string)
+            }
+
+            features['length'] = tf.FixedLenFeature([], tf.int64)
+            features['X'] = self._record_schema.feature('X')
+            features['U'] = self._record_schema.feature('U')
+            features['O'] = self._record_schema.feature('O')
+            features['output'] = tf.FixedLenFeature([], tf.string)
+            features['starts'] = tf.VarLenFeature(tf.int64)
+            features['len'] = tf.VarLenFeature(tf.int64)
+            inputs = [None, None]
+            for i, fq in enumerate(filename_queues):
+                parsed_example = tf.parse_single_example(readers[i].read(fq)[1], features=features)
+
+                length = tf.cast(parsed_example['length'], tf.int32)
+                X = self._record_schema.decode('X', parsed_example['X'], (length, self.dX))
+                U = self._record_schema.decode('U', parsed_example['U'], (length, self.dU))
+                O = self._record_schema.decode('O', parsed_example['O'], (length, self.dO))
+                output = tf.reshape(tf.decode_raw(parsed_example['output'], tf.uint8), (length, self.doutput))
+                starts = tf.cast(tf.sparse_tensor_to_dense(parsed_example['starts']), tf.int32)
+                lens = tf.sparse_tensor_to_dense(parsed_example['len'])
+
+                ### slice all windows out of the trajectory
+                window_idxs = tf.expand_dims(starts, 1) + tf.expand_dims(tf.range(self.T), 0)
+                windows = [
+                        tf.fill(tf.shape(starts), parsed_example['fname']),
+                        tf.gather(X, window_idxs),
+                        tf.gather(U, window_idxs),
+                        tf.gather(O, starts),
+                        tf.gather(output, window_idxs),
+                        lens
+                    ]
+
+                window_queue = tf.RandomShuffleQueue(
+                    capacity=10*self.batch_size + 3 * self.batch_size,
+                    min_after_dequeue=10*self.batch_size,
+                    dtypes=[tf.string, self._record_schema.tf_dtype('X'), self._record_schema.tf_dtype('U'),
+                            self._record_schema.tf_dtype('O'), tf.uint8, tf.int64],
+                    shapes=[(), (self.T, self.dX), (self.T, self.dU), (self.dO,), (self.T, self.doutput), ()])
+                tf.train.add_queue_runner(
+                    tf.train.QueueRunner(window_queue, [window_queue.enqueue_many(windows)]))
+
+                window_examples = [window_queue.dequeue() for b in xrange(self._num_reads)]
+                fname = window_examples[0][0]
+                bootstrap_X_input = [window_examples[b][1] for b in xrange(self._num_reads)]
+                bootstrap_U_input = [window_examples[b][2] for b in xrange(self._num_reads)]
+                bootstrap_O_input = [window_examples[b][3] for b in xrange(self._num_reads)]
+                bootstrap_output = [window_examples[b][4] for b in xrange(self._num_reads)]
+                bootstrap_len = [window_examples[b][5] for b in xrange(self._num_reads)]
+                inputs[i] = (fname,) + tuple(bootstrap_X_input + bootstrap_U_input + bootstrap_O_input + bootstrap_output + bootstrap_len)
+
+            fname_batch, bootstrap_X_inputs, bootstrap_U_inputs, bootstrap_O_inputs, bootstrap_outputs, \
+                bootstrap_lens = self._graph_batch_join(inputs)
+
+        return fname_batch, bootstrap_X_inputs, bootstrap_U_inputs, bootstrap_O_inputs, bootstrap_outputs,\
+               bootstrap_lens, filename_queues, filename_vars
+
+    def _graph_inputs_outputs_from_replay(self, name):
+        """
+        Batches are sampled in numpy and fed into a staging queue of capacity 2,
+        so the next batch is enqueued while the current one is used (see _run_batch)
+        """
+        with tf.name_scope(name + '_replay_input'):
+            dtypes = [tf.string, self._record_schema.tf_dtype('X'), self._record_schema.tf_dtype('U'),
+                      self._record_schema.tf_dtype('O'), tf.uint8, tf.int64]
+            shapes = [
+                    (self.batch_size,),
+                    (self._num_reads, self.batch_size, self.T, self.dX),
+                    (self._num_reads, self.batch_size, self.T, self.dU),
+                    (self._num_reads, self.batch_size, self.dO),
+                    (self._num_reads, self.batch_size, self.T, self.doutput),
+                    (self._num_reads, self.batch_size)
+                ]
+            staging_phs = [tf.placeholder(dtype, shape) for dtype, shape in zip(dtypes, shapes)]
+            staging_queue = tf.FIFOQueue(capacity=2, dtypes=dtypes, shapes=shapes)
+            staging_enqueue = staging_queue.enqueue(staging_phs)
+
+            fname_batch, X_inputs, U_inputs, O_inputs, outputs, lens = staging_queue.dequeue()
+            bootstrap_X_inputs = tf.unstack(X_inputs, num=self._num_reads)
+            bootstrap_U_inputs = tf.unstack(U_inputs, num=self._num_reads)
+            bootstrap_O_inputs = tf.unstack(O_inputs, num=self._num_reads)
+            bootstrap_outputs = tf.unstack(outputs, num=self._num_reads)
+            bootstrap_lens = tf.unstack(lens, num=self._num_reads)
+
+        return fname_batch, self._reads_to_bootstraps(bootstrap_X_inputs), self._reads_to_bootstraps(bootstrap_U_inputs), \
+               self._reads_to_bootstraps(bootstrap_O_inputs), self._reads_to_bootstraps(bootstrap_outputs), \
+               self._reads_to_bootstraps(bootstrap_lens), staging_enqueue, staging_phs
+
+    def _graph_inference_from_placeholders(self, name):
+        """
+        Every bootstrap is evaluated on the same fixed size batch, so one run covers all of them.
+        Batch norm uses the moving statistics, so the padding of the last batch does not change the outputs
+        :return: X, U, O placeholders and the output mats of each bootstrap
+        """
+        batch_size = params['model'].get('val_batch_size', 1024)
+        with tf.variable_scope(name + '_feed_input'):
+            X_inputs = tf.placeholder(self._record_schema.tf_dtype('X'), [batch_size, self.T, self.dX])
+            U_inputs = tf.placeholder(self._record_schema.tf_dtype('U'), [batch_size, self.T, self.dU])
+            O_inputs = tf.placeholder(self._record_schema.tf_dtype('O'), [batch_size, self.dO])
+        output_mats = self._graph_inference(
+            name,
+            [X_inputs] * self.num_bootstrap,
+            [U_inputs] * self.num_bootstrap,
+            [O_inputs] * self.num_bootstrap,
+            reuse=True,
+            is_training=False)
+        return X_inputs, U_inputs, O_inputs, output_mats
+
     def _graph_inputs_from_placeholders(self):
         with tf.variable_scope('feed_input'):
             X_inputs = tf.placeholder(self.dtype, [None, self.T, self.dX])
@@ -507,6 +981,29 @@ class ProbcollModel:
             O_input = tf.placeholder(self.dtype, [1, self.dO])
         return X_inputs, U_inputs, O_input
 
+    def _graph_observation_images(self, observation):
+        """
+        :param observation: ... x batch x dO
+        :return: ... x batch x height x width x channels of all devices
+        """
+        shape = observation.get_shape().as_list()
+        obs_float = tf.cast(observation, self.dtype) / 255.
+        if params['model']['center_O']:
+            obs_float = obs_float - tf.reduce_mean(obs_float, axis=len(shape)-2, keep_dims=True)
+        num_devices = len(params['model']['O_order'])
+        obss = tf.split(len(shape)-1, num_devices, obs_float)
+        obs_shaped_list = []
+        for obs, device in zip(obss, params['model']['O_order']):
+            obs_shaped = tf.reshape(
+                obs,
+                shape[:-1] + [
+                    params["O"][device]["height"],
+                    params["O"][device]["width"],
+                    params["O"][device]["num_channels"]
+                ])
+            obs_shaped_list.append(obs_shaped)
+        return tf.concat(len(shape)+1, obs_shaped_list)
+
     def get_embedding(self, observation, batch_size=1, reuse=False, scope=None, is_training=True):
         
         obg_type = params["model"]["image_graph"]["graph_type"]
@@ -521,25 +1018,9 @@ class ProbcollModel:
         obs_batch = observation.get_shape()[0].value
         # TODO if batch size is 1 then clearly not training
         is_training = is_training and obs_batch != 1
-        obs_float = tf.cast(observation, self.dtype) / 255.
-        if params['model']['center_O']:
-            obs_float = obs_float - tf.reduce_mean(obs_float, axis=0)
-        num_devices = len(params['model']['O_order'])
-        obss = tf.split(1, num_devices, obs_float)
-        obs_shaped_list = []
-        for obs, device in zip(obss, params['model']['O_order']):
-            obs_shaped = tf.reshape(
-                obs,
-                [
-                    obs_batch,
-                    params["O"][device]["height"],
-                    params["O"][device]["width"],
-                    params["O"][device]["num_channels"]
-                ])
-            obs_shaped_list.append(obs_shaped)
         # TODO dropout
         im_output, _ = observation_graph(
-            tf.concat(3, obs_shaped_list),
+            self._graph_observation_images(observation),
             params['model']['image_graph'],
             dtype=self.dtype,
             scope=scope,
@@ -561,8 +1042,15 @@ class ProbcollModel:
    
     def _graph_inference(
             self, name, bootstrap_X_inputs, bootstrap_U_inputs, bootstrap_O_inputs,
-            reuse=False, finalize=True, tf_debug={}):
+            reuse=False, finalize=True, tf_debug={}, is_training=True):
+        """
+        :param is_training: False runs batch norm with the moving statistics
+        """
         assert(name == 'train' or name == 'val')
+        if self.ensemble_mode == 'fused':
+            return self._graph_inference_fused(
+                name, bootstrap_X_inputs, bootstrap_U_inputs, bootstrap_O_inputs, reuse=reuse,
+                is_training=is_training)
         num_bootstrap = params['model']['num_bootstrap']
 
         bootstrap_output_mats = []
@@ -585,6 +1073,10 @@ class ProbcollModel:
         with tf.name_scope(name + '_inference'):
             tf.set_random_seed(self.random_seed)
 
+            if self.shared_trunk and self.dO > 0:
+                shared_initial_states = self._get_shared_embeddings(bootstrap_O_inputs, reuse=reuse,
+                                                                    is_training=is_training)
+
             for b in xrange(num_bootstrap):
                 ### inputs
                 x_input_b = bootstrap_X_inputs[b]
@@ -620,11 +1112,15 @@ class ProbcollModel:
                     
                     
                     if self.dO > 0:
-                        initial_state = self.get_embedding(
-                            o_input_b,
-                            batch_size=batch_size,
-                            reuse=reuse,
-                            scope="observation_graph_b{0}".format(b))
+                        if self.shared_trunk:
+                            initial_state = shared_initial_states[b]
+                        else:
+                            initial_state = self.get_embedding(
+                                o_input_b,
+                                batch_size=batch_size,
+                                reuse=reuse,
+                                scope="observation_graph_b{0}".format(b),
+                                is_training=is_training)
 
                         if not recurrent:
                             concat_list.append(initial_state)
@@ -689,6 +1185,9 @@ class ProbcollModel:
     def graph_eval_inference(
             self, X_input, U_input, O_input=None, bootstrap_initial_states=None,
             reuse=False, finalize=True, tf_debug={}):
+        if self.ensemble_mode == 'fused':
+            return self._graph_eval_inference_fused(
+                X_input, U_input, O_input=O_input, bootstrap_initial_states=bootstrap_initial_states, reuse=reuse)
         
         bootstrap_output_mats = []
         bootstrap_output_preds = []
@@ -742,6 +1241,9 @@ class ProbcollModel:
                     u_input_flat_b = tf.reshape(u_input_b, [batch_size, self.T * self.dU])
                 
                 base_concat_list.append(u_input_flat_b)
+
+            if self.shared_trunk and not given_initial_states and self.dO > 0:
+                shared_initial_state = self._get_shared_embedding(o_input_b, batch_size=batch_size, reuse=reuse)
             
             for b in xrange(num_bootstrap):
                 concat_list = copy.copy(base_concat_list)
@@ -759,11 +1261,14 @@ class ProbcollModel:
                         if not recurrent:
                             concat_list.append(initial_state)
                     elif self.dO > 0:
-                        initial_state = self.get_embedding(
-                            o_input_b,
-                            batch_size=batch_size,
-                            reuse=reuse,
-                            scope="observation_graph_b{0}".format(b))
+                        if self.shared_trunk:
+                            initial_state = shared_initial_state
+                        else:
+                            initial_state = self.get_embedding(
+                                o_input_b,
+                                batch_size=batch_size,
+                                reuse=reuse,
+                                scope="observation_graph_b{0}".format(b))
 
                         if not recurrent:
                             concat_list.append(initial_state)
@@ -846,20 +1351,374 @@ class ProbcollModel:
                 bootstrap_output_mats.append(output_mat_b)
                 bootstrap_output_preds.append(output_pred_b)
 
+            ### combination of all the bootstraps
+            output_pred_mean, output_pred_std, output_mat_mean, output_mat_std = \
+                self._graph_combine_bootstraps(bootstrap_output_mats, bootstrap_output_preds)
+
+        return output_pred_mean, output_pred_std, output_mat_mean, output_mat_std
+
+    def _graph_combine_bootstraps(self, bootstrap_output_mats, bootstrap_output_preds):
+        num_bootstrap = len(bootstrap_output_mats)
+        with tf.name_scope('combine_bootstraps'):
+            output_pred_mean = (1. / num_bootstrap) * tf.add_n(bootstrap_output_preds, name='output_pred_mean')
+            std_normalize = (1. / (num_bootstrap - 1)) if num_bootstrap > 1 else 1
+            output_pred_std = tf.sqrt(std_normalize * tf.add_n(
+                [tf.square(tf.sub(output_pred_b, output_pred_mean)) for output_pred_b in bootstrap_output_preds]))
+
+            output_mat_mean = (1. / num_bootstrap) * tf.add_n(bootstrap_output_mats, name='output_mat_mean')
+            output_mat_std = tf.sqrt(std_normalize * tf.add_n(
+                [tf.square(tf.sub(output_mat_b, output_mat_mean)) for output_mat_b in bootstrap_output_mats]))
+
+        return output_pred_mean, output_pred_std, output_mat_mean, output_mat_std
+
+    def graph_eval_inference_segment(self, U_input, bootstrap_states, reuse=True):
+        """
+        Runs the action and output graphs of every bootstrap over a segment of the horizon,
+        so a sequence can be evaluated in segments that share the state of their prefix.
+        Only for rnn action graphs in separate ensemble mode, without X inputs or dropout.
+        :param U_input: batch x segment length x dU
+        :param bootstrap_states: list of initial states, the embeddings (get_bootstrap_embeddings)
+                                 or the states returned for the previous segment
+        :return: list of output mats (batch x segment length x doutput), list of final states
+        """
+        assert(params['model']['action_graph']['graph_type'] == 'rnn')
+        assert(self.ensemble_mode == 'separate' and self.dX == 0 and self.dropout is None)
+        batch_size = tf.shape(U_input)[0]
+        segment_len = U_input.get_shape()[1].value
+
+        bootstrap_output_mats = []
+        bootstrap_final_states = []
+        with tf.name_scope('eval_inference_segment'):
+            control_mean = (np.array(params['model']['control_range']['lower']) + \
+                np.array(params['model']['control_range']['upper']))/2.
+            control_width = (np.array(params['model']['control_range']['upper']) - \
+                control_mean)
+            u_input = tf.cast((U_input - control_mean) / control_width, self.dtype)
+            u_input = tf.reshape(u_input, [batch_size, segment_len, self.dU])
+
+            for b in xrange(self.num_bootstrap):
+                with tf.name_scope('inputs_b{0}'.format(b)):
+                    ag_output, _, final_state = rnn(
+                        inputs=u_input,
+                        initial_state=bootstrap_states[b],
+                        params=params["model"]["action_graph"],
+                        dtype=self.dtype,
+                        scope="action_graph_b{0}".format(b),
+                        reuse=reuse,
+                        return_final_state=True)
+                    ag_output = tf.reshape(
+                        ag_output,
+                        (batch_size * segment_len, int(ag_output.get_shape()[-1])))
+
+                    params["model"]["output_graph"]["output_dim"] = self.doutput
+                    params["model"]["output_graph"]["dropout"] = None
+                    output_mat_b, _ = fcnn(
+                        ag_output,
+                        params["model"]["output_graph"],
+                        dtype=self.dtype,
+                        scope="output_graph_b{0}".format(b),
+                        reuse=reuse)
+                    output_mat_b = tf.reshape(output_mat_b, [batch_size, segment_len, self.doutput])
+
+                bootstrap_output_mats.append(output_mat_b)
+                bootstrap_final_states.append(final_state)
+
+        return bootstrap_output_mats, bootstrap_final_states
+
+    def graph_eval_inference_from_segments(self, bootstrap_output_mats):
+        """
+        Same outputs as graph_eval_inference from the output mats of whole sequences
+        assembled from graph_eval_inference_segment
+        :param bootstrap_output_mats: list of batch x T x doutput
+        """
+        bootstrap_output_mats = list(bootstrap_output_mats)
+        bootstrap_output_preds = []
+        with tf.name_scope('eval_inference_from_segments'):
+            for b, output_mat_b in enumerate(bootstrap_output_mats):
+                if params["model"]["prob_coll_strictly_increasing"]:
+                    batch_size = tf.shape(output_mat_b)[0]
+                    output_mat_b = tf.reshape(output_mat_b, (batch_size, self.T))
+                    output_mat_b = tf_utils.cumulative_increasing_sum(
+                        output_mat_b,
+                        self.dtype)
+                    output_mat_b = tf.reshape(output_mat_b, (batch_size, self.T, self.doutput))
+                    bootstrap_output_mats[b] = output_mat_b
+                bootstrap_output_preds.append(tf.sigmoid(output_mat_b, name='output_pred_b{0}'.format(b)))
+
+            return self._graph_combine_bootstraps(bootstrap_output_mats, bootstrap_output_preds)
+
+    def get_bootstrap_embeddings(self, observation, batch_size=1, reuse=False):
+        """
+        Observation embedding of every bootstrap, to pass as bootstrap_initial_states to graph_eval_inference
+        :return: list of batch_size x embedding, or num_bootstrap x batch_size x embedding if fused
+        """
+        if self.ensemble_mode == 'fused':
+            return self._get_fused_embedding(observation, batch_size=batch_size, reuse=reuse)
+        if self.shared_trunk:
+            return [self._get_shared_embedding(observation, batch_size=batch_size, reuse=reuse)] * self.num_bootstrap
+        return [
+            self.get_embedding(
+                observation,
+                batch_size=batch_size,
+                reuse=reuse,
+                scope="observation_graph_b{0}".format(b)) for b in xrange(self.num_bootstrap)
+        ]
+
+    def _get_shared_embedding(self, observation, batch_size=1, reuse=False, is_training=True):
+        """ get_embedding with the observation graph shared by all bootstraps """
+        return self.get_embedding(
+            observation,
+            batch_size=batch_size,
+            reuse=reuse,
+            scope="observation_graph_shared",
+            is_training=is_training)
+
+    def _get_shared_embeddings(self, bootstrap_O_inputs, reuse=False, is_training=True):
+        """
+        Runs the shared observation graph once on the observations of all bootstraps
+        (normalization statistics are over all of them)
+        :return: list of embeddings, one per bootstrap
+        """
+        num_bootstrap = len(bootstrap_O_inputs)
+        with tf.name_scope('inputs_shared'):
+            if all(O is bootstrap_O_inputs[0] for O in bootstrap_O_inputs):
+                # e.g. online bootstrap, every bootstrap sees the same images
+                embedding = self._get_shared_embedding(bootstrap_O_inputs[0], reuse=reuse, is_training=is_training)
+                return [embedding] * num_bootstrap
+            embeddings = self._get_shared_embedding(tf.concat(0, bootstrap_O_inputs), reuse=reuse,
+                                                    is_training=is_training)
+            return tf.split(0, num_bootstrap, embeddings)
+
+    ######################
+    ### Fused ensemble ###
+    ######################
+
+    def _get_fused_embedding(self, observation, batch_size=1, reuse=False, is_training=True):
+        """
+        Same as get_embedding for all bootstraps at once
+        :param observation: batch x dO shared by all bootstraps, or num_bootstrap x batch x dO
+        :return: num_bootstrap x batch_size x embedding
+        """
+        if self.shared_trunk:
+            if len(observation.get_shape()) == 2:
+                embedding = self._get_shared_embedding(
+                    observation, batch_size=batch_size, reuse=reuse, is_training=is_training)
+                return tf.tile(tf.expand_dims(embedding, 0), [self.num_bootstrap, 1, 1])
+            shape = observation.get_shape().as_list()
+            embeddings = self._get_shared_embedding(
+                tf.reshape(observation, [shape[0] * shape[1], shape[2]]), reuse=reuse, is_training=is_training)
+            return tf.reshape(embeddings, [shape[0], shape[1], embeddings.get_shape()[-1].value])
+
+        if params["model"]["image_graph"]["graph_type"] != "cnn":
+            raise NotImplementedError("Fused ensemble requires a cnn image graph")
+
+        shared_input = len(observation.get_shape()) == 2
+        obs_batch = observation.get_shape()[-2].value
+        # TODO if batch size is 1 then clearly not training
+        is_training = is_training and obs_batch != 1
+        im_output = ensemble.fused_convnn(
+            self._graph_observation_images(observation),
+            params['model']['image_graph'],
+            self.num_bootstrap,
+            shared_input=shared_input,
+            dtype=self.dtype,
+            scope=ensemble.fused_scope("observation_graph"),
+            reuse=reuse,
+            is_training=is_training)
+        output = ensemble.fused_fcnn(
+            ensemble.channels_to_heads(im_output, self.num_bootstrap),
+            params['model']['observation_graph'],
+            self.num_bootstrap,
+            dtype=self.dtype,
+            scope=ensemble.fused_scope("observation_graph"),
+            reuse=reuse)
+        if obs_batch == 1 and batch_size != 1:
+            output = tf.tile(output, [1, batch_size, 1])
+        return output
+
+    def _graph_fused_heads(self, X, U, initial_states=None, reuse=False):
+        """
+        Action and output graphs of all bootstraps at once
+        :param X: num_bootstrap x batch x T x dX
+        :param U: num_bootstrap x batch x T x dU
+        :param initial_states: num_bootstrap x batch x embedding
+        :return: output mats num_bootstrap x batch x T x doutput
+        """
+        num_bootstrap = self.num_bootstrap
+        ag_type = params["model"]["action_graph"]["graph_type"]
+        if ag_type == "fc":
+            recurrent = False
+        elif ag_type == "rnn":
+            recurrent = True
+        else:
+            raise NotImplementedError(
+                "Action graph {0} is not valid".format(ag_type))
+
+        if recurrent:
+            assert(initial_states is not None)
+
+        batch_size = tf.shape(U)[1]
+
+        concat_list = []
+        if self.dX > 0:
+            if recurrent:
+                concat_list.append(tf.cast(X, self.dtype))
+            else:
+                concat_list.append(tf.reshape(tf.cast(X, self.dtype), [num_bootstrap, batch_size, self.T * self.dX]))
+
+        if self.dU > 0:
+            control_mean = (np.array(params['model']['control_range']['lower']) + \
+                np.array(params['model']['control_range']['upper']))/2.
+            control_width = (np.array(params['model']['control_range']['upper']) - \
+                control_mean)
+            U = tf.cast((U - control_mean) / control_width, self.dtype)
+            if recurrent:
+                concat_list.append(U)
+            else:
+                concat_list.append(tf.reshape(U, [num_bootstrap, batch_size, self.T * self.dU]))
+
+        if recurrent:
+            ag_output = ensemble.fused_rnn(
+                tf.concat(3, concat_list),
+                params["model"]["action_graph"],
+                num_bootstrap,
+                initial_state=initial_states,
+                dtype=self.dtype,
+                scope=ensemble.fused_scope("action_graph"),
+                reuse=reuse)
+            ag_output = tf.reshape(
+                ag_output,
+                (num_bootstrap, batch_size * self.T, int(ag_output.get_shape()[-1])))
+        else:
+            if initial_states is not None:
+                concat_list.append(initial_states)
+            ag_output = ensemble.fused_fcnn(
+                tf.concat(2, concat_list),
+                params["model"]["action_graph"],
+                num_bootstrap,
+                dtype=self.dtype,
+                scope=ensemble.fused_scope("action_graph"),
+                reuse=reuse)
+            ag_output = tf.reshape(
+                ag_output,
+                (num_bootstrap, batch_size * self.T, int(ag_output.get_shape()[-1])//self.T))
+
+        params["model"]["output_graph"]["output_dim"] = self.doutput
+        params["model"]["output_graph"]["dropout"] = None
+        output_mats = ensemble.fused_fcnn(
+            ag_output,
+            params["model"]["output_graph"],
+            num_bootstrap,
+            dtype=self.dtype,
+            scope=ensemble.fused_scope("output_graph"),
+            reuse=reuse)
+
+        output_mats = tf.reshape(output_mats, [num_bootstrap, batch_size, self.T, self.doutput])
+        # TODO not general because it assumes doutput = 1
+        if params["model"]["prob_coll_strictly_increasing"]:
+            output_mats = tf.reshape(output_mats, (num_bootstrap * batch_size, self.T))
+            output_mats = tf_utils.cumulative_increasing_sum(
+                output_mats,
+                self.dtype)
+            output_mats = tf.reshape(output_mats, (num_bootstrap, batch_size, self.T, self.doutput))
+
+        return output_mats
+
+    def _graph_inference_fused(self, name, bootstrap_X_inputs, bootstrap_U_inputs, bootstrap_O_inputs, reuse=False,
+                               is_training=True):
+        """ Same as _graph_inference with the weights of all bootstraps stacked """
+        with tf.name_scope(name + '_inference'):
+            tf.set_random_seed(self.random_seed)
+
+            with tf.name_scope('inputs'):
+                X = tf.stack(bootstrap_X_inputs)
+                U = tf.stack(bootstrap_U_inputs)
+                batch_size = tf.shape(U)[1]
+                initial_states = None
+                if self.dO > 0:
+                    if all(O is bootstrap_O_inputs[0] for O in bootstrap_O_inputs):
+                        # e.g. online bootstrap, every bootstrap sees the same images
+                        observation = bootstrap_O_inputs[0]
+                    else:
+                        observation = tf.stack(bootstrap_O_inputs)
+                    initial_states = self._get_fused_embedding(observation, batch_size=batch_size, reuse=reuse,
+                                                               is_training=is_training)
+
+            output_mats = self._graph_fused_heads(X, U, initial_states=initial_states, reuse=reuse)
+
+        return tf.unstack(output_mats)
+
+    def _graph_eval_inference_fused(self, X_input, U_input, O_input=None, bootstrap_initial_states=None, reuse=False):
+        """ Same as graph_eval_inference with the weights of all bootstraps stacked """
+        num_bootstrap = self.num_bootstrap
+        batch_size = tf.shape(U_input)[0]
+
+        def tile_batch(initial_state):
+            if initial_state.get_shape()[-2].value == 1:
+                multiples = [1] * (len(initial_state.get_shape()) - 2) + [batch_size, 1]
+                initial_state = tf.tile(initial_state, multiples)
+            return initial_state
+
+        with tf.name_scope('eval_inference'):
+            tf.set_random_seed(self.random_seed)
+
+            if bootstrap_initial_states is not None:
+                if isinstance(bootstrap_initial_states, list):
+                    initial_states = tf.stack([tile_batch(s) for s in bootstrap_initial_states])
+                elif len(bootstrap_initial_states.get_shape()) == 3:
+                    initial_states = tile_batch(bootstrap_initial_states)
+                else:
+                    initial_states = tf.tile(
+                        tf.expand_dims(tile_batch(bootstrap_initial_states), 0),
+                        [num_bootstrap, 1, 1])
+            elif self.dO > 0:
+                initial_states = self._get_fused_embedding(O_input, batch_size=batch_size, reuse=reuse)
+            else:
+                initial_states = None
+
+            X = tf.tile(tf.expand_dims(X_input, 0), [num_bootstrap, 1, 1, 1])
+            U = tf.tile(tf.expand_dims(U_input, 0), [num_bootstrap, 1, 1, 1])
+            output_mats = self._graph_fused_heads(X, U, initial_states=initial_states, reuse=reuse)
+            output_preds = tf.sigmoid(output_mats)
+
             ### combination of all the bootstraps
             with tf.name_scope('combine_bootstraps'):
-                output_pred_mean = (1. / num_bootstrap) * tf.add_n(bootstrap_output_preds, name='output_pred_mean')
                 std_normalize = (1. / (num_bootstrap - 1)) if num_bootstrap > 1 else 1
-                output_pred_std = tf.sqrt(std_normalize * tf.add_n(
-                    [tf.square(tf.sub(output_pred_b, output_pred_mean)) for output_pred_b in bootstrap_output_preds]))
+                output_pred_mean = tf.reduce_mean(output_preds, axis=0, name='output_pred_mean')
+                output_pred_std = tf.sqrt(std_normalize * tf.reduce_sum(
+                    tf.square(output_preds - output_pred_mean), axis=0))
 
-                output_mat_mean = (1. / num_bootstrap) * tf.add_n(bootstrap_output_mats, name='output_mat_mean')
-                output_mat_std = tf.sqrt(std_normalize * tf.add_n(
-                    [tf.square(tf.sub(output_mat_b, output_mat_mean)) for output_mat_b in bootstrap_output_mats]))
+                output_mat_mean = tf.reduce_mean(output_mats, axis=0, name='output_mat_mean')
+                output_mat_std = tf.sqrt(std_normalize * tf.reduce_sum(
+                    tf.square(output_mats - output_mat_mean), axis=0))
 
         return output_pred_mean, output_pred_std, output_mat_mean, output_mat_std
     
-    def _graph_cost(self, name, bootstrap_output_mats, bootstrap_outputs, bootstrap_lengths, reg=0.):
+    def _graph_bootstrap_weights(self):
+        """
+        Per example weights for online bootstrapping, so each bootstrap sees a different
+        resample of the shared batch
+        :return: list of (batch_size,) weights for each bootstrap
+        """
+        with tf.name_scope('bootstrap_weights'):
+            if self.bootstrap_weights == 'poisson':
+                # Poisson(1) counts by inverting the cdf of a uniform sample
+                max_count = 12
+                pmf = np.exp(-1.) / np.cumprod([1.] + range(1, max_count))
+                cdf = tf.constant(np.cumsum(pmf), dtype=self.dtype)
+                uniform = tf.random_uniform((self.num_bootstrap, self.batch_size, 1), dtype=self.dtype)
+                weights = tf.reduce_sum(tf.cast(tf.greater(uniform, cdf), self.dtype), axis=2)
+            elif self.bootstrap_weights == 'multinomial':
+                # counts of batch_size draws with replacement from the batch
+                draws = tf.multinomial(tf.zeros((self.num_bootstrap, self.batch_size)), self.batch_size)
+                weights = tf.reduce_sum(tf.one_hot(draws, self.batch_size, dtype=self.dtype), axis=1)
+            else:
+                raise Exception('{0} is not valid bootstrap weights'.format(self.bootstrap_weights))
+
+        return tf.unstack(weights, num=self.num_bootstrap)
+
+    def _graph_cost(self, name, bootstrap_output_mats, bootstrap_outputs, bootstrap_lengths, reg=0.,
+                    bootstrap_weights=None):
         with tf.name_scope(name + '_cost_and_err'):
             costs = []
             num_coll = 0
@@ -896,6 +1755,8 @@ class ProbcollModel:
                 with tf.name_scope('cost_b{0}'.format(b)):
                     cross_entropy_b = tf.nn.sigmoid_cross_entropy_with_logits(output_mat_b, output_b)
                     masked_cross_entropy_b = cross_entropy_b * mask
+                    if bootstrap_weights is not None:
+                        masked_cross_entropy_b *= tf.reshape(bootstrap_weights[b], (-1, 1, 1))
 #                    costs.append(tf.reduce_sum(masked_cross_entropy_b) / 
 #                        tf.cast(tf.reduce_sum(length_b), self.dtype))
                     costs.append(tf.reduce_mean(masked_cross_entropy_b))
@@ -951,6 +1812,16 @@ class ProbcollModel:
                 optimizers.append(opt.apply_gradients(grad))
             grads += grad
 
+            if self.data_parallel_workers > 1:
+                # gradients are computed and applied in separate runs, averaged in between
+                grad = [(g, var) for g, var in grad if g is not None]
+                with tf.control_dependencies(update_ops):
+                    dp_grads = [tf.identity(tf.convert_to_tensor(g)) for g, _ in grad]
+                dp_grad_phs = [tf.placeholder(var.dtype.base_dtype, var.get_shape()) for _, var in grad]
+                dp_apply = opt.apply_gradients(zip(dp_grad_phs, [var for _, var in grad]))
+                self.d_train['dp_grads'], self.d_train['dp_grad_phs'], self.d_train['dp_apply'] = \
+                    dp_grads, dp_grad_phs, dp_apply
+
         vars_after = tf.global_variables()
         optimizer_vars = list(set(vars_after).difference(set(vars_before)))
 
@@ -974,26 +1845,99 @@ class ProbcollModel:
                 coll_queue.dequeue_up_to(10*self.batch_size)
             ]
 
+    def _graph_weight_swap(self, include_optimizer=False, name='weight_swap'):
+        """
+        :param include_optimizer: also the optimizer variables (slots and beta powers)
+        :return: variables needed for inference (no optimizer slots), their placeholders
+                 and one op assigning all of them
+        """
+        inference_vars = dict()
+        var_list = tf.trainable_variables() + tf.get_collection(tf.GraphKeys.MODEL_VARIABLES)
+        if include_optimizer:
+            var_list += self.d_train['optimizer_vars']
+        for var in var_list:
+            inference_vars[var.op.name] = var
+        inference_vars = [inference_vars[k] for k in sorted(inference_vars.keys())]
+        with tf.name_scope(name):
+            phs = [tf.placeholder(var.dtype.base_dtype, var.get_shape()) for var in inference_vars]
+            weight_swap = tf.group(*[tf.assign(var, ph) for var, ph in zip(inference_vars, phs)])
+        return inference_vars, phs, weight_swap
+
     def _graph_init_vars(self):
         self.sess.run(
             self._initializer)
+        self._session_model_file = None
 
     def _graph_setup(self):
         """ Only call once """
 
         tf.reset_default_graph()
 
+        start = time.time()
+        graph_cache = GraphCache(self._graph_cache_dir, self._graph_cache_key) \
+            if params['model'].get('graph_cache', False) else None
+        if graph_cache is not None and graph_cache.exists():
+            handles = graph_cache.load()
+            # python state the ensemble layers register while building, needed to load checkpoints
+            ensemble.HEAD_LAYOUTS.update(handles.pop('head_layouts'))
+            for name, value in handles.items():
+                setattr(self, name, value)
+            cached = True
+        else:
+            attrs_before = dict(self.__dict__)
+            self._graph_build()
+            if graph_cache is not None:
+                # everything _graph_build set on self is graph elements, exported to import next time
+                handles = dict([(name, value) for name, value in self.__dict__.items()
+                                if name not in attrs_before or attrs_before[name] is not value])
+                handles['head_layouts'] = dict(ensemble.HEAD_LAYOUTS)
+                try:
+                    graph_cache.export(handles)
+                except Exception as e:
+                    self._logger.warning('Could not cache graph: {0}'.format(e))
+            cached = False
+        graph_time = time.time() - start
+        self._logger.info('{0} graph in {1:.2f}s'.format('Imported cached' if cached else 'Built', graph_time))
+        self._telemetry.write('graph_setup', time=graph_time, cached=cached)
+
+        ### python state using the graph
+        for name, d in (('train', self.d_train), ('val', self.d_val)):
+            if self.data_source == 'replay':
+                d['replay_data'] = ReplayData(
+                    self,
+                    name,
+                    params['model'].get('replay_capacity', 200000),
+                    pct_coll=self.pct_coll,
+                    recency_decay=params['model'].get('recency_decay', None))
+                d['staged'] = False
+        # only the chief (rank 0) validates
+        if self.val_mode == 'cached' and self.data_parallel_rank == 0:
+            self._val_cache = ValidationCache(self, max_windows=params['model'].get('val_max_windows', None))
+
+        self._graph_session_setup()
+
+    def _graph_build(self):
+        """ Builds the graph, only sets graph elements on self (see _graph_setup) """
         self.d_train = dict()
         self.d_val = dict()
         self.d_eval = dict()
 
         ### prepare for training
         for i, (name, d) in enumerate((('train', self.d_train), ('val', self.d_val))):
-            d['fnames'], d['X_inputs'], d['U_inputs'], d['O_inputs'], d['outputs'], d['len'], \
-            queues, queue_vars = self._graph_inputs_outputs_from_file(name)
-            d['no_coll_queue'], d['coll_queue'] = queues
-            d['no_coll_dequeue'], d['coll_dequeue'] = self._graph_dequeue(*queues)
-            d['no_coll_queue_var'], d['coll_queue_var'] = queue_vars
+            if self.data_source == 'queue':
+                d['fnames'], d['X_inputs'], d['U_inputs'], d['O_inputs'], d['outputs'], d['len'], \
+                queues, queue_vars = self._graph_inputs_outputs_from_file(name)
+                d['no_coll_queue'], d['coll_queue'] = queues
+                d['no_coll_dequeue'], d['coll_dequeue'] = self._graph_dequeue(*queues)
+                d['no_coll_queue_var'], d['coll_queue_var'] = queue_vars
+                # the batch queue is the input of the op dequeuing the batch, only its size is used
+                batch_queue = tf.QueueBase([d['fnames'].dtype], None, None, d['fnames'].op.inputs[0])
+                d['queue_sizes'] = [batch_queue.size(), d['no_coll_queue'].size(), d['coll_queue'].size()]
+            elif self.data_source == 'replay':
+                d['fnames'], d['X_inputs'], d['U_inputs'], d['O_inputs'], d['outputs'], d['len'], \
+                d['staging_enqueue'], d['staging_phs'] = self._graph_inputs_outputs_from_replay(name)
+            else:
+                raise Exception('{0} is not valid data source'.format(self.data_source))
             d['output_mats'] = self._graph_inference(
                 name,
                 d['X_inputs'],
@@ -1001,11 +1945,22 @@ class ProbcollModel:
                 d['O_inputs'],
                 reuse=i>0,
                 tf_debug=self.tf_debug)
+            if name == 'train' and self.bootstrap_mode == 'online':
+                d['bootstrap_weights'] = self._graph_bootstrap_weights()
+                d['bootstrap_weight_sums'] = [tf.reduce_sum(w) for w in d['bootstrap_weights']]
+            else:
+                d['bootstrap_weights'] = None
             d['bootstraps_cost'], d['reg_cost'], d['cost'], d['cross_entropy'], d['err'], d['err_coll'], d['err_nocoll'], d['num_coll'], d['num_nocoll'] = \
-                self._graph_cost(name, d['output_mats'], d['outputs'], d['len'], reg=self.reg)
+                self._graph_cost(name, d['output_mats'], d['outputs'], d['len'], reg=self.reg,
+                                 bootstrap_weights=d['bootstrap_weights'])
         ### optimizer
         self.d_train['optimizer'], self.d_train['grads'], self.d_train['optimizer_vars'] = \
             self._graph_optimize(self.d_train['bootstraps_cost'], self.d_train['reg_cost'])
+        ### swapping in inference weights
+        self._inference_vars, self._weight_swap_phs, self._weight_swap = self._graph_weight_swap()
+        if self.data_parallel_workers > 1:
+            self._dp_vars, self._dp_var_phs, self._dp_var_assign = \
+                self._graph_weight_swap(include_optimizer=True, name='data_parallel_assign')
 
         ### prepare for eval
         self.d_eval['X_inputs'], self.d_eval['U_inputs'], self.d_eval['O_input'] = self._graph_inputs_from_placeholders()
@@ -1017,10 +1972,19 @@ class ProbcollModel:
                 self.d_eval['O_input'],
                 reuse=True)
 
+        ### cached validation
+        if self.val_mode == 'cached':
+            self.d_val_cached = dict()
+            self.d_val_cached['X_inputs'], self.d_val_cached['U_inputs'], self.d_val_cached['O_inputs'], \
+            self.d_val_cached['output_mats'] = self._graph_inference_from_placeholders('val')
+
         ### queues
-        self._graph_queue_update()
+        if self.data_source == 'queue':
+            self._graph_queue_update()
         ### initialize
         self._initializer = [tf.local_variables_initializer(), tf.global_variables_initializer()]
+
+    def _graph_session_setup(self):
         os.environ["CUDA_VISIBLE_DEVICES"] = str(self.device)
         gpu_options = tf.GPUOptions(per_process_gpu_memory_fraction=self.gpu_fraction)
         config = tf.ConfigProto(
@@ -1029,6 +1993,12 @@ class ProbcollModel:
             allow_soft_placement=True)
         # config.intra_op_parallelism_threads = 1
         # config.inter_op_parallelism_threads = 1
+        if self.data_parallel_workers > 1:
+            # split the cores between the processes
+            num_threads = params['model'].get('data_parallel_threads', None) or \
+                max(multiprocessing.cpu_count() // self.data_parallel_workers, 1)
+            config.intra_op_parallelism_threads = num_threads
+            config.inter_op_parallelism_threads = num_threads
         self.sess = tf.Session(config=config)
         self.coord = tf.train.Coordinator()
         self._graph_init_vars()
@@ -1039,6 +2009,14 @@ class ProbcollModel:
             os.path.join('/tmp', params['exp_name']),
             graph=self.sess.graph)
         self.saver = tf.train.Saver(max_to_keep=None)
+        self._checkpoint_writer = CheckpointWriter(
+            self.sess,
+            self._checkpoints_dir,
+            self._logger,
+            background=params['model'].get('checkpoint_background', True),
+            keep_last=params['model'].get('checkpoint_keep_last', None),
+            keep_every=params['model'].get('checkpoint_keep_every', None),
+            telemetry=self._telemetry)
 
     ################
     ### Training ###
@@ -1066,16 +2044,7 @@ class ProbcollModel:
                 except:
                     closed = True
     
-    def train(self, reset=False, **kwargs):
-
-        if reset:
-            self._graph_init_vars()
-        else:
-            self.recover()
-        
-        num_files = len(self.tfrecords_no_coll_train_fnames)
-        
-        new_model_file, model_num  = self._next_model_file()
+    def _update_queues(self, flush=True):
         self._logger.debug('Updating queue with train files {0} {1} and val files {2} {3}'.format(
             self.tfrecords_no_coll_train_fnames,
             self.tfrecords_coll_train_fnames,
@@ -1089,16 +2058,246 @@ class ProbcollModel:
                 self._no_coll_val_fnames_ph : self.tfrecords_no_coll_val_fnames,
                 self._coll_val_fnames_ph : self.tfrecords_coll_val_fnames
             })
+        if flush:
+            self._logger.debug('Flushing queue')
+            self._flush_queue()
+
+    def _start_queue_threads(self):
         if not hasattr(self, '_queue_threads'):
             self._logger.debug('Starting queue threads')
             self._queue_threads = tf.train.start_queue_runners(sess=self.sess, coord=self.coord)
             self.threads += self._queue_threads
 
-        #TODO do you need to flush here
-        self._logger.debug('Flushing queue')
-        self._flush_queue()
-        ### create plotter
-        plotter = MLPlotter(
+    def _prepare_data_source(self):
+        """ Makes the data in the shard manifest available before training """
+        if self.data_source == 'queue':
+            self._update_queues(flush=False)
+            self._start_queue_threads()
+
+            #TODO do you need to flush here
+            self._logger.debug('Flushing queue')
+            self._flush_queue()
+            if self._val_cache is not None:
+                self._val_cache.update(self._shard_manifest.version)
+        else:
+            self._update_data_source()
+
+    def _update_data_source(self):
+        """ Called when the shard manifest changes """
+        if self.data_source == 'queue':
+            self._update_queues()
+        else:
+            for d in (self.d_train, self.d_val):
+                d['replay_data'].update()
+        if self._val_cache is not None:
+            self._val_cache.update(self._shard_manifest.version)
+
+    def _replay_feed(self, d):
+        return dict(zip(
+            d['staging_phs'],
+            d['replay_data'].sample_batch(self.batch_size, self._num_reads)))
+
+    def _run_batch(self, d, fetches, trace=False):
+        """
+        Runs fetches on the next batch of d (self.d_train or self.d_val).
+        With the replay data source the batch after is staged in the same call.
+        d['run_times'] is set to the run time and the time spent waiting on the input
+        (with the queue data source only measured if trace, else None).
+        """
+        start = time.time()
+        if self.data_source == 'queue':
+            if trace:
+                run_metadata = tf.RunMetadata()
+                values = self.sess.run(
+                    fetches,
+                    options=tf.RunOptions(trace_level=tf.RunOptions.FULL_TRACE),
+                    run_metadata=run_metadata)
+                input_wait = self._dequeue_time(d, run_metadata)
+            else:
+                values = self.sess.run(fetches)
+                input_wait = None
+        else:
+            if not d['staged']:
+                self.sess.run(d['staging_enqueue'], feed_dict=self._replay_feed(d))
+                d['staged'] = True
+                start = time.time()
+            feed_dict = self._replay_feed(d)
+            input_wait = time.time() - start
+            values = self.sess.run(fetches + [d['staging_enqueue']], feed_dict=feed_dict)[:-1]
+        d['run_times'] = (time.time() - start, input_wait)
+        return values
+
+    def _train_step(self, fetches, trace=False):
+        """
+        Runs an optimizer step and fetches on the next training batch. With data parallel training
+        the gradients are averaged with the other processes before they are applied.
+        :return: values of fetches, None if a data parallel worker step was cancelled
+        """
+        if self._data_parallel is None:
+            return self._run_batch(self.d_train, [self.d_train['optimizer']] + fetches, trace=trace)[1:]
+
+        values = self._run_batch(self.d_train, [self.d_train['dp_grads']] + fetches, trace=trace)
+        mean_grads = self._data_parallel.allreduce(values[0], alive=self._data_parallel_alive)
+        if mean_grads is None:
+            if self._data_parallel.is_chief:
+                raise Exception('Data parallel worker process is gone')
+            return None
+        self.sess.run(self.d_train['dp_apply'], feed_dict=dict(zip(self.d_train['dp_grad_phs'], mean_grads)))
+        return values[1:]
+
+    def _dequeue_time(self, d, run_metadata):
+        """ :return: seconds the traced run spent in the op dequeuing the batch """
+        dequeue_name = d['fnames'].op.name
+        for dev_stats in run_metadata.step_stats.dev_stats:
+            for node_stats in dev_stats.node_stats:
+                if node_stats.node_name == dequeue_name:
+                    return node_stats.all_end_rel_micros / 1e6
+        return None
+
+    def _telemetry_fetches(self, d):
+        """ :return: extra fetches for _write_step_telemetry """
+        if not self._telemetry.enabled:
+            return []
+        fetches = []
+        if self.data_source == 'queue':
+            fetches += d['queue_sizes']
+        if d['bootstrap_weights'] is not None:
+            fetches += d['bootstrap_weight_sums']
+        return fetches
+
+    def _write_step_telemetry(self, step, d, telemetry_values, traced=False):
+        if not self._telemetry.enabled:
+            return
+        step_time, input_wait = d['run_times']
+        record = {
+            'step': step,
+            'time': step_time,
+            'input_wait': input_wait,
+            'traced': traced
+        }
+        telemetry_values = list(telemetry_values)
+        if self.data_source == 'queue':
+            record['batch_queue'], record['no_coll_fnames_queue'], record['coll_fnames_queue'] = telemetry_values[:3]
+            telemetry_values = telemetry_values[3:]
+        else:
+            record['replay_windows'] = len(d['replay_data'])
+        if d['bootstrap_weights'] is not None:
+            # online bootstrap, each head sees the weighted examples
+            head_examples = telemetry_values
+        else:
+            head_examples = [self.batch_size] * self.num_bootstrap
+        record['head_examples_per_sec'] = [num / step_time for num in head_examples]
+        self._telemetry.write('train_step', **record)
+
+    def _validate_queue(self):
+        """ Averages val_steps batches from the validation input pipeline """
+        val_values = defaultdict(list)
+        val_nums = defaultdict(float)
+        val_steps = 0
+        while val_steps < self.val_steps:
+            val_cost, val_cross_entropy, \
+            val_err, val_err_coll, val_err_nocoll, \
+            val_fnames, val_coll, val_nocoll = \
+                self._run_batch(
+                    self.d_val,
+                    [self.d_val['cost'], self.d_val['cross_entropy'],
+                    self.d_val['err'], self.d_val['err_coll'], self.d_val['err_nocoll'],
+                    self.d_val['fnames'], self.d_val['num_coll'], self.d_val['num_nocoll']])
+
+            val_values['cost'].append(val_cost)
+            val_values['cross_entropy'].append(val_cross_entropy)
+            val_values['err'].append(val_err)
+            if not np.isnan(val_err_coll): val_values['err_coll'].append(val_err_coll)
+            if not np.isnan(val_err_nocoll): val_values['err_nocoll'].append(val_err_nocoll)
+            val_nums['coll'] += val_coll
+            val_nums['nocoll'] += val_nocoll
+
+            val_steps += 1
+
+        return val_values, val_nums
+
+    def _validate_cached(self):
+        """
+        Evaluates every bootstrap on the whole cached validation set, same metrics as _graph_cost
+        """
+        val_values = defaultdict(list)
+        val_nums = defaultdict(float)
+        data = self._val_cache.get()
+        if data is None:
+            self._logger.debug('\tNo validation data yet')
+            return val_values, val_nums
+
+        d = self.d_val_cached
+        batch_size = d['X_inputs'].get_shape()[0].value
+        num_windows = len(data['X'])
+        output_mats = []
+        for start in xrange(0, num_windows, batch_size):
+            feed = dict()
+            for ph, k in ((d['X_inputs'], 'X'), (d['U_inputs'], 'U'), (d['O_inputs'], 'O')):
+                # pad the last batch, padding is dropped below
+                batch = data[k][start:start+batch_size]
+                feed[ph] = np.concatenate((batch, np.zeros((batch_size - len(batch),) + batch.shape[1:], dtype=batch.dtype)))
+            output_mats.append(np.array(self.sess.run(d['output_mats'], feed_dict=feed)))
+        output_mats = np.concatenate(output_mats, axis=1)[:, :num_windows].astype(np.float64) # bootstrap x N x T x doutput
+
+        ### mask
+        lens = data['len'].astype(np.int64)
+        if params["model"]["mask"] == "last":
+            mask = (np.arange(self.T)[None, :] == (lens - 1)[:, None])
+        elif params["model"]["mask"] == "all":
+            mask = (np.arange(self.T)[None, :] < lens[:, None])
+        else:
+            raise NotImplementedError(
+                "Mask {0} is not valid".format(
+                    params["model"]["mask"]))
+        mask = np.tile(mask[:, :, None].astype(np.float64), (1, 1, self.doutput))
+
+        ### cost
+        output = data['output'].astype(np.float64)
+        cross_entropy = np.maximum(output_mats, 0) - output_mats * output + np.log1p(np.exp(-np.abs(output_mats)))
+        cross_entropy = np.mean(cross_entropy * mask, axis=(1, 2, 3)).mean()
+        reg_cost = self.sess.run(self.d_val['reg_cost'])
+
+        ### accuracy
+        output_incorrect = ((output_mats >= 0) != (output > 0.5)).astype(np.float64)
+        num_coll = np.sum(output * mask) * self.num_bootstrap
+        num_nocoll = np.sum((1 - output) * mask) * self.num_bootstrap
+        num_errs_on_coll = np.sum(output * mask * output_incorrect)
+        num_errs_on_nocoll = np.sum((1 - output) * mask * output_incorrect)
+
+        val_values['cost'].append(cross_entropy + reg_cost)
+        val_values['cross_entropy'].append(cross_entropy)
+        val_values['err'].append((num_errs_on_coll + num_errs_on_nocoll) / max(num_coll + num_nocoll, 1.))
+        if num_coll > 0: val_values['err_coll'].append(num_errs_on_coll / num_coll)
+        if num_nocoll > 0: val_values['err_nocoll'].append(num_errs_on_nocoll / num_nocoll)
+        val_nums['coll'] += num_coll
+        val_nums['nocoll'] += num_nocoll
+
+        return val_values, val_nums
+
+    def train(self, reset=False, publish=False, **kwargs):
+        """
+        :param publish: also publish a model version at every checkpoint (see publish)
+        """
+
+        if reset:
+            self._graph_init_vars()
+        else:
+            self.recover()
+        
+        data_version = self._shard_manifest.refresh()
+        budget = self._scheduler.start(
+            self._shard_manifest.count('no_coll_train') + self._shard_manifest.count('coll_train'),
+            reset=reset)
+        val_interval = self._scheduler.validation_interval(self.val_freq)
+        
+        new_model_file, model_num  = self._next_model_file()
+        self._prepare_data_source()
+        if self.data_parallel_workers > 1:
+            self._data_parallel_resume()
+        ### create metrics recorder, figures are drawn in a child process
+        metrics = MetricsRecorder(
+            os.path.join(self._plots_dir, 'metrics_{0}.csv'.format(model_num)),
             self.save_dir,
             {
                 'err': {
@@ -1137,83 +2336,70 @@ class ProbcollModel:
         train_fnames_dict = defaultdict(int)
 
         step = 0
-        epoch_start = save_start = time.time()
+        epoch_start = save_start = display_start = train_start = time.time()
+        self._telemetry.write(
+            'train_start',
+            steps=budget,
+            batch_size=self.batch_size,
+            num_bootstrap=self.num_bootstrap,
+            data_source=self.data_source,
+            bootstrap_mode=self.bootstrap_mode,
+            val_mode=self.val_mode)
         # TODO using rospy to ensure code ends if stuff crashes
-        while step < self.steps and not rospy.is_shutdown():
+        # a training process also stops once the process that started it is gone
+        while step < budget and self._parent_alive() and not rospy.is_shutdown():
             
-            new_num_files = len(self.tfrecords_no_coll_train_fnames)
-
-            if new_num_files > num_files:
-                num_files = new_num_files
-                self._logger.debug('Updating queue with train files {0} {1} and val files {2} {3}'.format(
-                    self.tfrecords_no_coll_train_fnames,
-                    self.tfrecords_coll_train_fnames,
-                    self.tfrecords_no_coll_val_fnames,
-                    self.tfrecords_coll_val_fnames))
-                self.sess.run(
-                    self._queue_update,
-                    {
-                        self._no_coll_train_fnames_ph : self.tfrecords_no_coll_train_fnames,
-                        self._coll_train_fnames_ph : self.tfrecords_coll_train_fnames,
-                        self._no_coll_val_fnames_ph : self.tfrecords_no_coll_val_fnames,
-                        self._coll_val_fnames_ph : self.tfrecords_coll_val_fnames
-                    })
-                self._logger.debug('Flushing queue')
-                self._flush_queue()
+            new_data_version = self._shard_manifest.refresh()
+
+            if new_data_version != data_version:
+                data_version = new_data_version
+                update_start = time.time()
+                self._update_data_source()
+                self._telemetry.write('data_update', step=step, time=time.time() - update_start, version=data_version)
 
             ### validation
-            if (step != 0 and (step % int(self.val_freq * self.steps)) == 0):
-                val_values = defaultdict(list)
-                val_nums = defaultdict(float)
-                val_steps = 0
+            if (step != 0 and (step % val_interval) == 0):
                 self._logger.debug('\tComputing validation...')
-                while val_steps < self.val_steps:
-                    val_cost, val_cross_entropy, \
-                    val_err, val_err_coll, val_err_nocoll, \
-                    val_fnames, val_coll, val_nocoll = \
-                        self.sess.run(
-                            [self.d_val['cost'], self.d_val['cross_entropy'],
-                            self.d_val['err'], self.d_val['err_coll'], self.d_val['err_nocoll'],
-                            self.d_val['fnames'], self.d_val['num_coll'], self.d_val['num_nocoll']])
-
-                    val_values['cost'].append(val_cost)
-                    val_values['cross_entropy'].append(val_cross_entropy)
-                    val_values['err'].append(val_err)
-                    if not np.isnan(val_err_coll): val_values['err_coll'].append(val_err_coll)
-                    if not np.isnan(val_err_nocoll): val_values['err_nocoll'].append(val_err_nocoll)
-                    val_nums['coll'] += val_coll
-                    val_nums['nocoll'] += val_nocoll
-
-                    val_steps += 1
-
-                plotter.add_val('err', np.mean(val_values['err']))
-                plotter.add_val('err_coll', np.mean(val_values['err_coll']))
-                plotter.add_val('err_nocoll', np.mean(val_values['err_nocoll']))
-                plotter.add_val('cost', np.mean(val_values['cost']))
-                plotter.add_val('cross_entropy', np.mean(val_values['cross_entropy']))
-
-                self._logger.debug(
-                    'error: {0:5.2f}%,  error coll: {1:5.2f}%,  error nocoll: {2:5.2f}%,  pct coll: {3:4.1f}%,  cost: {4:4.2f}, ce: {5:4.2f} ({6:.2f} s per {7:04d} samples)'.format(
-                        100 * np.mean(val_values['err']),
-                        100 * np.mean(val_values['err_coll']),
-                        100 * np.mean(val_values['err_nocoll']),
-                        100 * val_nums['coll'] / (val_nums['coll'] + val_nums['nocoll']),
-                        np.mean(val_values['cost']),
-                        np.mean(val_values['cross_entropy']),
-                        time.time() - epoch_start,
-                        int(self.val_freq * self.batch_size)))
+                val_start = time.time()
+                if self.val_mode == 'cached':
+                    val_values, val_nums = self._validate_cached()
+                else:
+                    val_values, val_nums = self._validate_queue()
+                self._telemetry.write('validation', step=step, time=time.time() - val_start)
+
+                if len(val_values['err']) > 0:
+                    metrics.add_val('err', np.mean(val_values['err']))
+                    metrics.add_val('err_coll', np.mean(val_values['err_coll']))
+                    metrics.add_val('err_nocoll', np.mean(val_values['err_nocoll']))
+                    metrics.add_val('cost', np.mean(val_values['cost']))
+                    metrics.add_val('cross_entropy', np.mean(val_values['cross_entropy']))
+
+                    self._logger.debug(
+                        'error: {0:5.2f}%,  error coll: {1:5.2f}%,  error nocoll: {2:5.2f}%,  pct coll: {3:4.1f}%,  cost: {4:4.2f}, ce: {5:4.2f} ({6:.2f} s per {7:04d} samples)'.format(
+                            100 * np.mean(val_values['err']),
+                            100 * np.mean(val_values['err_coll']),
+                            100 * np.mean(val_values['err_nocoll']),
+                            100 * val_nums['coll'] / (val_nums['coll'] + val_nums['nocoll']),
+                            np.mean(val_values['cost']),
+                            np.mean(val_values['cross_entropy']),
+                            time.time() - epoch_start,
+                            int(self.val_freq * self.batch_size)))
+
+                    if self._scheduler.validated(step, np.mean(val_values['cost'])):
+                        break
                 
                 epoch_start = time.time()
 
                 ### save model
-                self.save(new_model_file)
+                save_start_time = time.time()
+                self._save_checkpoint(new_model_file, publish=publish)
+                self._telemetry.write('checkpoint', step=step, time=time.time() - save_start_time)
+                self._telemetry.flush()
 
             ### train
-            _, train_cost, train_cross_entropy, \
-            train_err, train_err_coll, train_err_nocoll, \
-            train_fnames, train_coll, train_nocoll = self.sess.run(
-                [
-                    self.d_train['optimizer'],
+            trace = self._telemetry.enabled and self.data_source == 'queue' and \
+                step % self.telemetry_trace_steps == 0
+            train_fetches = [
                     self.d_train['cost'],
                     self.d_train['cross_entropy'],
                     self.d_train['err'],
@@ -1222,7 +2408,14 @@ class ProbcollModel:
                     self.d_train['fnames'],
                     self.d_train['num_coll'],
                     self.d_train['num_nocoll']
-                ])
+                ]
+            train_values_list = self._train_step(
+                train_fetches + self._telemetry_fetches(self.d_train),
+                trace=trace)
+            train_cost, train_cross_entropy, \
+            train_err, train_err_coll, train_err_nocoll, \
+            train_fnames, train_coll, train_nocoll = train_values_list[:len(train_fetches)]
+            self._write_step_telemetry(step, self.d_train, train_values_list[len(train_fetches):], traced=trace)
 
             # Keeps track of how many times files are read
             for fname in train_fnames:
@@ -1238,32 +2431,37 @@ class ProbcollModel:
 
             # Print an overview fairly often.
             if step % self.display_steps == 0 and step > 0:
-                plotter.add_train('err', step * self.batch_size, np.mean(train_values['err']))
+                metrics.add_train('err', step * self.batch_size, np.mean(train_values['err']))
                 if len(train_values['err_coll']) > 0:
-                    plotter.add_train('err_coll', step * self.batch_size, np.mean(train_values['err_coll']))
+                    metrics.add_train('err_coll', step * self.batch_size, np.mean(train_values['err_coll']))
                 if len(train_values['err_nocoll']) > 0:
-                    plotter.add_train('err_nocoll', step * self.batch_size, np.mean(train_values['err_nocoll']))
-                plotter.add_train('cost', step * self.batch_size, np.mean(train_values['cost']))
-                plotter.add_train('cross_entropy', step * self.batch_size, np.mean(train_values['cross_entropy']))
+                    metrics.add_train('err_nocoll', step * self.batch_size, np.mean(train_values['err_nocoll']))
+                metrics.add_train('cost', step * self.batch_size, np.mean(train_values['cost']))
+                metrics.add_train('cross_entropy', step * self.batch_size, np.mean(train_values['cross_entropy']))
 
-                self._logger.debug('\tstep pct: {0:.1f}%,  error: {1:5.2f}%,  error coll: {2:5.2f}%,  error nocoll: {3:5.2f}%,  pct coll: {4:4.1f}%,  cost: {5:4.2f}, ce: {6:4.2f}'.format(
-                    100 * step / float(self.steps),
+                self._logger.debug('\tstep pct: {0:.1f}%,  error: {1:5.2f}%,  error coll: {2:5.2f}%,  error nocoll: {3:5.2f}%,  pct coll: {4:4.1f}%,  cost: {5:4.2f}, ce: {6:4.2f}, {7:.1f} steps/s'.format(
+                    100 * step / float(budget),
                     100 * np.mean(train_values['err']),
                     100 * np.mean(train_values['err_coll']),
                     100 * np.mean(train_values['err_nocoll']),
                     100 * train_nums['coll'] / (train_nums['coll'] + train_nums['nocoll']),
                     np.mean(train_values['cost']),
-                    np.mean(train_values['cross_entropy'])))
+                    np.mean(train_values['cross_entropy']),
+                    self.display_steps / (time.time() - display_start)))
+                display_start = time.time()
 
                 train_values = defaultdict(list)
                 train_nums = defaultdict(float)
 
             if time.time() - save_start > 60.:
-                plotter.save(self._plots_dir, suffix=str(model_num))
+                metrics.plot(self._plots_dir, suffix=str(model_num))
                 save_start = time.time()
 
             step += 1
 
+        if self._data_parallel is not None:
+            self._data_parallel.pause()
+
         # Logs the number of times files were accessed
         fnames_condensed = defaultdict(int)
         for k, v in train_fnames_dict.items():
@@ -1271,9 +2469,16 @@ class ProbcollModel:
         for k, v in sorted(fnames_condensed.items(), key=lambda x: x[1]):
             self._logger.debug('\t\t\t{0} : {1}'.format(k, v))
         
-        self.save(new_model_file)
-        plotter.save(self._plots_dir, suffix=str(model_num))
-        plotter.close()
+        save_start_time = time.time()
+        self._save_checkpoint(new_model_file, publish=publish)
+        self._telemetry.write('checkpoint', step=step, time=time.time() - save_start_time)
+        train_time = time.time() - train_start
+        self._telemetry.write('train_end', steps=step, time=train_time,
+                              time_saved=self._scheduler.finish(step, train_time))
+        self._logger.debug('Checkpoint stalls {0:.2f}s, {1:.1f} MB written'.format(
+            self._checkpoint_writer.total_stall, self._checkpoint_writer.total_bytes / 1e6))
+        self._telemetry.flush()
+        metrics.plot(self._plots_dir, suffix=str(model_num), skip_busy=False)
 
     ##################
     ### Evaluating ###
@@ -1426,21 +2631,83 @@ class ProbcollModel:
     #############################
 
     def recover(self):
+        if self._subscriber is not None:
+            # checkpoints are written by the training process, only load published versions
+            self.swap_published()
+            return
+        if self._session_model_file is not None and self._session_model_file == self._checkpoint_writer.last_model_file:
+            # the newest checkpoint was saved from this session (always in thread mode), so the weights
+            # are already loaded, do not wait for it to be written
+            return
+        self._checkpoint_writer.wait()
         try:
             latest_file = tf.train.latest_checkpoint(
                 self._checkpoints_dir)
+            if latest_file is not None and latest_file == self._session_model_file:
+                # saved from this session, so the weights are already loaded (or newer)
+                return
             self.load(latest_file)
         except:
             self._logger.debug("Could not find checkpoint file")
 
     def load(self, model_file):
         self.saver.restore(self.sess, model_file)
+        self._session_model_file = model_file
+
+    def load_per_head(self, model_file):
+        """ Loads a checkpoint saved in separate ensemble mode into the fused ensemble """
+        assert(self.ensemble_mode == 'fused')
+        loaded = ensemble.load_per_head_checkpoint(self.sess, model_file, self.num_bootstrap)
+        self._logger.info('Loaded {0} variables from {1}'.format(len(loaded), model_file))
 
     def save(self, model_file):
         self.saver.save(self.sess, model_file, write_meta_graph=False)
+        self._session_model_file = model_file
+
+    def _save_checkpoint(self, model_file, publish=False):
+        """
+        Saves into the checkpoints folder with the checkpoint writer, returns before the write is done
+        :param publish: also publish the checkpoint (see publish)
+        """
+        on_written = self.publish() if publish else None
+        self._checkpoint_writer.save(model_file, on_written=on_written)
+        self._session_model_file = model_file
+
+    def get_inference_weights(self):
+        """ :return: values of the inference variables """
+        return self.sess.run(self._inference_vars)
+
+    def set_inference_weights(self, values):
+        """
+        Assigns the inference variables with one op, works once the graph is finalized
+        :param values: list in the order of get_inference_weights, or dict from variable name
+        :return: time it took in seconds
+        """
+        start = time.time()
+        if isinstance(values, dict):
+            values = [values[var.op.name] for var in self._inference_vars]
+        self.sess.run(self._weight_swap, feed_dict=dict(zip(self._weight_swap_phs, values)))
+        return time.time() - start
+
+    def _inference_weights_layout(self):
+        return [(var.op.name, var.get_shape().as_list(), var.dtype.base_dtype.as_numpy_dtype)
+                for var in self._inference_vars]
 
     def close(self):
         """ Release tf session """
+        self._checkpoint_writer.wait()
+        for process in self._data_parallel_processes:
+            process.stop()
+        if self._data_parallel is not None:
+            self._data_parallel.close()
+        if self._subscriber is not None:
+            self._subscriber.close()
+        if self._shared_weights is not None:
+            self._shared_weights.close()
+        self._telemetry.close()
+        self._data_converter.close()
+        if self._trainer_process is not None:
+            self._trainer_process.stop()
         if hasattr(self, 'coord'):
             assert(hasattr(self, 'threads'))
             self.coord.request_stop()
@@ -1448,6 +2715,151 @@ class ProbcollModel:
         self.sess.close()
         self.sess = None
 
+    ########################
+    ### Training process ###
+    ########################
+
+    def publish(self):
+        """
+        Publishes the current weights as a new version for the planning process. With the shm transport
+        the inference weights are written to shared memory now, the checkpoint is published once the
+        checkpoint writer has written it (the weights are not saved again).
+        :return: to pass as on_written to the checkpoint writer save of the current weights
+        """
+        if self._publisher is None:
+            self._publisher = ModelPublisher(self._published_dir, keep=params['model'].get('publish_keep', 5))
+        version = self._publisher.reserve()
+        if self.publish_transport == 'shm':
+            if self._shared_weights is None:
+                self._shared_weights = SharedWeights(self._shared_weights_fname, self._inference_weights_layout())
+            self._shared_weights.write(self.get_inference_weights(), version)
+        self._logger.debug('Published model version {0}'.format(version))
+
+        def on_written(model_file):
+            self._publisher.publish(model_file, version)
+        return on_written
+
+    def run_trainer(self, parent_pid=None):
+        """
+        Trains until interrupted, publishing a version at every checkpoint. Meant to run in its own process
+        :param parent_pid: stop once this process is gone
+        """
+        self._logger.info('Started training process')
+        self._parent_pid = parent_pid
+        try:
+            while self._parent_alive() and not rospy.is_shutdown():
+                self.train(publish=True)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self._logger.info('Ending training process')
+
+    def start_training_process(self):
+        """
+        Trains in a separate process (see run_trainer). The weights are only changed by swap_published
+        """
+        # the trainer loads the params of this process, which may differ from the yaml file
+        with open(self._trainer_params_fname, 'w') as f:
+            yaml.dump(params, f)
+        self._trainer_process = TrainerProcess(self._robot, self._trainer_params_fname, self._logger)
+        self._trainer_process.start()
+        if self.publish_transport == 'shm':
+            self._subscriber = SharedWeights(self._shared_weights_fname, self._inference_weights_layout())
+        elif self.publish_transport == 'disk':
+            self._subscriber = ModelSubscriber(
+                self._published_dir,
+                self._logger,
+                poll_interval=params['model'].get('publish_poll_interval', 1.))
+            self._subscriber.start()
+        else:
+            raise Exception('{0} is not valid publish transport'.format(self.publish_transport))
+
+    def swap_published(self):
+        """
+        Loads the newest published version if it has already been read, never waits for one.
+        Call between control steps.
+        :return: True if the weights changed
+        """
+        if self._subscriber is None:
+            return False
+        version, values = self._subscriber.pop()
+        if version is None:
+            return False
+
+        swap_time = self.set_inference_weights(values)
+        self._logger.debug('Swapped in published model version {0} ({1:.1f} ms)'.format(version, 1e3 * swap_time))
+        return True
+
+    #####################
+    ### Data parallel ###
+    #####################
+
+    def _create_gradient_exchange(self):
+        return GradientExchange(
+            self._gradient_exchange_fname,
+            [g.get_shape().as_list() for g in self.d_train['dp_grads']],
+            [var.get_shape().as_list() for var in self._dp_vars],
+            self.data_parallel_workers,
+            self.data_parallel_rank,
+            dtype=self.dtype.as_numpy_dtype)
+
+    def _parent_alive(self):
+        """ :return: False once the process that started this one (run_trainer, run_data_parallel_worker) is gone """
+        return self._parent_pid is None or os.getppid() == self._parent_pid
+
+    def _data_parallel_alive(self):
+        if self._data_parallel.is_chief:
+            return all([process.is_alive() for process in self._data_parallel_processes])
+        return self._parent_alive()
+
+    def _data_parallel_resume(self):
+        """ Starts the worker processes the first time, then sends them the variables of this train call """
+        if self._data_parallel is None:
+            assert(self.data_parallel_rank == 0)
+            self._data_parallel = self._create_gradient_exchange()
+            self._data_parallel.open()
+            # workers load the params of this process, which may differ from the yaml file
+            with open(self._data_parallel_params_fname, 'w') as f:
+                yaml.dump(params, f)
+            for rank in xrange(1, self.data_parallel_workers):
+                process = TrainerProcess(self._robot, self._data_parallel_params_fname, self._logger,
+                                         command='dp_worker', args=('-rank', str(rank)))
+                process.start()
+                self._data_parallel_processes.append(process)
+        if not self._data_parallel.resume(self.sess.run(self._dp_vars), alive=self._data_parallel_alive):
+            raise Exception('Data parallel worker process is gone')
+
+    def run_data_parallel_worker(self, parent_pid=None):
+        """
+        Computes gradients for the train calls of the chief (rank 0) until the chief is gone.
+        Meant to run in a process started by the chief
+        """
+        assert(self.data_parallel_rank > 0)
+        self._parent_pid = parent_pid
+        self._data_parallel = self._create_gradient_exchange()
+        self._logger.info('Started data parallel worker {0}'.format(self.data_parallel_rank))
+        try:
+            if not self._data_parallel.open(alive=self._data_parallel_alive):
+                return
+            self._prepare_data_source()
+            data_version = self._shard_manifest.version
+            while not rospy.is_shutdown():
+                weights = self._data_parallel.wait_resume(alive=self._data_parallel_alive)
+                if weights is None:
+                    break
+                self.sess.run(self._dp_var_assign, feed_dict=dict(zip(self._dp_var_phs, weights)))
+                while True:
+                    new_data_version = self._shard_manifest.refresh()
+                    if new_data_version != data_version:
+                        data_version = new_data_version
+                        self._update_data_source()
+                    if self._train_step([]) is None:
+                        break
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self._logger.info('Ending data parallel worker {0}'.format(self.data_parallel_rank))
+
     @staticmethod
     def checkpoint_exists(model_file):
         ckpt = tf.train.get_checkpoint_state(os.path.dirname(model_file))
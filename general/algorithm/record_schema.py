@@ -0,0 +1,115 @@
+import numpy as np
+import tensorflow as tf
+
+class RecordSchema(object):
+    """
+    How the X, U and O fields of each tfrecord Example are stored.
+
+    Without dtypes every field is a FloatList (the original format). With dtypes, e.g.
+        {'X': 'float32', 'U': 'float32', 'O': 'uint8'}
+    each field is stored as the raw bytes of the array in that dtype and decoded with decode_raw.
+    O keeps its storage dtype through the input pipeline and is only cast when it is embedded.
+    """
+    FIELDS = ('X', 'U', 'O')
+
+    def __init__(self, dtypes=None):
+        if dtypes is None:
+            self.dtypes = None
+        else:
+            self.dtypes = dict([(field, np.dtype(dtypes[field])) for field in RecordSchema.FIELDS])
+
+    @property
+    def is_raw(self):
+        return self.dtypes is not None
+
+    ################
+    ### Encoding ###
+    ################
+
+    def encode(self, field, arr):
+        """
+        :return: tf.train.Feature for arr
+        """
+        if not self.is_raw:
+            return tf.train.Feature(float_list=tf.train.FloatList(value=np.ravel(arr).tolist()))
+
+        dtype = self.dtypes[field]
+        encoded = np.ascontiguousarray(arr, dtype=dtype)
+        if dtype.kind in ('i', 'u') and not np.array_equal(encoded, arr):
+            raise Exception('{0} cannot be stored as {1} without loss'.format(field, dtype.name))
+        return tf.train.Feature(bytes_list=tf.train.BytesList(value=[encoded.tostring()]))
+
+    def to_numpy(self, field, feature):
+        """
+        :param feature: tf.train.Feature written with this schema
+        :return: flat numpy array
+        """
+        if not self.is_raw:
+            return np.array(feature.float_list.value, dtype=np.float32)
+        return np.fromstring(feature.bytes_list.value[0], dtype=self.dtypes[field])
+
+    ################
+    ### Decoding ###
+    ################
+
+    def feature(self, field, size=None):
+        """
+        :param size: number of values for fixed length records, None for variable length
+        :return: feature for tf.parse_single_example
+        """
+        if self.is_raw:
+            return tf.FixedLenFeature([], tf.string)
+        elif size is None:
+            return tf.VarLenFeature(tf.float32)
+        else:
+            return tf.FixedLenFeature([size], tf.float32)
+
+    def tf_dtype(self, field):
+        """ dtype of the field after decoding """
+        if self.is_raw and field == 'O':
+            return tf.as_dtype(self.dtypes[field])
+        return tf.float32
+
+    def decode(self, field, parsed, shape):
+        """
+        :param parsed: parsed feature from self.feature
+        :return: tensor of shape with dtype self.tf_dtype(field)
+        """
+        if self.is_raw:
+            decoded = tf.decode_raw(parsed, tf.as_dtype(self.dtypes[field]))
+            if decoded.dtype != self.tf_dtype(field):
+                decoded = tf.cast(decoded, self.tf_dtype(field))
+        elif isinstance(parsed, tf.SparseTensor):
+            decoded = tf.sparse_tensor_to_dense(parsed)
+        else:
+            decoded = parsed
+        return tf.reshape(decoded, shape)
+
+##################
+### Conversion ###
+##################
+
+def convert_tfrecords(tfrecords, new_tfrecords, schema, new_schema):
+    """
+    Rewrites the X, U and O fields of every Example from schema to new_schema.
+    :return: number of records
+    """
+    writer = tf.python_io.TFRecordWriter(new_tfrecords)
+    num_records = 0
+    for serialized in tf.python_io.tf_record_iterator(tfrecords):
+        example = tf.train.Example.FromString(serialized)
+        feature = example.features.feature
+        for field in RecordSchema.FIELDS:
+            feature[field].CopyFrom(new_schema.encode(field, schema.to_numpy(field, feature[field])))
+        writer.write(example.SerializeToString())
+        num_records += 1
+    writer.close()
+
+    return num_records
+
+def parse_dtypes(dtypes):
+    """ ['X=float32', 'U=float32', 'O=uint8'] -> dict, None if empty """
+    if dtypes is None or len(dtypes) == 0:
+        return None
+    return dict([dtype.split('=') for dtype in dtypes])
+
@@ -0,0 +1,142 @@
+import time
+import numpy as np
+
+from general.algorithm.balanced_sampler import BalancedSampler
+
+class ReplayBuffer(object):
+    """
+    Preallocated ring buffer of training windows of one class.
+    Once full, the oldest windows are overwritten.
+    """
+
+    def __init__(self, capacity, shapes, dtypes):
+        """
+        :param shapes: dict from field to shape of one window
+        :param dtypes: dict from field to numpy dtype
+        """
+        self._capacity = capacity
+        self._arrays = dict([(k, np.zeros((capacity,) + tuple(shapes[k]), dtype=dtypes[k])) for k in shapes.keys()])
+        self._size = 0
+        self._next = 0
+
+    def __len__(self):
+        return self._size
+
+    def add(self, windows):
+        """
+        :param windows: dict from field to array of windows (same fields as shapes)
+        """
+        num = len(windows[list(self._arrays.keys())[0]])
+        # if more windows than capacity, only the newest fit
+        start = max(0, num - self._capacity)
+        idxs = (self._next + np.arange(num - start)) % self._capacity
+        for k, arr in self._arrays.items():
+            arr[idxs] = windows[k][start:]
+        self._next = (self._next + num - start) % self._capacity
+        self._size = min(self._size + num - start, self._capacity)
+
+    def field(self, k):
+        """ :return: view of field k for the windows in the buffer """
+        return self._arrays[k][:self._size]
+
+class ReplayData(object):
+    """
+    Holds every window of one split (train or val) in RAM, split into a collision and
+    no collision ReplayBuffer, and samples stratified batches for all bootstraps at once
+    with a BalancedSampler. Windows are weighted by recency in the order their shard was added.
+
+    Shards are loaded from the model's shard manifest, so new data is visible
+    to the next sampled batch without touching any queues.
+    """
+    FIELDS = ('X', 'U', 'O', 'output', 'len', 'shard')
+
+    def __init__(self, probcoll_model, split, capacity, pct_coll=0.5, recency_decay=None):
+        assert(split in ('train', 'val'))
+        self._probcoll_model = probcoll_model
+        self._split = split
+        self._logger = probcoll_model._logger
+
+        pm = probcoll_model
+        shapes = {
+            'X': (pm.T, pm.dX),
+            'U': (pm.T, pm.dU),
+            'O': (pm.dO,),
+            'output': (pm.T, pm.doutput),
+            'len': (),
+            'shard': ()
+        }
+        dtypes = {
+            'X': pm._record_schema.tf_dtype('X').as_numpy_dtype,
+            'U': pm._record_schema.tf_dtype('U').as_numpy_dtype,
+            'O': pm._record_schema.tf_dtype('O').as_numpy_dtype,
+            'output': np.uint8,
+            'len': np.int64,
+            'shard': np.int32
+        }
+        self._buffers = {
+            'no_coll': ReplayBuffer(capacity, shapes, dtypes),
+            'coll': ReplayBuffer(capacity, shapes, dtypes)
+        }
+        self._sampler = BalancedSampler([1. - pct_coll, pct_coll], recency_decay=recency_decay)
+        self._shard_names = []
+        self._loaded = set()
+
+    def __len__(self):
+        return sum(len(buffer) for buffer in self._buffers.values())
+
+    def update(self):
+        """
+        Loads the shards in the manifest that have not been loaded yet
+        :return: number of windows added
+        """
+        start = time.time()
+        num_added = 0
+        for shard in self._probcoll_model._shard_manifest.shards():
+            if shard['shard'] in self._loaded:
+                continue
+            shard_id = len(self._shard_names)
+            self._shard_names.append(shard['shard'])
+            self._loaded.add(shard['shard'])
+            for name, buffer in self._buffers.items():
+                windows = self._probcoll_model._read_tfrecords_windows(
+                    shard['files']['{0}_{1}'.format(name, self._split)])
+                if windows is None:
+                    continue
+                windows['shard'] = np.full(len(windows['X']), shard_id, dtype=np.int32)
+                buffer.add(windows)
+                num_added += len(windows['X'])
+
+        if num_added > 0:
+            self._sampler.set_data(
+                np.concatenate((np.zeros(len(self._buffers['no_coll']), dtype=np.int64),
+                                np.ones(len(self._buffers['coll']), dtype=np.int64))),
+                itrs=np.concatenate((self._buffers['no_coll'].field('shard'), self._buffers['coll'].field('shard'))))
+            self._logger.debug('Replay {0} loaded {1} windows in {2:.2f}s (no coll: {3}, coll: {4})'.format(
+                self._split,
+                num_added,
+                time.time() - start,
+                len(self._buffers['no_coll']),
+                len(self._buffers['coll'])))
+        return num_added
+
+    def sample_batch(self, batch_size, num_bootstrap):
+        """
+        Samples an independent balanced batch for each bootstrap
+        :return: fnames (batch_size,), X, U, O, output, len (num_bootstrap x batch_size x ...)
+        """
+        if len(self._sampler) == 0:
+            raise Exception('Replay {0} data is empty'.format(self._split))
+        idxs = self._sampler.sample(batch_size, num_bootstrap=num_bootstrap)
+
+        # sampler indices are no coll windows followed by coll windows
+        num_no_coll = len(self._buffers['no_coll'])
+        is_coll = idxs >= num_no_coll
+        batch = dict()
+        for k in ReplayData.FIELDS:
+            no_coll_field, coll_field = self._buffers['no_coll'].field(k), self._buffers['coll'].field(k)
+            batch[k] = np.empty(idxs.shape + no_coll_field.shape[1:], dtype=no_coll_field.dtype)
+            batch[k][~is_coll] = no_coll_field[idxs[~is_coll]]
+            batch[k][is_coll] = coll_field[idxs[is_coll] - num_no_coll]
+
+        fnames = np.array(self._shard_names)[batch['shard'][0]]
+        return [fnames, batch['X'], batch['U'], batch['O'], batch['output'], batch['len']]
@@ -0,0 +1,140 @@
+import os
+import json
+import fcntl
+import threading
+from collections import OrderedDict
+
+class ShardManifest(object):
+    """
+    Append-only registry of tfrecord shards.
+
+    Each line of the manifest file is a json record, either
+        {"op": "add", "shard": name, "files": {key: tfrecords}, "counts": {key: num_records}}
+    or
+        {"op": "remove", "shard": name}
+    where key is one of ShardManifest.KEYS. File lists, record counts and the version are
+    kept in memory, so readers learn about new shards without listing directories.
+    """
+    KEYS = ('no_coll_train', 'coll_train', 'no_coll_val', 'coll_val')
+
+    def __init__(self, fname):
+        self._fname = fname
+        self._lock = threading.Condition()
+        self._shards = OrderedDict()
+        self._fnames = dict([(key, []) for key in ShardManifest.KEYS])
+        self._counts = dict([(key, 0) for key in ShardManifest.KEYS])
+        self._version = 0
+        self._offset = 0
+        self.refresh()
+
+    ###############
+    ### Reading ###
+    ###############
+
+    @property
+    def version(self):
+        """ Incremented every time shards are added or removed """
+        return self._version
+
+    def fnames(self, key):
+        return self._fnames[key]
+
+    def count(self, key):
+        return self._counts[key]
+
+    def shards(self):
+        with self._lock:
+            return list(self._shards.values())
+
+    def __contains__(self, name):
+        return name in self._shards
+
+    def __len__(self):
+        return len(self._shards)
+
+    def wait(self, version, timeout=None):
+        """
+        Blocks until the version is different from version (or timeout)
+        :return: current version
+        """
+        with self._lock:
+            if self._version == version:
+                self._lock.wait(timeout)
+            return self._version
+
+    def refresh(self):
+        """ Applies records appended by other processes, only reads the new bytes """
+        if not os.path.exists(self._fname) or os.path.getsize(self._fname) == self._offset:
+            return self._version
+
+        with self._lock:
+            with open(self._fname, 'r') as f:
+                f.seek(self._offset)
+                lines = f.read()
+            # only apply complete lines, a writer may be in the middle of a record
+            complete = lines[:lines.rfind('\n') + 1]
+            self._offset += len(complete)
+            records = [json.loads(line) for line in complete.split('\n') if len(line) > 0]
+            if len(records) > 0:
+                for record in records:
+                    self._apply(record)
+                self._update()
+            return self._version
+
+    ###############
+    ### Writing ###
+    ###############
+
+    def add(self, name, files, counts):
+        """
+        :param name: shard name (the basename of the sample file it was converted from)
+        :param files: dict from key to tfrecords file
+        :param counts: dict from key to number of records
+        """
+        self._append([{
+            'op': 'add',
+            'shard': name,
+            'files': dict([(key, files[key]) for key in ShardManifest.KEYS]),
+            'counts': dict([(key, int(counts[key])) for key in ShardManifest.KEYS])
+        }])
+
+    def remove(self, names):
+        self._append([{'op': 'remove', 'shard': name} for name in names])
+
+    def _append(self, records):
+        if len(records) == 0:
+            return
+        with self._lock:
+            with open(self._fname, 'a') as f:
+                # other processes append too, the file lock keeps them out from the refresh to the end of the write
+                fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+                try:
+                    # pick up records from other writers first so the offset stays at the end of the file
+                    self.refresh()
+                    data = ''.join([json.dumps(record) + '\n' for record in records])
+                    f.write(data)
+                    f.flush()
+                    os.fsync(f.fileno())
+                    self._offset = f.tell()
+                finally:
+                    fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+            for record in records:
+                self._apply(record)
+            self._update()
+
+    def _apply(self, record):
+        if record['op'] == 'add':
+            self._shards[record['shard']] = record
+        elif record['op'] == 'remove':
+            self._shards.pop(record['shard'], None)
+        else:
+            raise Exception('Manifest op {0} is not valid'.format(record['op']))
+
+    def _update(self):
+        """ Recomputes the cached file lists and counts and notifies waiters """
+        shards = list(self._shards.values())
+        for key in ShardManifest.KEYS:
+            self._fnames[key] = [shard['files'][key] for shard in shards]
+            self._counts[key] = sum([shard['counts'][key] for shard in shards])
+        self._version += 1
+        self._lock.notify_all()
@@ -0,0 +1,128 @@
+import os
+import mmap
+import hashlib
+import tempfile
+import numpy as np
+
+class SharedWeights(object):
+    """
+    Inference weights in a shared memory file, written by one process and read by others.
+
+    A sequence number in the header is odd while a write is in progress, so a reader never
+    uses a partial write and never waits for the writer: it skips and tries again later.
+    The writer removes the file on close.
+    """
+    HEADER_BYTES = 32 # sequence number, version, layout digest
+    ALIGN = 8
+
+    def __init__(self, fname, layout):
+        """
+        :param layout: list of (name, shape, numpy dtype) of the weights, same order for the writer and readers
+        """
+        self._fname = fname
+        self._layout = [(name, tuple(shape), np.dtype(dtype)) for name, shape, dtype in layout]
+        self._digest = hashlib.md5(str([(name, shape, dtype.str) for name, shape, dtype in self._layout])).digest()
+
+        self._offsets = []
+        offset = SharedWeights.HEADER_BYTES
+        for _, shape, dtype in self._layout:
+            self._offsets.append(offset)
+            num_bytes = int(np.prod(shape)) * dtype.itemsize
+            offset += SharedWeights.ALIGN * ((num_bytes + SharedWeights.ALIGN - 1) // SharedWeights.ALIGN)
+        self._size = offset
+
+        self._mmap = None
+        self._header = None
+        self._arrays = None
+        self._last_seq = None
+        self._created = False
+        self._inode = None
+
+    @staticmethod
+    def shared_dir():
+        """ /dev/shm is memory backed, fall back to the temp folder where it does not exist """
+        return '/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir()
+
+    @property
+    def num_bytes(self):
+        return self._size
+
+    def _open(self, create):
+        """ :return: True if the buffer is mapped """
+        if self._mmap is not None:
+            return True
+        if not create and (not os.path.exists(self._fname) or os.path.getsize(self._fname) != self._size):
+            return False
+
+        fd = os.open(self._fname, (os.O_RDWR | os.O_CREAT) if create else os.O_RDWR)
+        try:
+            if create:
+                os.ftruncate(fd, self._size)
+            self._mmap = mmap.mmap(fd, self._size)
+            self._inode = os.fstat(fd).st_ino
+        finally:
+            os.close(fd)
+
+        self._header = np.frombuffer(self._mmap, dtype=np.int64, count=2)
+        self._arrays = [np.frombuffer(self._mmap, dtype=dtype, count=int(np.prod(shape)), offset=offset).reshape(shape)
+                        for (_, shape, dtype), offset in zip(self._layout, self._offsets)]
+        if create:
+            # a writer that died during a write left the sequence number odd, which readers would skip forever
+            self._header[0] += self._header[0] % 2
+            self._mmap[16:SharedWeights.HEADER_BYTES] = self._digest
+            self._created = True
+        return True
+
+    def write(self, values, version):
+        """
+        :param values: arrays in layout order
+        """
+        self._open(create=True)
+        self._header[0] += 1
+        for arr, value in zip(self._arrays, values):
+            arr[...] = value
+        self._header[1] = version
+        self._header[0] += 1
+
+    def pop(self):
+        """
+        Never blocks
+        :return: version, arrays in layout order if there is a complete write not read yet, else None, None
+        """
+        if self._mmap is not None and not self._created and self._replaced():
+            # the writer closed (removed) the file, and maybe a new writer created another one
+            self.close()
+        if not self._open(create=False):
+            return None, None
+        digest = self._mmap[16:SharedWeights.HEADER_BYTES]
+        if digest != self._digest:
+            if digest.strip('\x00') == '':
+                return None, None
+            raise Exception('Shared weights {0} were written with a different layout'.format(self._fname))
+
+        seq = int(self._header[0])
+        if seq == 0 or seq % 2 == 1 or seq == self._last_seq:
+            return None, None
+        version = int(self._header[1])
+        values = [np.array(arr) for arr in self._arrays]
+        if int(self._header[0]) != seq:
+            # written while copying
+            return None, None
+        self._last_seq = seq
+        return version, values
+
+    def _replaced(self):
+        try:
+            return os.stat(self._fname).st_ino != self._inode
+        except OSError:
+            return True
+
+    def close(self):
+        if self._mmap is not None:
+            self._header = self._arrays = None
+            self._mmap.close()
+            self._mmap = None
+        if self._created:
+            if os.path.exists(self._fname):
+                os.remove(self._fname)
+            self._created = False
@@ -0,0 +1,158 @@
+import os
+import json
+import time
+import argparse
+import threading
+import numpy as np
+
+class Telemetry(object):
+    """
+    Append-only stream of training telemetry, one JSON object per line.
+    Every record has an event name and a wall clock time t. See summarize for the events.
+    Records can be written from several threads.
+    """
+
+    def __init__(self, fname, enabled=True):
+        self._fname = fname
+        self._f = open(fname, 'a') if enabled else None
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return self._f is not None
+
+    def write(self, event, **values):
+        if self._f is None:
+            return
+        values['event'] = event
+        values['t'] = time.time()
+        line = json.dumps(values, default=_to_json) + '\n'
+        with self._lock:
+            self._f.write(line)
+
+    def flush(self):
+        if self._f is not None:
+            self._f.flush()
+
+    def close(self):
+        if self._f is not None:
+            self._f.close()
+            self._f = None
+
+def _to_json(value):
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    raise TypeError('{0} is not JSON serializable'.format(type(value)))
+
+def read(fname):
+    """ :return: list of records, a line cut off by a crash is skipped """
+    records = []
+    with open(fname, 'r') as f:
+        for line in f:
+            try:
+                records.append(json.loads(line))
+            except ValueError:
+                pass
+    return records
+
+###############
+### Summary ###
+###############
+
+def _runs(records):
+    """ Splits records into one list per train call """
+    runs = []
+    for record in records:
+        if record['event'] == 'train_start' or len(runs) == 0:
+            runs.append([])
+        runs[-1].append(record)
+    return runs
+
+def summarize_run(records):
+    """
+    :param records: records of one train call
+    :return: dict of summary statistics
+    """
+    start = [r for r in records if r['event'] == 'train_start']
+    steps = [r for r in records if r['event'] == 'train_step']
+    untraced = [r for r in steps if not r.get('traced', False)]
+    waited = [r for r in steps if r.get('input_wait', None) is not None]
+
+    summary = dict(start[0]) if len(start) > 0 else dict()
+    summary['num_steps'] = len(steps)
+    summary['wall_time'] = records[-1]['t'] - records[0]['t'] if len(records) > 1 else 0.
+    if len(untraced) > 0:
+        step_times = np.array([r['time'] for r in untraced])
+        summary['step_ms'] = 1e3 * step_times.mean()
+        summary['step_p95_ms'] = 1e3 * np.percentile(step_times, 95)
+    if len(waited) > 0:
+        summary['input_wait_pct'] = 100. * sum(r['input_wait'] for r in waited) / sum(r['time'] for r in waited)
+        summary['input_wait_steps'] = len(waited)
+    for key in ('batch_queue', 'no_coll_fnames_queue', 'coll_fnames_queue', 'replay_windows'):
+        values = [r[key] for r in steps if key in r]
+        if len(values) > 0:
+            summary[key] = (np.mean(values), np.min(values))
+    head_rates = [r['head_examples_per_sec'] for r in untraced if 'head_examples_per_sec' in r]
+    if len(head_rates) > 0:
+        summary['head_examples_per_sec'] = np.mean(head_rates, axis=0).tolist()
+    for event in ('validation', 'checkpoint', 'data_update'):
+        stalls = [r['time'] for r in records if r['event'] == event]
+        summary[event] = (len(stalls), sum(stalls))
+    writes = [r for r in records if r['event'] == 'checkpoint_write']
+    if len(writes) > 0:
+        summary['checkpoint_write'] = (len(writes), sum(r['bytes'] for r in writes), sum(r['time'] for r in writes))
+    plans = [r for r in records if r['event'] == 'plan']
+    if len(plans) > 0:
+        iterations = [r['iterations'] for r in plans]
+        summary['plan'] = (len(plans), np.mean(iterations), np.min(iterations),
+                           1e3 * np.mean([r['time'] for r in plans]), sum(r['overrun'] for r in plans))
+    return summary
+
+def format_summary(i, summary):
+    lines = ['Run {0}: {1} steps in {2:.1f}s'.format(i, summary['num_steps'], summary['wall_time'])]
+    if 'step_ms' in summary:
+        lines.append('  step time: {0:.1f} ms mean, {1:.1f} ms p95 ({2:.1f} steps/s)'.format(
+            summary['step_ms'], summary['step_p95_ms'], 1e3 / summary['step_ms']))
+    if 'input_wait_pct' in summary:
+        lines.append('  input wait: {0:.1f}% of step time over {1} steps -> {2}'.format(
+            summary['input_wait_pct'],
+            summary['input_wait_steps'],
+            'input bound' if summary['input_wait_pct'] > 50. else 'compute bound'))
+    for key in ('batch_queue', 'no_coll_fnames_queue', 'coll_fnames_queue', 'replay_windows'):
+        if key in summary:
+            lines.append('  {0}: {1:.0f} mean, {2:.0f} min'.format(key, *summary[key]))
+    if 'head_examples_per_sec' in summary:
+        rates = summary['head_examples_per_sec']
+        lines.append('  examples/s per head: {0:.0f} mean ({1})'.format(
+            np.mean(rates), ', '.join('{0:.0f}'.format(rate) for rate in rates)))
+    for event in ('validation', 'checkpoint', 'data_update'):
+        num, total = summary[event]
+        if num > 0:
+            lines.append('  {0} stalls: {1} totaling {2:.1f}s ({3:.1f}% of wall time)'.format(
+                event, num, total, 100. * total / max(summary['wall_time'], 1e-6)))
+    if 'checkpoint_write' in summary:
+        lines.append('  checkpoint writes: {0} totaling {1:.1f} MB in {2:.1f}s'.format(
+            summary['checkpoint_write'][0], summary['checkpoint_write'][1] / 1e6, summary['checkpoint_write'][2]))
+    if 'plan' in summary:
+        lines.append('  anytime plans: {0}, {1:.1f} mean / {2} min iterations, {3:.1f} ms mean, {4} over the deadline'.format(
+            *summary['plan']))
+    return '\n'.join(lines)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Summarize training telemetry')
+    parser.add_argument('telemetry', type=str, help='telemetry.jsonl, or the experiment folder containing it')
+    parser.add_argument('--all', action='store_true', help='summarize every train call, not just the last')
+    args = parser.parse_args()
+
+    fname = args.telemetry
+    if os.path.isdir(fname):
+        fname = os.path.join(fname, 'telemetry.jsonl')
+    runs = _runs(read(fname))
+    if len(runs) == 0:
+        print('{0} has no records'.format(fname))
+    start = 0 if args.all else max(len(runs) - 1, 0)
+    for i in xrange(start, len(runs)):
+        print(format_summary(i, summarize_run(runs[i])))
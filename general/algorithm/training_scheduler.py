@@ -0,0 +1,97 @@
+class TrainingScheduler(object):
+    """
+    Decides how many steps a train call runs.
+
+    fixed: always steps
+    adaptive: the budget is steps_per_example times the number of training windows added since
+        the last train call, clipped to [min_steps, max_steps]. Training stops early once the
+        validation cost has not improved by min_delta (relative) for patience validations in a row,
+        but never before min_steps. Validations run every val_freq of the budget instead of the steps.
+    """
+
+    def __init__(self, steps, logger, mode='fixed', steps_per_example=0.1, min_steps=100,
+                 max_steps=None, patience=3, min_delta=0.01):
+        if mode not in ('fixed', 'adaptive'):
+            raise Exception('{0} is not valid train schedule mode'.format(mode))
+        self._steps = steps
+        self._logger = logger
+        self._mode = mode
+        self._steps_per_example = steps_per_example
+        self._min_steps = min_steps
+        self._max_steps = max_steps if max_steps is not None else steps
+        assert(self._min_steps <= self._max_steps)
+        self._patience = patience
+        self._min_delta = min_delta
+
+        self._trained_examples = 0
+        self._budget = steps
+        self._best_cost = None
+        self._num_bad = 0
+
+    @property
+    def budget(self):
+        return self._budget
+
+    def validation_interval(self, val_freq):
+        """
+        :param val_freq: fraction of the steps between validations
+        :return: steps between validations of this train call, a fraction of the budget when adaptive
+            so that patience validations fit in it
+        """
+        if self._mode == 'fixed':
+            return max(int(val_freq * self._steps), 1)
+        return max(int(val_freq * self._budget), 1)
+
+    def start(self, num_examples, reset=False):
+        """
+        :param num_examples: number of training windows currently available
+        :param reset: if the weights were reinitialized, all windows are new
+        :return: step budget of this train call
+        """
+        if reset:
+            self._trained_examples = 0
+        num_new = max(num_examples - self._trained_examples, 0)
+        self._trained_examples = num_examples
+        self._best_cost = None
+        self._num_bad = 0
+
+        if self._mode == 'fixed':
+            self._budget = self._steps
+        else:
+            self._budget = int(min(max(self._steps_per_example * num_new, self._min_steps), self._max_steps))
+            self._logger.debug('Train schedule: {0} new windows, budget of {1} steps'.format(num_new, self._budget))
+        return self._budget
+
+    def validated(self, step, cost):
+        """
+        :param cost: mean validation cost at step
+        :return: True if training should stop
+        """
+        if self._mode == 'fixed':
+            return False
+
+        if self._best_cost is None or self._best_cost - cost > self._min_delta * abs(self._best_cost):
+            self._best_cost = cost
+            self._num_bad = 0
+        else:
+            self._num_bad += 1
+
+        if self._num_bad >= self._patience and step >= self._min_steps:
+            self._logger.debug('Train schedule: validation cost plateaued at {0:4.2f}, stopping at step {1}'.format(
+                self._best_cost, step))
+            return True
+        return False
+
+    def finish(self, steps, elapsed):
+        """
+        Logs the time saved against always running the configured steps
+        :param steps: steps run
+        :param elapsed: seconds spent training
+        :return: estimated seconds saved (negative if more steps were run)
+        """
+        if self._mode == 'fixed' or steps == 0:
+            return 0.
+        saved = (self._steps - steps) * elapsed / float(steps)
+        self._logger.info('Train schedule: ran {0} of {1} configured steps (budget {2}), saved {3:.1f}s'.format(
+            steps, self._steps, self._budget, saved))
+        return saved
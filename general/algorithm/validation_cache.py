@@ -0,0 +1,101 @@
+import time
+import threading
+import numpy as np
+
+class ValidationCache(object):
+    """
+    Fixed set of validation windows, materialized once per shard manifest version.
+
+    The windows are read in a background thread when the version changes, so training
+    keeps using the previous set until the new one is ready. Only the very first set is waited on.
+    """
+    FIELDS = ('X', 'U', 'O', 'output', 'len')
+
+    def __init__(self, probcoll_model, max_windows=None, seed=0):
+        """
+        :param max_windows: if the validation data has more windows, a fixed subset is used
+        """
+        self._probcoll_model = probcoll_model
+        self._logger = probcoll_model._logger
+        self._max_windows = max_windows
+        self._seed = seed
+
+        self._lock = threading.Condition()
+        self._data = None
+        self._version = None
+        self._requested_version = None
+        self._thread = None
+        self._error = None
+
+    @property
+    def version(self):
+        return self._version
+
+    def update(self, version):
+        """ Starts building the validation set for version if it is not built or being built """
+        with self._lock:
+            if version == self._requested_version:
+                return
+            self._requested_version = version
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._build_loop)
+                self._thread.daemon = True
+                self._thread.start()
+
+    def get(self):
+        """
+        :return: dict of X, U, O, output, len for every validation window, None if there are none
+        """
+        with self._lock:
+            while self._version is None and self._error is None:
+                self._lock.wait(1.)
+            if self._error is not None:
+                # raised once, the next update builds again
+                error, self._error = self._error, None
+                raise error
+            return self._data
+
+    def _build_loop(self):
+        # keep building until the newest requested version is built
+        while True:
+            with self._lock:
+                version = self._requested_version
+            try:
+                data = self._build()
+            except Exception as e:
+                with self._lock:
+                    self._error = e
+                    # so the same version is built again on the next update
+                    self._requested_version = None
+                    self._thread = None
+                    self._lock.notify_all()
+                return
+            with self._lock:
+                self._data, self._version = data, version
+                self._lock.notify_all()
+                if self._requested_version == version:
+                    self._thread = None
+                    return
+
+    def _build(self):
+        start = time.time()
+        shards = self._probcoll_model._shard_manifest.shards()
+        windows = []
+        for shard in shards:
+            for key in ('no_coll_val', 'coll_val'):
+                shard_windows = self._probcoll_model._read_tfrecords_windows(shard['files'][key])
+                if shard_windows is not None:
+                    windows.append(shard_windows)
+        if len(windows) == 0:
+            return None
+
+        data = dict([(k, np.concatenate([w[k] for w in windows])) for k in ValidationCache.FIELDS])
+        num_windows = len(data['X'])
+        if self._max_windows is not None and num_windows > self._max_windows:
+            # same seed so the subset only changes when the data does
+            idxs = np.sort(np.random.RandomState(self._seed).choice(num_windows, self._max_windows, replace=False))
+            data = dict([(k, v[idxs]) for k, v in data.items()])
+
+        self._logger.debug('Validation cache holds {0} of {1} windows from {2} shards ({3:.2f}s)'.format(
+            len(data['X']), num_windows, len(shards), time.time() - start))
+        return data
@@ -0,0 +1,76 @@
+import copy
+import time
+import multiprocessing
+import numpy as np
+
+from config import params
+from general.benchmark import benchmark_utils
+from general.tf.planning.planner_cem import PlannerCem
+
+
+def _busy():
+    while True:
+        pass
+
+def run(model_cls, npz_fnames, steps=100, deadline_fractions=(0.2, 0.4, 0.8), loads=(0, None)):
+    """
+    Fixed iteration CEM against anytime CEM with deadlines of deadline_fractions of dt, on an idle
+    machine and with busy processes loading it (None is one per cpu). Reports plan time, the
+    ticks that overran dt (fixed) or the deadline (anytime), iterations per plan and cost of the
+    returned sequence. Does not need data.
+    """
+    logger = benchmark_utils.get_benchmark_logger('BenchmarkAnytime')
+    model, old_params = benchmark_utils.create_model(model_cls, 'benchmark_anytime', read_only=True)
+    dt = params['dt']
+    rng = np.random.RandomState(0)
+    observations = [rng.uniform(0., 255., size=max(model.O_idxs()) + 1) for _ in xrange(steps)]
+
+    planners = []
+    for fraction in (None,) + tuple(deadline_fractions):
+        planning_params = copy.deepcopy(params['planning'])
+        planning_params['cem']['warm_start'] = dict(planning_params['cem'].get('warm_start', {}), enabled=False)
+        if fraction is not None:
+            planning_params['cem']['anytime'] = dict(planning_params['cem'].get('anytime', {}),
+                                                     enabled=True, deadline=fraction * dt)
+        planners.append((fraction, PlannerCem(model, planning_params)))
+
+    rows = []
+    for load in loads:
+        num_busy = multiprocessing.cpu_count() if load is None else load
+        busy = [multiprocessing.Process(target=_busy) for _ in xrange(num_busy)]
+        for process in busy:
+            process.daemon = True
+            process.start()
+        try:
+            for fraction, planner in planners:
+                limit = dt if fraction is None else fraction * dt
+                for o in observations[:10]:
+                    planner.plan(None, o, 0, only_noise=False)
+                del planner.anytime_iterations[:]
+                times = []
+                costs = []
+                for o in observations:
+                    start = time.time()
+                    planner.plan(None, o, 0, only_noise=False)
+                    times.append(time.time() - start)
+                    costs.append(planner.last_cost)
+                times = np.array(times)
+                if fraction is None:
+                    mode = 'fixed'
+                    iterations = params['planning']['cem']['num_iters']
+                else:
+                    mode = 'anytime {0:.0f}ms'.format(1e3 * limit)
+                    iterations = np.mean(planner.anytime_iterations)
+                rows.append([num_busy, mode, '{0:.2f}'.format(1e3 * times.mean()),
+                             '{0:.2f}'.format(1e3 * np.percentile(times, 95)),
+                             '{0:.1f}%'.format(100. * np.mean(times > limit)),
+                             '{0:.1f}'.format(iterations), '{0:.4f}'.format(np.mean(costs))])
+        finally:
+            for process in busy:
+                process.terminate()
+                process.join()
+    model.close()
+    benchmark_utils.restore_params(old_params)
+
+    benchmark_utils.log_table(logger, ['busy', 'mode', 'ms', 'p95 ms', 'overrun', 'iters', 'cost'], rows)
+    return rows
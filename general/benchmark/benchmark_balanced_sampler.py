@@ -0,0 +1,29 @@
+import numpy as np
+
+from config import params
+from general.algorithm.balanced_sampler import BalancedSampler
+from general.benchmark import benchmark_utils
+
+
+def run(model_cls, npz_fnames, steps=100, num_windows=1000000, num_itrs=100):
+    """
+    Times balancing num_windows synthetic windows, with and without recency weights.
+    Does not need a model or data.
+    """
+    logger = benchmark_utils.get_benchmark_logger('BenchmarkBalancedSampler')
+    pct_coll = params['model'].get('pct_coll', 0.5)
+    classes = (np.random.random(num_windows) < 0.05).astype(np.int64)
+    itrs = np.sort(np.random.randint(0, num_itrs, size=num_windows))
+
+    rows = []
+    for recency_decay in (None, 0.9):
+        sampler = BalancedSampler([1. - pct_coll, pct_coll], recency_decay=recency_decay)
+        set_data_time, _ = benchmark_utils.time_runs(lambda: sampler.set_data(classes, itrs=itrs), steps)
+        for num, num_bootstrap in ((params['model']['batch_size'], params['model']['num_bootstrap']),
+                                   (num_windows, params['model']['num_bootstrap'])):
+            sample_time, _ = benchmark_utils.time_runs(lambda: sampler.sample(num, num_bootstrap=num_bootstrap), steps)
+            rows.append([str(recency_decay), num_windows, '{0}x{1}'.format(num_bootstrap, num),
+                         '{0:.2f}'.format(1e3 * set_data_time), '{0:.3f}'.format(1e3 * sample_time)])
+
+    benchmark_utils.log_table(logger, ['recency_decay', 'windows', 'draw', 'set_data ms', 'sample ms'], rows)
+    return rows
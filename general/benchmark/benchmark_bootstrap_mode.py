@@ -0,0 +1,22 @@
+from general.benchmark import benchmark_utils
+
+
+def run(model_cls, npz_fnames, steps=100, bootstrap_modes=('resample', 'online')):
+    """
+    Compares input pipeline throughput of reading a batch per bootstrap against
+    reading one batch shared by all bootstraps
+    """
+    logger = benchmark_utils.get_benchmark_logger('BenchmarkBootstrapMode')
+    rows = []
+    for bootstrap_mode in bootstrap_modes:
+        logger.info('Benchmarking bootstrap mode {0}'.format(bootstrap_mode))
+        num_bytes, write_time, records_per_sec = benchmark_utils.benchmark_input_pipeline(
+            model_cls,
+            'benchmark_bootstrap_mode_{0}'.format(bootstrap_mode),
+            {'bootstrap_mode': bootstrap_mode},
+            npz_fnames,
+            steps)
+        rows.append([bootstrap_mode, '{0:.0f}'.format(records_per_sec)])
+
+    benchmark_utils.log_table(logger, ['bootstrap_mode', 'bootstrap examples/s'], rows)
+    return rows
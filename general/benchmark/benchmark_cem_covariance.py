@@ -0,0 +1,55 @@
+import copy
+import numpy as np
+import tensorflow as tf
+
+from config import params
+from general.benchmark import benchmark_utils
+from general.tf.planning.cem_covariance import get_cem_covariance
+from general.tf.planning.planner_cem import PlannerCem
+
+
+def run(model_cls, npz_fnames, steps=100, horizon_scales=(1, 2, 4), covariances=('full', 'diag', 'lowrank')):
+    """
+    Time of a CEM iteration with every covariance type, at the shipped horizon and longer ones.
+    'refit ms' is the refit and sampling of the distribution alone, 'iter ms' a whole planner
+    iteration (with the evaluation of the M samples), from the planner with num_iters 2
+    against the planner with num_iters 0. Does not need data.
+    """
+    logger = benchmark_utils.get_benchmark_logger('BenchmarkCemCovariance')
+    cem_params = params['planning']['cem']
+    base_T = params['model']['T']
+
+    rows = []
+    for scale in horizon_scales:
+        T = scale * base_T
+        model, old_params = benchmark_utils.create_model(model_cls, 'benchmark_cem_covariance_T{0}'.format(T),
+                                                         {'T': T}, read_only=True)
+        dU = len(params['planning']['control_range']['lower'])
+        o = np.random.uniform(0., 255., size=max(model.O_idxs()) + 1)
+        for covariance_type in covariances:
+            planning_params = copy.deepcopy(params['planning'])
+            planning_params['cem']['covariance'] = covariance_type
+            planning_params['cem']['warm_start'] = dict(planning_params['cem'].get('warm_start', {}), enabled=False)
+
+            covariance = get_cem_covariance(planning_params['cem'], T * dU, dtype=model.dtype)
+            with tf.name_scope('benchmark_refit'):
+                top_controls = tf.random_uniform((cem_params['K'], T * dU), dtype=model.dtype)
+                top_mean = tf.reduce_mean(top_controls, axis=0)
+                samples = covariance.sample(top_mean, covariance.fit(top_controls - top_mean), cem_params['M'])
+            refit_time, _ = benchmark_utils.time_runs(lambda: model.sess.run(samples), steps, num_warmup=10)
+
+            plan_times = []
+            for num_iters in (0, 2):
+                planning_params['cem']['num_iters'] = num_iters
+                planner = PlannerCem(model, planning_params)
+                plan_time, _ = benchmark_utils.time_runs(lambda: planner.plan(None, o, 0, only_noise=False),
+                                                         steps, num_warmup=10)
+                plan_times.append(plan_time)
+            iter_time = (plan_times[1] - plan_times[0]) / 2.
+
+            rows.append([T, covariance_type, '{0:.3f}'.format(1e3 * refit_time), '{0:.2f}'.format(1e3 * iter_time)])
+        model.close()
+        benchmark_utils.restore_params(old_params)
+
+    benchmark_utils.log_table(logger, ['T', 'covariance', 'refit ms', 'iter ms'], rows)
+    return rows
@@ -0,0 +1,61 @@
+import copy
+import time
+import numpy as np
+
+from config import params
+from general.benchmark import benchmark_utils
+from general.tf.planning.planner_cem import PlannerCem
+
+
+def run(model_cls, npz_fnames, steps=100, episode_len=20,
+        warm_configs=((64, 0), (128, 0), (128, 1), (256, 1))):
+    """
+    Cost of the plans against the samples evaluated per control step, cold CEM against warm started
+    CEM with (M, num_iters) of warm_configs. Every planner sees the same episodes of observations
+    drifting from a random start, the planner is reset at the start of an episode, so the
+    first step is cold for every planner and is not counted. Does not need data.
+    :param steps: control steps per planner
+    """
+    logger = benchmark_utils.get_benchmark_logger('BenchmarkCemWarmStart')
+    model, old_params = benchmark_utils.create_model(model_cls, 'benchmark_cem_warm_start', read_only=True)
+    dim_o = max(model.O_idxs()) + 1
+
+    rng = np.random.RandomState(0)
+    observations = []
+    for t in xrange(steps):
+        if t % episode_len == 0:
+            o = rng.uniform(0., 255., size=dim_o)
+        else:
+            o = np.clip(o + rng.normal(0., 5., size=dim_o), 0., 255.)
+        observations.append(o)
+
+    configs = [('cold', params['planning']['cem']['init_M'], params['planning']['cem']['num_iters'])]
+    configs += [('warm', m, num_iters) for m, num_iters in warm_configs]
+    rows = []
+    for mode, m, num_iters in configs:
+        planning_params = copy.deepcopy(params['planning'])
+        planning_params['cem']['warm_start'] = dict(planning_params['cem'].get('warm_start', {}),
+                                                    enabled=(mode == 'warm'), M=m, num_iters=num_iters)
+        planner = PlannerCem(model, planning_params)
+        samples = planner.warm_samples_per_plan if mode == 'warm' else planner.samples_per_plan
+        # warm up
+        for t in xrange(2):
+            planner.plan(None, observations[t], t, only_noise=False)
+
+        costs = []
+        times = []
+        for t, o in enumerate(observations):
+            if t % episode_len == 0:
+                planner.reset()
+            start = time.time()
+            planner.plan(None, o, t % episode_len, only_noise=False)
+            if t % episode_len != 0:
+                times.append(time.time() - start)
+                costs.append(planner.last_cost)
+        rows.append([mode, m, num_iters, samples, '{0:.4f}'.format(np.mean(costs)),
+                     '{0:.4f}'.format(np.std(costs)), '{0:.2f}'.format(1e3 * np.mean(times))])
+    model.close()
+    benchmark_utils.restore_params(old_params)
+
+    benchmark_utils.log_table(logger, ['mode', 'M', 'iters', 'samples/step', 'cost', 'std cost', 'ms'], rows)
+    return rows
@@ -0,0 +1,49 @@
+import time
+
+from config import params
+from general.benchmark import benchmark_utils
+
+
+def run(model_cls, npz_fnames, steps=100, num_workers=(1, 2, 4, 8)):
+    """
+    Training throughput with 1 to N data parallel processes on this host.
+    Every process trains on its own batch, so a step trains on num_workers batches.
+    """
+    logger = benchmark_utils.get_benchmark_logger('BenchmarkDataParallel')
+    if len(npz_fnames) == 0:
+        logger.info('Data parallel benchmark needs data, pass -data')
+        return []
+
+    rows = []
+    base_examples_per_sec = None
+    for num in num_workers:
+        logger.info('Benchmarking {0} data parallel processes'.format(num))
+        model, old_params = benchmark_utils.create_model(
+            model_cls,
+            'benchmark_data_parallel_{0}'.format(num),
+            {'data_parallel_workers': num})
+        model.add_data(list(npz_fnames))
+        model._prepare_data_source()
+        if num > 1:
+            # starts the workers, the first steps include their start up
+            model._data_parallel_resume()
+        fetches = [model.d_train['cost']]
+        for _ in xrange(10):
+            model._train_step(fetches)
+        start = time.time()
+        for _ in xrange(steps):
+            model._train_step(fetches)
+        step_time = (time.time() - start) / float(steps)
+        if num > 1:
+            model._data_parallel.pause()
+        model.close()
+        benchmark_utils.restore_params(old_params)
+
+        examples_per_sec = num * params['model']['batch_size'] / step_time
+        if base_examples_per_sec is None:
+            base_examples_per_sec = examples_per_sec
+        rows.append([num, '{0:.2f}'.format(1e3 * step_time), '{0:.0f}'.format(examples_per_sec),
+                     '{0:.2f}x'.format(examples_per_sec / base_examples_per_sec)])
+
+    benchmark_utils.log_table(logger, ['workers', 'step ms', 'examples/s', 'speedup'], rows)
+    return rows
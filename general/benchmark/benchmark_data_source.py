@@ -0,0 +1,45 @@
+import time
+
+from general.benchmark import benchmark_utils
+
+
+def run(model_cls, npz_fnames, steps=100, data_sources=('queue', 'replay')):
+    """
+    Compares training steps/sec for each data source, and how long it takes
+    for newly added data to become available to training
+    """
+    logger = benchmark_utils.get_benchmark_logger('BenchmarkDataSource')
+    npz_fnames = list(npz_fnames)
+    rows = []
+    for data_source in data_sources:
+        logger.info('Benchmarking data source {0}'.format(data_source))
+        model, old_params = benchmark_utils.create_model(
+            model_cls,
+            'benchmark_data_source_{0}'.format(data_source),
+            {'data_source': data_source})
+        # hold back the last file to time adding new data
+        model.add_data(npz_fnames[:max(1, len(npz_fnames) - 1)])
+
+        start = time.time()
+        model._prepare_data_source()
+        prepare_time = time.time() - start
+
+        fetches = [model.d_train['optimizer']]
+        mean_time, std_time = benchmark_utils.time_runs(
+            lambda: model._run_batch(model.d_train, fetches), steps, num_warmup=10)
+
+        update_time = float('nan')
+        if len(npz_fnames) > 1:
+            model.add_data(npz_fnames[-1:])
+            start = time.time()
+            model._update_data_source()
+            model._run_batch(model.d_train, fetches)
+            update_time = time.time() - start
+
+        rows.append([data_source, '{0:.1f}'.format(1. / mean_time), '{0:.2f}'.format(1e3 * std_time),
+                     '{0:.2f}'.format(prepare_time), '{0:.2f}'.format(update_time)])
+        model.close()
+        benchmark_utils.restore_params(old_params)
+
+    benchmark_utils.log_table(logger, ['data_source', 'steps/s', 'std ms', 'prepare s', 'new data s'], rows)
+    return rows
@@ -0,0 +1,33 @@
+from config import params
+from general.benchmark import benchmark_utils
+
+
+def run(model_cls, npz_fnames, steps=100, num_bootstraps=(1, 4, 8, 16), ensemble_modes=('separate', 'fused')):
+    """
+    Times the eval inference graph at the batch sizes the planner uses, with a subgraph
+    per bootstrap against stacked bootstrap weights, and reports the FLOPs of its convolutions
+    per observation. Does not need data.
+    """
+    logger = benchmark_utils.get_benchmark_logger('BenchmarkEnsemble')
+    # dropout is not supported by fused ensembles
+    action_graph = dict(params['model']['action_graph'], dropout=None)
+
+    rows = []
+    for num_bootstrap in num_bootstraps:
+        for ensemble_mode in ensemble_modes:
+            logger.info('Benchmarking {0} ensemble with {1} bootstraps'.format(ensemble_mode, num_bootstrap))
+            model, old_params = benchmark_utils.create_model(
+                model_cls,
+                'benchmark_ensemble_{0}_{1}'.format(ensemble_mode, num_bootstrap),
+                {'ensemble_mode': ensemble_mode, 'num_bootstrap': num_bootstrap, 'action_graph': action_graph},
+                read_only=True)
+            mflops = benchmark_utils.conv_flops(model.d_eval['output_pred_mean']) / 1e6
+            for batch_size in benchmark_utils.planner_batch_sizes():
+                mean_time, std_time = benchmark_utils.time_eval(model, batch_size, steps)
+                rows.append([num_bootstrap, ensemble_mode, '{0:.2f}'.format(mflops), batch_size,
+                             '{0:.2f}'.format(1e3 * mean_time), '{0:.2f}'.format(1e3 * std_time)])
+            model.close()
+            benchmark_utils.restore_params(old_params)
+
+    benchmark_utils.log_table(logger, ['num_bootstrap', 'ensemble_mode', 'conv MFLOPs', 'batch', 'ms', 'std ms'], rows)
+    return rows
@@ -0,0 +1,32 @@
+import time
+import shutil
+
+from general.benchmark import benchmark_utils
+
+
+def run(model_cls, npz_fnames, steps=100, repeats=3):
+    """
+    Model construction time building and exporting the graph (cold) against importing
+    the cached graph (warm). Does not need data, steps is unused.
+    """
+    logger = benchmark_utils.get_benchmark_logger('BenchmarkGraphCache')
+
+    times = {'cold': [], 'warm': []}
+    model, old_params = benchmark_utils.create_model(model_cls, 'benchmark_graph_cache', {'graph_cache': True},
+                                                     read_only=True)
+    graph_cache_dir = model._graph_cache_dir
+    model.close()
+    for _ in xrange(repeats):
+        shutil.rmtree(graph_cache_dir, ignore_errors=True)
+        for start in ('cold', 'warm'):
+            start_time = time.time()
+            model = model_cls(read_only=True)
+            times[start].append(time.time() - start_time)
+            model.close()
+    benchmark_utils.restore_params(old_params)
+
+    rows = [[start, '{0:.2f}'.format(min(times[start])), '{0:.2f}'.format(sum(times[start]) / len(times[start]))]
+            for start in ('cold', 'warm')]
+    benchmark_utils.log_table(logger, ['start', 'min s', 'mean s'], rows)
+    logger.info('Speedup: {0:.2f}x'.format(min(times['cold']) / min(times['warm'])))
+    return rows
@@ -0,0 +1,63 @@
+import copy
+import numpy as np
+
+from config import params
+from general.benchmark import benchmark_utils
+from general.tf.planning.planner_cem import PlannerCem
+from general.tf.planning.planner_mppi import PlannerMppi
+
+
+def run(model_cls, npz_fnames, steps=100, cem_iters=(0, 1, 2, 3),
+        mppi_configs=((256, 1), (512, 1), (1024, 1), (2048, 1), (256, 2), (512, 2), (1024, 2))):
+    """
+    MPPI against CEM at equal latency budgets. Every CEM planner (cem params with num_iters of
+    cem_iters) sets a budget, the MPPI planner with the lowest cost among mppi_configs (M, num_iters)
+    within the budget is compared to it. The cost is of the planned sequence (the best sample for
+    CEM, the weighted average for MPPI), averaged over random observations. Does not need data.
+    """
+    logger = benchmark_utils.get_benchmark_logger('BenchmarkMppi')
+    model, old_params = benchmark_utils.create_model(model_cls, 'benchmark_mppi', read_only=True)
+    rng = np.random.RandomState(0)
+    observations = [rng.uniform(0., 255., size=max(model.O_idxs()) + 1) for _ in xrange(steps)]
+
+    def evaluate(planner):
+        mean_time, _ = benchmark_utils.time_runs(
+            lambda: model.sess.run(planner.action, feed_dict=planner._feed_dict(observations[0])),
+            steps, num_warmup=10)
+        costs = [model.sess.run(planner.cost, feed_dict=planner._feed_dict(o)) for o in observations]
+        return mean_time, np.mean(costs)
+
+    cem_results = []
+    for num_iters in cem_iters:
+        planning_params = copy.deepcopy(params['planning'])
+        planning_params['cem']['num_iters'] = num_iters
+        planning_params['cem']['warm_start'] = dict(planning_params['cem'].get('warm_start', {}), enabled=False)
+        planner = PlannerCem(model, planning_params)
+        cem_results.append((num_iters, planner.samples_per_plan) + evaluate(planner))
+
+    mppi_results = []
+    for m, num_iters in mppi_configs:
+        planning_params = copy.deepcopy(params['planning'])
+        planning_params['mppi'].update({'M': m, 'num_iters': num_iters})
+        planner = PlannerMppi(model, planning_params)
+        mppi_results.append((m, num_iters) + evaluate(planner))
+    model.close()
+    benchmark_utils.restore_params(old_params)
+
+    rows = []
+    for num_iters, samples, cem_time, cem_cost in cem_results:
+        row = ['{0:.2f}'.format(1e3 * cem_time), num_iters, samples, '{0:.4f}'.format(cem_cost)]
+        within = [result for result in mppi_results if result[2] <= cem_time]
+        if len(within) > 0:
+            m, mppi_iters, mppi_time, mppi_cost = min(within, key=lambda result: result[3])
+            row += ['{0}x{1}'.format(m, mppi_iters), '{0:.2f}'.format(1e3 * mppi_time), '{0:.4f}'.format(mppi_cost)]
+        else:
+            row += ['-', '-', '-']
+        rows.append(row)
+
+    benchmark_utils.log_table(logger, ['budget ms', 'cem iters', 'cem samples', 'cem cost',
+                                       'mppi MxN', 'mppi ms', 'mppi cost'], rows)
+    benchmark_utils.log_table(logger, ['mppi M', 'rounds', 'ms', 'cost'],
+                              [[m, num_iters, '{0:.2f}'.format(1e3 * t), '{0:.4f}'.format(cost)]
+                               for m, num_iters, t, cost in mppi_results])
+    return rows
@@ -0,0 +1,42 @@
+import numpy as np
+
+from config import params
+from general.benchmark import benchmark_utils
+from robots.rccar.tf.planning.planner_primitives_rccar import PlannerPrimitivesRCcar
+
+
+def run(model_cls, npz_fnames, steps=100, planner_cls=PlannerPrimitivesRCcar):
+    """
+    Latency of planning with the primitives evaluated as a prefix tree against the flat
+    enumeration, with the reduction of recurrent step FLOPs. Does not need data.
+    """
+    logger = benchmark_utils.get_benchmark_logger('BenchmarkPrimitivesTree')
+    model, old_params = benchmark_utils.create_model(
+        model_cls,
+        'benchmark_primitives_tree',
+        {'action_graph': dict(params['model']['action_graph'], dropout=None)},
+        read_only=True)
+    feed = {
+        model.d_eval['X_inputs']: [[[]] * model.T],
+        model.d_eval['O_input']: np.random.uniform(0., 255., size=(1, model.dO))
+    }
+
+    rows = []
+    times = dict()
+    for eval_mode in ('flat', 'tree'):
+        planning_params = dict(params['planning'])
+        planning_params['primitives'] = dict(planning_params['primitives'], eval_mode=eval_mode)
+        planner = planner_cls(model, planning_params)
+        times[eval_mode], std_time = benchmark_utils.time_runs(
+            lambda: model.sess.run(planner.action, feed_dict=feed), steps, num_warmup=10)
+        if eval_mode == 'tree':
+            flop_reduction = planner.flop_reduction
+        rows.append([eval_mode, int(planner.primitives.get_shape()[0]),
+                     '{0:.2f}'.format(1e3 * times[eval_mode]), '{0:.2f}'.format(1e3 * std_time)])
+    model.close()
+    benchmark_utils.restore_params(old_params)
+
+    benchmark_utils.log_table(logger, ['eval_mode', 'primitives', 'ms', 'std ms'], rows)
+    logger.info('Recurrent step FLOPs reduced {0:.1f}x, latency reduced {1:.2f}x'.format(
+        flop_reduction, times['flat'] / times['tree']))
+    return rows
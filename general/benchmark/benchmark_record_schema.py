@@ -0,0 +1,26 @@
+from config import params
+from general.benchmark import benchmark_utils
+
+
+def run(model_cls, npz_fnames, steps=100, record_dtypes=(None, {'X': 'float32', 'U': 'float32', 'O': 'uint8'})):
+    """
+    Compares float list records against raw bytes records for the configured save type:
+    bytes on disk, write time and input pipeline records/sec
+    """
+    logger = benchmark_utils.get_benchmark_logger('BenchmarkRecordSchema')
+    rows = []
+    for dtypes in record_dtypes:
+        name = 'floatlist' if dtypes is None else 'raw_' + '_'.join(
+            '{0}{1}'.format(field, dtypes[field]) for field in ('X', 'U', 'O'))
+        logger.info('Benchmarking record schema {0} ({1})'.format(name, params['model']['save_type']))
+        num_bytes, write_time, records_per_sec = benchmark_utils.benchmark_input_pipeline(
+            model_cls,
+            'benchmark_record_schema_{0}'.format(name),
+            {'record_dtypes': dtypes},
+            npz_fnames,
+            steps)
+        rows.append([name, '{0:.1f}'.format(num_bytes / 1e6), '{0:.2f}'.format(write_time),
+                     '{0:.0f}'.format(records_per_sec)])
+
+    benchmark_utils.log_table(logger, ['schema', 'MB on disk', 'write s', 'records/s'], rows)
+    return rows
@@ -0,0 +1,22 @@
+from general.benchmark import benchmark_utils
+
+
+def run(model_cls, npz_fnames, steps=100, save_types=('fixedlen', 'window')):
+    """
+    Compares bytes on disk, write time and input pipeline records/sec for each save type
+    """
+    logger = benchmark_utils.get_benchmark_logger('BenchmarkSaveType')
+    rows = []
+    for save_type in save_types:
+        logger.info('Benchmarking save type {0}'.format(save_type))
+        num_bytes, write_time, records_per_sec = benchmark_utils.benchmark_input_pipeline(
+            model_cls,
+            'benchmark_save_type_{0}'.format(save_type),
+            {'save_type': save_type},
+            npz_fnames,
+            steps)
+        rows.append([save_type, '{0:.1f}'.format(num_bytes / 1e6), '{0:.2f}'.format(write_time),
+                     '{0:.0f}'.format(records_per_sec)])
+
+    benchmark_utils.log_table(logger, ['save_type', 'MB on disk', 'write s', 'records/s'], rows)
+    return rows
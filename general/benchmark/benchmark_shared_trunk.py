@@ -0,0 +1,36 @@
+from config import params
+from general.benchmark import benchmark_utils
+
+
+def run(model_cls, npz_fnames, steps=100, num_bootstraps=(4, 8)):
+    """
+    Speedup of sharing the observation graph between bootstraps, for eval inference at the
+    planner batch sizes and for training steps (only if there is data)
+    """
+    logger = benchmark_utils.get_benchmark_logger('BenchmarkSharedTrunk')
+    rows = []
+    for num_bootstrap in num_bootstraps:
+        times = dict()
+        for shared_trunk in (False, True):
+            logger.info('Benchmarking shared trunk {0} with {1} bootstraps'.format(shared_trunk, num_bootstrap))
+            model, old_params = benchmark_utils.create_model(
+                model_cls,
+                'benchmark_shared_trunk_{0}_{1}'.format(shared_trunk, num_bootstrap),
+                {'shared_trunk': shared_trunk, 'num_bootstrap': num_bootstrap})
+            for batch_size in benchmark_utils.planner_batch_sizes():
+                times[(shared_trunk, 'eval', batch_size)], _ = benchmark_utils.time_eval(model, batch_size, steps)
+            if len(npz_fnames) > 0:
+                times[(shared_trunk, 'train', params['model']['batch_size'])], _ = \
+                    benchmark_utils.time_train_step(model, npz_fnames, steps)
+            model.close()
+            benchmark_utils.restore_params(old_params)
+
+        for (shared_trunk, graph, batch_size), shared_time in sorted(times.items()):
+            if not shared_trunk:
+                continue
+            separate_time = times[(False, graph, batch_size)]
+            rows.append([num_bootstrap, graph, batch_size, '{0:.2f}'.format(1e3 * separate_time),
+                         '{0:.2f}'.format(1e3 * shared_time), '{0:.2f}x'.format(separate_time / shared_time)])
+
+    benchmark_utils.log_table(logger, ['num_bootstrap', 'graph', 'batch', 'separate ms', 'shared ms', 'speedup'], rows)
+    return rows
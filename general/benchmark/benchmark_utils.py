@@ -0,0 +1,126 @@
+import os
+import copy
+import time
+import numpy as np
+
+from general.utility.logger import get_logger
+from config import params, set_params
+
+
+def get_benchmark_logger(name):
+    save_dir = os.path.join(params['exp_dir'], params['exp_name'])
+    if not os.path.exists(save_dir):
+        os.makedirs(save_dir)
+    return get_logger(name, 'info', os.path.join(save_dir, 'benchmark.txt'))
+
+def create_model(model_cls, exp_name, model_params={}, read_only=False):
+    """
+    Creates a model in its own experiment folder with model params overridden.
+    Params are left modified, use restore_params after the model is closed.
+    :param read_only: the benchmark does not add data (see ProbcollModel)
+    """
+    old_params = copy.deepcopy(params)
+    params['exp_name'] = '{0}_{1}'.format(params['exp_name'], exp_name)
+    params['model'].update(copy.deepcopy(model_params))
+    model = model_cls(read_only=read_only)
+    return model, old_params
+
+def restore_params(old_params):
+    set_params(old_params, clear=True)
+
+def dir_size(dir):
+    return sum(os.path.getsize(os.path.join(dir, fn)) for fn in os.listdir(dir))
+
+def time_runs(func, num_runs, num_warmup=1):
+    """
+    :return: mean and std of func run times in seconds
+    """
+    for _ in xrange(num_warmup):
+        func()
+    times = []
+    for _ in xrange(num_runs):
+        start = time.time()
+        func()
+        times.append(time.time() - start)
+    return np.mean(times), np.std(times)
+
+def benchmark_input_pipeline(model_cls, exp_name, model_params, npz_fnames, steps):
+    """
+    Converts npz_fnames with a model created by create_model and times the training input pipeline
+    :return: bytes on disk, write time, records/sec
+    """
+    model, old_params = create_model(model_cls, exp_name, model_params)
+
+    start = time.time()
+    model.add_data(list(npz_fnames))
+    write_time = time.time() - start
+
+    num_bytes = sum(dir_size(dir) for dir in (
+            model._no_coll_train_tfrecords_dir,
+            model._coll_train_tfrecords_dir,
+            model._no_coll_val_tfrecords_dir,
+            model._coll_val_tfrecords_dir))
+
+    model._prepare_data_source()
+    fetches = [model.d_train['X_inputs'], model.d_train['U_inputs'], model.d_train['O_inputs'],
+               model.d_train['outputs'], model.d_train['len']]
+    mean_time, _ = time_runs(lambda: model._run_batch(model.d_train, fetches), steps, num_warmup=10)
+    records_per_sec = model.batch_size * model.num_bootstrap / mean_time
+
+    model.close()
+    restore_params(old_params)
+    return num_bytes, write_time, records_per_sec
+
+def planner_batch_sizes():
+    """ :return: batch sizes the eval graph is run at by the planners """
+    num_dp = params['planning']['num_dp']
+    return sorted(set([1,
+                       params['planning']['cem']['M'] * num_dp,
+                       params['planning']['cem']['init_M'] * num_dp]))
+
+def eval_feed(model, batch_size):
+    """ :return: feed of random inputs for model.d_eval """
+    return {
+        model.d_eval['X_inputs']: np.random.random((batch_size, model.T, model.dX)),
+        model.d_eval['U_inputs']: np.random.uniform(
+            model.control_range['lower'],
+            model.control_range['upper'],
+            size=(batch_size, model.T, model.dU)),
+        model.d_eval['O_input']: np.random.uniform(0., 255., size=(1, model.dO))
+    }
+
+def time_eval(model, batch_size, steps):
+    """ :return: mean and std of the eval graph run time in seconds """
+    feed = eval_feed(model, batch_size)
+    return time_runs(lambda: model.sess.run(model.d_eval['output_pred_mean'], feed_dict=feed), steps, num_warmup=10)
+
+def time_train_step(model, npz_fnames, steps):
+    """ :return: mean and std of the training step run time in seconds, after adding npz_fnames """
+    model.add_data(list(npz_fnames))
+    model._prepare_data_source()
+    fetches = [model.d_train['optimizer'], model.d_train['cost']]
+    return time_runs(lambda: model._run_batch(model.d_train, fetches), steps, num_warmup=10)
+
+def conv_flops(tensor):
+    """ :return: floating point operations of the convolutions tensor depends on, per example """
+    flops = 0
+    visited = set()
+    ops = [tensor.op]
+    while len(ops) > 0:
+        op = ops.pop()
+        if op in visited:
+            continue
+        visited.add(op)
+        if op.type == 'Conv2D':
+            out_shape = op.outputs[0].get_shape().as_list()
+            filter_shape = op.inputs[1].get_shape().as_list()
+            flops += 2 * np.prod(out_shape[1:]) * np.prod(filter_shape[:3])
+        ops += [t.op for t in op.inputs] + list(op.control_inputs)
+    return flops
+
+def log_table(logger, header, rows):
+    widths = [max(len(str(r[i])) for r in [header] + rows) for i in xrange(len(header))]
+    fmt = '  '.join('{{{0}:>{1}}}'.format(i, w) for i, w in enumerate(widths))
+    logger.info(fmt.format(*header))
+    for row in rows:
+        logger.info(fmt.format(*row))
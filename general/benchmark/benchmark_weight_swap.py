@@ -0,0 +1,48 @@
+import os
+
+from general.algorithm.shared_weights import SharedWeights
+from general.benchmark import benchmark_utils
+
+
+def run(model_cls, npz_fnames, steps=100):
+    """
+    Times refreshing the model weights with a full checkpoint restore against
+    reading the inference weights from shared memory and assigning them with one op.
+    Does not need data.
+    """
+    logger = benchmark_utils.get_benchmark_logger('BenchmarkWeightSwap')
+    model, old_params = benchmark_utils.create_model(model_cls, 'benchmark_weight_swap', read_only=True)
+
+    model_file = os.path.join(model._checkpoints_dir, 'benchmark.ckpt')
+    model.save(model_file)
+    restore_time, restore_std = benchmark_utils.time_runs(lambda: model.load(model_file), steps)
+
+    writer = SharedWeights(model._shared_weights_fname, model._inference_weights_layout())
+    reader = SharedWeights(model._shared_weights_fname, model._inference_weights_layout())
+    values = model.get_inference_weights()
+    write_time, write_std = benchmark_utils.time_runs(lambda: writer.write(values, 0), steps)
+
+    def swap():
+        writer.write(values, 0)
+        _, read_values = reader.pop()
+        return read_values
+    read_time, read_std = benchmark_utils.time_runs(swap, steps)
+    read_time -= write_time
+    read_values = swap()
+    assign_time, assign_std = benchmark_utils.time_runs(lambda: model.set_inference_weights(read_values), steps)
+
+    rows = [
+        ['saver restore', '{0:.2f}'.format(1e3 * restore_time), '{0:.2f}'.format(1e3 * restore_std)],
+        ['shm write (trainer)', '{0:.2f}'.format(1e3 * write_time), '{0:.2f}'.format(1e3 * write_std)],
+        ['shm read (planner)', '{0:.2f}'.format(1e3 * read_time), '{0:.2f}'.format(1e3 * read_std)],
+        ['grouped assign (planner)', '{0:.2f}'.format(1e3 * assign_time), '{0:.2f}'.format(1e3 * assign_std)]
+    ]
+    logger.info('{0} inference weights, {1:.2f} MB'.format(len(values), writer.num_bytes / 1e6))
+    benchmark_utils.log_table(logger, ['refresh', 'ms', 'std ms'], rows)
+
+    writer.close()
+    reader.close()
+    os.remove(model._shared_weights_fname)
+    model.close()
+    benchmark_utils.restore_params(old_params)
+    return rows
@@ -9,3 +9,6 @@ class OpenLoopPolicy(Policy):
     def act(self, x, obs, t, only_noise=False):
         u, u_no_noise = self._planner.plan(x, obs, t, only_noise=only_noise)
         return u, u_no_noise
+
+    def reset(self):
+        self._planner.reset()
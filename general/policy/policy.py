@@ -22,6 +22,12 @@ class Policy(UncopyableClass):
         """
         raise NotImplementedError()
 
+    def reset(self):
+        """
+        Called when a rollout starts
+        """
+        pass
+
     def get_info(self):
         """
         Keeps track of relevant info for saving
@@ -207,6 +207,10 @@ class Sample(object):
 
     @staticmethod
     def save(fname, samples):
+        from general.state_info import sample_archive
+        if os.path.splitext(fname)[-1] == sample_archive.EXT:
+            return sample_archive.SampleArchive.save(fname, samples)
+
         assert(os.path.splitext(fname)[-1] == '.npz')
         meta_datas = [s._meta_data for s in samples]
         Xs = [s.get_X() for s in samples]
@@ -217,6 +221,11 @@ class Sample(object):
     @staticmethod
     def load(fname):
         assert(os.path.exists(fname))
+        from general.state_info import sample_archive
+        if os.path.splitext(fname)[-1] == sample_archive.EXT:
+            # lazy views into memory mapped arrays
+            return sample_archive.SampleArchive.load(fname)
+
         samples = []
 
         assert (os.path.splitext(fname)[-1] == '.npz')
@@ -0,0 +1,180 @@
+import os
+import argparse
+import pickle
+import numpy as np
+
+from general.state_info.sample import Sample
+
+EXT = '.samples'
+
+class SampleArchive(object):
+    """
+    Columnar on-disk format for a list of Samples.
+
+    <fname>.samples/
+        schema.pkl      field dtypes/dims, unique meta datas, number of samples
+        offsets.npy     start of each sample in the concatenated fields (num_samples + 1)
+        meta_idxs.npy   index into the unique meta datas for each sample
+        X.dat, U.dat, O.dat
+                        all samples concatenated along time, opened with np.memmap
+
+    Loaded Samples are views into the memmaps, so only the pages that are read are touched.
+    The memmaps are copy on write: Samples can be modified in place as before, the changes stay
+    in memory and never reach the archive.
+    """
+    FIELDS = ('X', 'U', 'O')
+    VERSION = 1
+
+    def __init__(self, fname):
+        assert(os.path.splitext(fname)[-1] == EXT)
+        assert(os.path.isdir(fname))
+        self.fname = fname
+
+        with open(os.path.join(fname, 'schema.pkl'), 'rb') as f:
+            self.schema = pickle.load(f)
+        assert(self.schema['version'] == SampleArchive.VERSION)
+        self.offsets = np.load(os.path.join(fname, 'offsets.npy'))
+        self.meta_idxs = np.load(os.path.join(fname, 'meta_idxs.npy'))
+        self.meta_datas = self.schema['meta_datas']
+
+        total_T = int(self.offsets[-1])
+        self.fields = dict()
+        for field in SampleArchive.FIELDS:
+            field_schema = self.schema['fields'][field]
+            shape = (total_T, field_schema['dim'])
+            if total_T > 0:
+                self.fields[field] = np.memmap(
+                    os.path.join(fname, '{0}.dat'.format(field)),
+                    dtype=np.dtype(field_schema['dtype']),
+                    mode='c',
+                    shape=shape)
+            else:
+                # cannot memmap an empty file
+                self.fields[field] = np.zeros(shape, dtype=np.dtype(field_schema['dtype']))
+
+    def __len__(self):
+        return len(self.meta_idxs)
+
+    def __getitem__(self, i):
+        start, stop = int(self.offsets[i]), int(self.offsets[i+1])
+        return Sample(
+            meta_data=self.meta_datas[self.meta_idxs[i]],
+            T=stop - start,
+            X=self.fields['X'][start:stop],
+            U=self.fields['U'][start:stop],
+            O=self.fields['O'][start:stop])
+
+    def samples(self):
+        return [self[i] for i in xrange(len(self))]
+
+    ######################
+    ### Saving/Loading ###
+    ######################
+
+    @staticmethod
+    def save(fname, samples):
+        SampleArchive._save(
+            fname,
+            [s._meta_data for s in samples],
+            dict([(field, [s.get(field) for s in samples]) for field in SampleArchive.FIELDS]))
+
+    @staticmethod
+    def _save(fname, meta_datas, fields):
+        """
+        :param meta_datas: meta data of each sample
+        :param fields: dict from field to list of (T x dim) arrays for each sample
+        """
+        assert(os.path.splitext(fname)[-1] == EXT)
+        if not os.path.exists(fname):
+            os.makedirs(fname)
+
+        ### store each distinct meta data once
+        unique_meta_datas = []
+        meta_idxs = []
+        for meta_data in meta_datas:
+            for i, unique_meta_data in enumerate(unique_meta_datas):
+                if unique_meta_data == meta_data:
+                    meta_idxs.append(i)
+                    break
+            else:
+                meta_idxs.append(len(unique_meta_datas))
+                unique_meta_datas.append(meta_data)
+
+        lengths = [len(arr) for arr in fields['X']]
+        offsets = np.concatenate(([0], np.cumsum(lengths))).astype(np.int64)
+
+        schema = {
+            'version': SampleArchive.VERSION,
+            'num_samples': len(meta_datas),
+            'meta_datas': unique_meta_datas,
+            'fields': dict()
+        }
+        for field in SampleArchive.FIELDS:
+            arrs = fields[field]
+            assert(len(arrs) == len(lengths))
+            assert([len(arr) for arr in arrs] == lengths)
+            if len(arrs) > 0:
+                dtype = np.result_type(*[np.asarray(arr).dtype for arr in arrs])
+                dim = np.asarray(arrs[0]).shape[1]
+            else:
+                dtype, dim = np.dtype(np.float32), 0
+            schema['fields'][field] = {'dtype': dtype.str, 'dim': dim}
+
+            ### stream each sample to disk
+            with open(os.path.join(fname, '{0}.dat'.format(field)), 'wb') as f:
+                for arr in arrs:
+                    arr = np.asarray(arr)
+                    assert(arr.shape[1] == dim)
+                    np.ascontiguousarray(arr, dtype=dtype).tofile(f)
+
+        np.save(os.path.join(fname, 'offsets.npy'), offsets)
+        np.save(os.path.join(fname, 'meta_idxs.npy'), np.array(meta_idxs, dtype=np.int32))
+        with open(os.path.join(fname, 'schema.pkl'), 'wb') as f:
+            pickle.dump(schema, f, protocol=2)
+
+    @staticmethod
+    def load(fname):
+        return SampleArchive(fname).samples()
+
+    ##################
+    ### Conversion ###
+    ##################
+
+    @staticmethod
+    def archive_fname(npz_fname):
+        return os.path.splitext(npz_fname)[0] + EXT
+
+    @staticmethod
+    def from_npz(npz_fname, fname=None, verify=True):
+        """
+        Losslessly converts a Sample.save npz file into an archive
+        """
+        assert(os.path.splitext(npz_fname)[-1] == '.npz')
+        if fname is None:
+            fname = SampleArchive.archive_fname(npz_fname)
+
+        d = np.load(npz_fname)
+        meta_datas = list(d['meta_datas'])
+        fields = {'X': list(d['Xs']), 'U': list(d['Us']), 'O': list(d['Os'])}
+        SampleArchive._save(fname, meta_datas, fields)
+
+        if verify:
+            archive = SampleArchive(fname)
+            assert(len(archive) == len(meta_datas))
+            for i in xrange(len(archive)):
+                assert(archive.meta_datas[archive.meta_idxs[i]] == meta_datas[i])
+                for field in SampleArchive.FIELDS:
+                    start, stop = archive.offsets[i], archive.offsets[i+1]
+                    assert(np.allclose(archive.fields[field][start:stop], fields[field][i], rtol=0, atol=0, equal_nan=True))
+
+        return fname
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Convert Sample npz files to sample archives')
+    parser.add_argument('npz_fnames', type=str, nargs='+')
+    parser.add_argument('--no_verify', action='store_true')
+    args = parser.parse_args()
+
+    for npz_fname in args.npz_fnames:
+        print('{0} -> {1}'.format(npz_fname, SampleArchive.from_npz(npz_fname, verify=not args.no_verify)))
@@ -0,0 +1,375 @@
+import numpy as np
+import tensorflow as tf
+
+"""
+Layers that evaluate every head of a bootstrap ensemble at once.
+
+Variables hold the weights of all heads stacked along a head axis, and each layer is
+a single batched matmul instead of one op per head. Convolutions after a shared input stay
+per head (see fused_convnn), a single convolution over all heads would multiply their cost.
+Variables are created under <name>_fused scopes with the same relative names as the
+per head <name>_b<head> scopes, so per head checkpoints can be loaded (see load_per_head_checkpoint).
+"""
+
+FUSED_SUFFIX = '_fused'
+
+# fused variable name -> (head axis, whether heads are concatenated instead of stacked along it)
+HEAD_LAYOUTS = dict()
+
+def fused_scope(name):
+    return name + FUSED_SUFFIX
+
+#################
+### Variables ###
+#################
+
+def _head_shape(shape, num_heads, head_axis, concat):
+    full_shape = list(shape)
+    if concat:
+        full_shape[head_axis] *= num_heads
+    else:
+        full_shape.insert(head_axis, num_heads)
+    return full_shape
+
+def _head_variable(name, shape, num_heads, head_axis=0, concat=False, dtype=tf.float32, initializer=None, regularizer=None):
+    """
+    Creates one variable holding num_heads variables of shape
+    Each head is initialized as if it was its own variable (e.g. the xavier fan in does not include the heads)
+    """
+    def head_initializer(full_shape, dtype=dtype, partition_info=None):
+        heads = [initializer(shape, dtype=dtype) for _ in xrange(num_heads)]
+        return tf.concat(head_axis, heads) if concat else tf.stack(heads, axis=head_axis)
+
+    var = tf.get_variable(
+        name,
+        _head_shape(shape, num_heads, head_axis, concat),
+        dtype=dtype,
+        initializer=head_initializer,
+        regularizer=regularizer)
+    HEAD_LAYOUTS[var.op.name] = (head_axis, concat)
+    return var
+
+def _register_new_variables(vars_before, head_axis=0, concat=True):
+    """ For variables created by other layers on concatenated heads (e.g. batch norm) """
+    for var in set(tf.global_variables()).difference(vars_before):
+        HEAD_LAYOUTS[var.op.name] = (head_axis, concat)
+
+##############
+### Layers ###
+##############
+
+def fused_fcnn(inputs, params, num_heads, dtype=tf.float32, scope="fcnn", reuse=False):
+    """
+    Same as fcnn for num_heads heads
+    :param inputs: num_heads x batch x dim
+    :return: num_heads x batch x output_dim
+    """
+    if "hidden_activation" not in params:
+        hidden_activation = None
+    elif params["hidden_activation"] == "relu":
+        hidden_activation = tf.nn.relu
+    elif params["hidden_activation"] == "tanh":
+        hidden_activation = tf.nn.tanh
+    else:
+        raise NotImplementedError(
+            "Hidden activation {0} is not valid".format(
+                params["hidden_activation"]))
+
+    if params.get("dropout", None) is not None:
+        raise NotImplementedError("Dropout is not supported for fused ensembles")
+
+    hidden_layers = params.get("hidden_layers", [])
+    output_dim = params["output_dim"]
+    dims = hidden_layers + [output_dim]
+
+    next_layer_input = inputs
+    with tf.variable_scope(scope, reuse=reuse):
+        for i, dim in enumerate(dims):
+            with tf.variable_scope(None, default_name="fully_connected"):
+                weights = _head_variable(
+                    "weights",
+                    [next_layer_input.get_shape()[-1].value, dim],
+                    num_heads,
+                    dtype=dtype,
+                    initializer=tf.contrib.layers.xavier_initializer(dtype=dtype),
+                    regularizer=tf.contrib.layers.l2_regularizer(0.5))
+                biases = _head_variable(
+                    "biases",
+                    [dim],
+                    num_heads,
+                    dtype=dtype,
+                    initializer=tf.constant_initializer(0., dtype=dtype))
+                next_layer_input = tf.batch_matmul(next_layer_input, weights) + tf.expand_dims(biases, 1)
+                if hidden_activation is not None:
+                    next_layer_input = hidden_activation(next_layer_input)
+
+    return next_layer_input
+
+def fused_convnn(inputs, params, num_heads, shared_input=True, dtype=tf.float32, scope="convnn", reuse=False, is_training=True):
+    """
+    Same as convnn for num_heads heads. Heads are kept side by side in the channels. With a
+    shared input the first layer is one convolution with the filters of all heads side by side,
+    every other layer convolves the channels of each head with its own filters, so a head never
+    costs more than its own convolution.
+    :param inputs: batch x H x W x C if shared_input, else num_heads x batch x H x W x C
+    :return: batch x H' x W' x (num_heads * filters), head major channels
+    """
+    if params["conv_activation"] == "relu":
+        conv_activation = tf.nn.relu
+    else:
+        raise NotImplementedError(
+            "Conv activation {0} is not valid".format(
+                params["conv_activation"]))
+
+    kernels = params["kernels"]
+    filters = params["filters"]
+    strides = params["strides"]
+    padding = params["padding"]
+    use_batch_norm = params.get('use_batch_norm', False)
+
+    if not shared_input:
+        # heads side by side in the channels
+        shape = inputs.get_shape().as_list()
+        inputs = tf.reshape(
+            tf.transpose(inputs, [1, 2, 3, 0, 4]),
+            [shape[1], shape[2], shape[3], num_heads * shape[4]])
+
+    next_layer_input = inputs
+    num_channels = next_layer_input.get_shape()[-1].value
+    if not shared_input:
+        num_channels //= num_heads
+
+    with tf.variable_scope(scope, reuse=reuse):
+        for i in xrange(len(kernels)):
+            with tf.variable_scope(None, default_name="Conv"):
+                # kernel x kernel x heads x in x out
+                weights = _head_variable(
+                    "weights",
+                    [kernels[i], kernels[i], num_channels, filters[i]],
+                    num_heads,
+                    head_axis=2,
+                    dtype=dtype,
+                    initializer=tf.contrib.layers.xavier_initializer_conv2d(dtype=dtype),
+                    regularizer=tf.contrib.layers.l2_regularizer(0.5))
+                if i == 0 and shared_input:
+                    # every head sees the same channels, so the filters are just side by side
+                    conv_filter = tf.reshape(
+                        tf.transpose(weights, [0, 1, 3, 2, 4]),
+                        [kernels[i], kernels[i], num_channels, num_heads * filters[i]])
+                    next_layer_input = tf.nn.conv2d(
+                        next_layer_input,
+                        conv_filter,
+                        [1, strides[i], strides[i], 1],
+                        padding)
+                else:
+                    # heads are kept out of the channel contraction
+                    next_layer_input = tf.concat(3, [
+                        tf.nn.conv2d(head_input, head_filter, [1, strides[i], strides[i], 1], padding)
+                        for head_input, head_filter in zip(tf.split(3, num_heads, next_layer_input),
+                                                           tf.unstack(weights, axis=2))])
+
+                if use_batch_norm:
+                    # per channel statistics, so identical to batch norm on each head
+                    vars_before = set(tf.global_variables())
+                    next_layer_input = tf.contrib.layers.batch_norm(next_layer_input, is_training=is_training)
+                    _register_new_variables(vars_before)
+                else:
+                    biases = _head_variable(
+                        "biases",
+                        [filters[i]],
+                        num_heads,
+                        concat=True,
+                        dtype=dtype,
+                        initializer=tf.constant_initializer(0., dtype=dtype))
+                    next_layer_input = tf.nn.bias_add(next_layer_input, biases)
+                next_layer_input = conv_activation(next_layer_input)
+            num_channels = filters[i]
+
+    return next_layer_input
+
+def channels_to_heads(inputs, num_heads):
+    """
+    :param inputs: batch x H x W x (num_heads * C) with head major channels
+    :return: num_heads x batch x (H * W * C), each head flattened like tf.contrib.layers.flatten
+    """
+    shape = inputs.get_shape().as_list()
+    batch_size = tf.shape(inputs)[0]
+    heads = tf.reshape(inputs, [batch_size, shape[1], shape[2], num_heads, shape[3] // num_heads])
+    heads = tf.transpose(heads, [3, 0, 1, 2, 4])
+    return tf.reshape(heads, [num_heads, batch_size, shape[1] * shape[2] * (shape[3] // num_heads)])
+
+###########
+### RNN ###
+###########
+
+_CELL_NAMES = {
+    'rnn': 'DpRNNCell',
+    'mulint_rnn': 'DpMulintRNNCell',
+    'lstm': 'DpLSTMCell',
+    'mulint_lstm': 'DpMulintLSTMCell'
+}
+
+def _fused_multiplicative_integration(Wx, Uz, output_size, num_heads, dtype=tf.float32):
+    """ Same as tf_utils.multiplicative_integration with precomputed Wx and Uz for num_heads heads """
+    with tf.variable_scope('double_inputs_multiple_integration'):
+        with tf.variable_scope("multiplicative_integration"):
+            alpha = _head_variable(
+                'mulint_alpha',
+                [output_size],
+                num_heads,
+                dtype=dtype,
+                initializer=tf.truncated_normal_initializer(mean=1.0, stddev=0.1, dtype=dtype))
+            betas = _head_variable(
+                'mulint_params_betas',
+                [output_size * 2],
+                num_heads,
+                dtype=dtype,
+                initializer=tf.truncated_normal_initializer(mean=0.5, stddev=0.1, dtype=dtype))
+            beta1, beta2 = tf.split(1, 2, betas)
+            original_bias = _head_variable(
+                'mulint_original_bias',
+                [output_size],
+                num_heads,
+                dtype=dtype,
+                initializer=tf.truncated_normal_initializer(mean=0.0, stddev=0.1, dtype=dtype))
+
+    alpha, beta1, beta2, original_bias = [tf.expand_dims(v, 1) for v in (alpha, beta1, beta2, original_bias)]
+    return alpha * Wx * Uz + beta1 * Uz + beta2 * Wx + original_bias
+
+def fused_rnn(inputs, params, num_heads, initial_state=None, dtype=tf.float32, scope="rnn", reuse=False):
+    """
+    Same as rnn for num_heads heads, without dropout
+    :param inputs: num_heads x batch x T x features
+    :param initial_state: num_heads x batch x state (first cell only)
+    :return: num_heads x batch x T x num_units
+    """
+    cell_type = params["cell_type"]
+    if cell_type not in _CELL_NAMES:
+        raise NotImplementedError(
+            "Cell type {0} is not valid".format(cell_type))
+    if params.get("dropout", None) is not None:
+        raise NotImplementedError("Dropout is not supported for fused ensembles")
+    is_lstm = cell_type in ('lstm', 'mulint_lstm')
+    is_mulint = cell_type in ('mulint_rnn', 'mulint_lstm')
+    gate_mult = 4 if is_lstm else 1
+
+    if initial_state is not None:
+        state_size = initial_state.get_shape()[-1].value
+        num_units = state_size // 2 if is_lstm else state_size
+    else:
+        num_units = params["num_units"]
+    num_cells = params["num_cells"]
+    num_inputs = inputs.get_shape()[-1].value
+    inputs = tf.cast(inputs, dtype)
+    batch_size = tf.shape(inputs)[1]
+
+    with tf.variable_scope(scope, reuse=reuse):
+        ### weights, created like the cells of rnn
+        cell_weights = []
+        for i in xrange(num_cells):
+            with tf.variable_scope("{0}_{1}".format(cell_type, i)):
+                head_variable = lambda name, shape: _head_variable(
+                    name,
+                    shape,
+                    num_heads,
+                    dtype=dtype,
+                    initializer=tf.contrib.layers.xavier_initializer(dtype=dtype),
+                    regularizer=tf.contrib.layers.l2_regularizer(0.5))
+                if is_mulint:
+                    cell_weights.append((
+                        head_variable("weights_W", [num_inputs, gate_mult * num_units]),
+                        head_variable("weights_U", [num_units, gate_mult * num_units])))
+                else:
+                    cell_weights.append(head_variable("weights", [num_inputs + num_units, gate_mult * num_units]))
+
+        ### initial states
+        zeros = tf.zeros(tf.stack([num_heads, batch_size, num_units]), dtype=dtype)
+        states = []
+        for i in xrange(num_cells):
+            if i == 0 and initial_state is not None:
+                if is_lstm:
+                    c, h = tf.split(2, 2, initial_state)
+                    states.append((c, h))
+                else:
+                    states.append(initial_state)
+            else:
+                states.append((zeros, zeros) if is_lstm else zeros)
+
+        ### unrolled in time, T is small
+        outputs = []
+        for t, input_t in enumerate(tf.unstack(inputs, axis=2)):
+            next_input = input_t
+            for i in xrange(num_cells):
+                h = states[i][1] if is_lstm else states[i]
+                with tf.variable_scope("RNN/MultiRNNCell/Cell{0}/{1}".format(i, _CELL_NAMES[cell_type]),
+                                       reuse=True if t > 0 else None):
+                    if is_mulint:
+                        weights_W, weights_U = cell_weights[i]
+                        gates = tf.tanh(_fused_multiplicative_integration(
+                            tf.batch_matmul(next_input, weights_W),
+                            tf.batch_matmul(h, weights_U),
+                            gate_mult * num_units,
+                            num_heads,
+                            dtype=dtype))
+                    else:
+                        gates = tf.tanh(tf.batch_matmul(tf.concat(2, [next_input, h]), cell_weights[i]))
+
+                if is_lstm:
+                    c = states[i][0]
+                    gate_i, gate_j, gate_f, gate_o = tf.split(2, 4, gates)
+                    new_c = c * tf.nn.sigmoid(gate_f + 1.0) + tf.nn.sigmoid(gate_i) * tf.tanh(gate_j)
+                    new_h = tf.tanh(new_c) * tf.nn.sigmoid(gate_o)
+                    states[i] = (new_c, new_h)
+                    next_input = new_h
+                else:
+                    states[i] = gates
+                    next_input = gates
+            outputs.append(next_input)
+
+    return tf.stack(outputs, axis=2)
+
+###################
+### Checkpoints ###
+###################
+
+def _head_checkpoint_name(name, head, checkpoint_names):
+    prefix, rel_name = name.split('/', 1)
+    assert(prefix.endswith(FUSED_SUFFIX))
+    head_prefix = '{0}_b{1}'.format(prefix[:-len(FUSED_SUFFIX)], head)
+    head_name = '{0}/{1}'.format(head_prefix, rel_name)
+    if head_name in checkpoint_names:
+        return head_name
+
+    # scopes added by the tf rnn helpers are version dependent, so fall back to the innermost scopes
+    suffix = '/' + '/'.join(rel_name.split('/')[-2:])
+    candidates = [n for n in checkpoint_names if n.startswith(head_prefix + '/') and n.endswith(suffix)]
+    if len(candidates) != 1:
+        raise Exception('Could not find {0} in checkpoint'.format(head_name))
+    return candidates[0]
+
+def load_per_head_checkpoint(sess, checkpoint, num_heads):
+    """
+    Loads a checkpoint saved with one subgraph per head (<name>_b<head> scopes) into the fused variables.
+    Variables with the same name in both layouts are copied, everything else is left as is.
+    :return: names of the loaded variables
+    """
+    reader = tf.train.NewCheckpointReader(checkpoint)
+    checkpoint_names = set(reader.get_variable_to_shape_map().keys())
+
+    loaded = []
+    for var in tf.global_variables():
+        name = var.op.name
+        if name in HEAD_LAYOUTS:
+            head_axis, concat = HEAD_LAYOUTS[name]
+            values = [reader.get_tensor(_head_checkpoint_name(name, b, checkpoint_names)) for b in xrange(num_heads)]
+            value = np.concatenate(values, axis=head_axis) if concat else np.stack(values, axis=head_axis)
+        elif name in checkpoint_names:
+            value = reader.get_tensor(name)
+            if tuple(value.shape) != tuple(var.get_shape().as_list()):
+                continue
+        else:
+            continue
+        sess.run(var.initializer, feed_dict={var.initializer.inputs[1]: value})
+        loaded.append(name)
+
+    return loaded
@@ -9,10 +9,13 @@ def rnn(
         dp_masks=None,
         dtype=tf.float32,
         scope="rnn",
-        reuse=False):
+        reuse=False,
+        return_final_state=False):
   
     """
     inputs is shape [batch_size x T x features].
+    If return_final_state, the final state is also returned, in the same format as
+    initial_state so it can be passed as the initial state of the next segment.
     """
     # TODO adjust state for Mulicell
     if params["cell_type"] == "rnn":
@@ -86,5 +89,12 @@ def rnn(
             initial_state=initial_state,
             dtype=dtype,
             time_major=False)
+
+    if return_final_state:
+        if isinstance(state[0], tf.nn.rnn_cell.LSTMStateTuple):
+            final_state = tf.concat(1, [state[0].c, state[0].h])
+        else:
+            final_state = state[0]
+        return outputs, dp_return_masks, final_state
     
     return outputs, dp_return_masks
@@ -0,0 +1,139 @@
+import abc
+import numpy as np
+import tensorflow as tf
+
+class CemCovariance(object):
+    """
+    Covariance of the CEM sampling distribution over flattened action sequences of size n.
+    A covariance is a list of tensors, so it can be kept in graph variables between plans.
+    """
+    __metaclass__ = abc.ABCMeta
+
+    def __init__(self, n, eps, dtype=tf.float32):
+        """
+        :param eps: added to the variances, to ensure the covariance is PD
+        """
+        self.n = n
+        self.eps = eps
+        self.dtype = dtype
+
+    @abc.abstractmethod
+    def fit(self, centered):
+        """
+        :param centered: elite samples (k x n), minus their mean with centered_covariance
+        :return: covariance
+        """
+        raise NotImplementedError('Implement in subclass')
+
+    @abc.abstractmethod
+    def sample(self, mean, covariance, m):
+        """
+        :return: m samples (m x n)
+        """
+        raise NotImplementedError('Implement in subclass')
+
+    @abc.abstractmethod
+    def initial(self, var):
+        """
+        :param var: numpy variances (n)
+        :return: numpy arrays of a covariance with diagonal var
+        """
+        raise NotImplementedError('Implement in subclass')
+
+    @abc.abstractmethod
+    def shift(self, covariance, d, var):
+        """
+        Drops the first d dimensions and appends d independent ones
+        :param var: numpy variances of the appended dimensions (d)
+        :return: covariance
+        """
+        raise NotImplementedError('Implement in subclass')
+
+class FullCovariance(CemCovariance):
+    """ Dense covariance, sampling pays for a Cholesky factorization of n x n """
+
+    def fit(self, centered):
+        k = int(centered.get_shape()[0])
+        sigma = tf.matmul(centered, centered, transpose_a=True) / k
+        return [sigma + tf.eye(self.n, dtype=self.dtype) * self.eps]
+
+    def sample(self, mean, covariance, m):
+        distribution = tf.contrib.distributions.MultivariateNormalFull(
+            mu=mean,
+            sigma=covariance[0])
+        return distribution.sample((m,))
+
+    def initial(self, var):
+        return [np.diag(var) + np.eye(self.n) * self.eps]
+
+    def shift(self, covariance, d, var):
+        var = np.concatenate([np.zeros(self.n - d), var + self.eps])
+        return [tf.pad(covariance[0][d:, d:], [[0, d], [0, d]]) + tf.constant(np.diag(var), dtype=self.dtype)]
+
+class DiagCovariance(CemCovariance):
+    """ Independent dimensions """
+
+    def fit(self, centered):
+        return [tf.reduce_mean(tf.square(centered), axis=0) + self.eps]
+
+    def sample(self, mean, covariance, m):
+        noise = tf.random_normal((m, self.n), dtype=self.dtype)
+        return mean + tf.sqrt(covariance[0]) * noise
+
+    def initial(self, var):
+        return [var + self.eps]
+
+    def shift(self, covariance, d, var):
+        return [tf.concat(0, [covariance[0][d:], tf.constant(var + self.eps, dtype=self.dtype)])]
+
+class LowRankCovariance(CemCovariance):
+    """
+    W W^T + diag(v): W (n x rank) spans the principal directions of the elites, found from the
+    eigendecomposition of the k x k gram matrix, v keeps the variance of every dimension.
+    Sampling and refitting are O(n * k * rank), no n x n matrix is formed.
+    """
+
+    def __init__(self, n, eps, rank, dtype=tf.float32):
+        CemCovariance.__init__(self, n, eps, dtype=dtype)
+        self.rank = rank
+
+    def fit(self, centered):
+        k = int(centered.get_shape()[0])
+        assert(self.rank <= k)
+        gram = tf.matmul(centered, centered, transpose_b=True) / k
+        # eigenvalues in ascending order
+        _, eigvecs = tf.self_adjoint_eig(gram)
+        factor = tf.matmul(centered, eigvecs[:, k-self.rank:], transpose_a=True) / np.sqrt(k)
+        var = tf.reduce_mean(tf.square(centered), axis=0) - tf.reduce_sum(tf.square(factor), axis=1)
+        return [factor, tf.maximum(var, 0.) + self.eps]
+
+    def sample(self, mean, covariance, m):
+        factor, var = covariance
+        factor_noise = tf.random_normal((m, self.rank), dtype=self.dtype)
+        noise = tf.random_normal((m, self.n), dtype=self.dtype)
+        return mean + tf.matmul(factor_noise, factor, transpose_b=True) + tf.sqrt(var) * noise
+
+    def initial(self, var):
+        return [np.zeros((self.n, self.rank)), var + self.eps]
+
+    def shift(self, covariance, d, var):
+        factor, diag = covariance
+        return [tf.pad(factor[d:], [[0, d], [0, 0]]),
+                tf.concat(0, [diag[d:], tf.constant(var + self.eps, dtype=self.dtype)])]
+
+def get_cem_covariance(params, n, dtype=tf.float32):
+    """
+    :param params: cem params
+    """
+    covariance_type = params.get('covariance', 'full')
+    if covariance_type == 'full':
+        return FullCovariance(n, params['eps'], dtype=dtype)
+    elif covariance_type == 'diag':
+        return DiagCovariance(n, params['eps'], dtype=dtype)
+    elif covariance_type == 'lowrank':
+        ks = [params['K']]
+        if params.get('warm_start', {}).get('enabled', False):
+            ks.append(params['warm_start']['K'])
+        return LowRankCovariance(n, params['eps'], min([params.get('rank', 4)] + ks), dtype=dtype)
+    else:
+        raise NotImplementedError('CEM covariance {0} is not valid'.format(covariance_type))
@@ -5,6 +5,8 @@ from general.tf.planning.noise import ZeroNoise
 from general.tf.planning.noise import GaussianNoise
 from general.tf.planning.noise import UniformNoise
 from general.tf.planning.epsilon_greedy import epsilon_greedy
+from general.tf.planning.cost.cost_desired import CostDesired
+from general.tf.planning.cost.cost_coll import CostColl
 
 class Planner(object):
     __metaclass__ = abc.ABCMeta
@@ -23,26 +25,61 @@ class Planner(object):
         """
         raise NotImplementedError('Implement in subclass')
 
+    def _setup_eval(self):
+        """ Sets the placeholders and what _eval_cost needs, the bootstrap embeddings of O_input are computed once """
+        self.X_inputs = self.probcoll_model.d_eval['X_inputs']
+        self.O_input = self.probcoll_model.d_eval['O_input']
+        self._control_cost_fn = CostDesired(self.params['cost']['control_cost'])
+        self._coll_cost_fn = CostColl(self.params['cost']['coll_cost'])
+        self._stack_x = tf.concat(0, [self.X_inputs]*self.params['num_dp'])
+        self._embeddings = self.probcoll_model.get_bootstrap_embeddings(
+            self.O_input,
+            batch_size=1,
+            reuse=True)
+
+    def _eval_cost(self, u_samples):
+        """
+        :param u_samples: (# samples x T x dU)
+        :return: cost of every sample, averaged over num_dp dropout passes
+        """
+        stack_u = tf.concat(0, [u_samples]*self.params['num_dp'])
+        # TODO incorporate std later
+        output_pred_mean, _, _, _ = self.probcoll_model.graph_eval_inference(
+            self._stack_x,
+            stack_u,
+            bootstrap_initial_states=self._embeddings,
+            reuse=True)
+
+        pred_mean = tf.reduce_mean(
+            tf.split(0, self.params['num_dp'], output_pred_mean), axis=0)
+
+        control_cost = self._control_cost_fn.eval(u_samples)
+        coll_cost = self._coll_cost_fn.eval(pred_mean, u_samples)
+        return control_cost + coll_cost
+
     def _setup_noise(self):
-        T = self.probcoll_model.T
+        self.action_noisy = self._add_noise(self.action)
+
+    def _add_noise(self, action):
         noise_type = self.params['control_noise']['type']
         if noise_type == 'zero':
-            self.action_noisy = self.action
+            action_noisy = action
         elif noise_type == 'gaussian':
             noise = GaussianNoise(
                 self.params['control_noise']['gaussian'],
                 dtype=self.dtype) 
-            self.action_noisy = self.action + noise
+            action_noisy = action + noise
         elif noise_type == 'uniform':
             noise = UniformNoise(
                 self.params['control_noise']['uniform'],
                 dtype=self.dtype) 
-            self.action_noisy = self.action + noise
+            action_noisy = action + noise
         else:
             raise NotImplementedError(
                 "Noise type {0} is not valid".format(noise_type))
         if self.params['epsilon_greedy']['epsilon'] > 0:
-            self.action_noisy = epsilon_greedy(self.action_noisy, self.params['epsilon_greedy'], dtype=self.dtype)
+            action_noisy = epsilon_greedy(action_noisy, self.params['epsilon_greedy'], dtype=self.dtype)
+        return action_noisy
     
     def visualize(
             self,
@@ -53,11 +90,18 @@ class Planner(object):
             des_cost):
         pass
 
+    def reset(self):
+        """ Called when a rollout starts, planners keeping state between plans clear it here """
+        pass
+
+    def _feed_dict(self, o):
+        o_input = o[self.probcoll_model.O_idxs()].reshape(1, -1)
+        return {self.X_inputs: [[[]]*self.probcoll_model.T], self.O_input: o_input}
+
     def plan(self, x, o, t, only_noise, visualize=False):
         # TODO figure out general way to handle state
         # import IPython; IPython.embed()
-        o_input = o[self.probcoll_model.O_idxs()].reshape(1, -1)
-        feed_dict = {self.X_inputs: [[[]]*self.probcoll_model.T], self.O_input: o_input}
+        feed_dict = self._feed_dict(o)
         if visualize:
             action_noisy, action, actions_considered, noisy_action, \
                 coll_cost, des_cost  = self.probcoll_model.sess.run(
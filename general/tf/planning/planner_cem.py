@@ -1,91 +1,250 @@
+import time
+import numpy as np
 import tensorflow as tf
 from general.tf.planning.planner import Planner
-
-import tensorflow as tf
-from general.tf.planning.cost.cost_desired import CostDesired
-from general.tf.planning.cost.cost_coll import CostColl
+from general.tf.planning.cem_covariance import get_cem_covariance
 
 class PlannerCem(Planner):
+    """
+    Cross entropy method over the flattened T x dU action sequences. The covariance of the
+    sampling distribution is full, diag or lowrank (see cem_covariance).
+
+    With warm_start enabled the elite mean and covariance of every plan are kept in graph
+    variables, shifted by one step (the step shifted in gets the mean and variance of the uniform
+    control_range distribution), and the next plan samples its first population from them,
+    with the warm_start population size and number of iterations. The first plan after reset
+    starts cold.
+
+    With anytime enabled a plan runs every iteration as its own session call, the population,
+    elite distribution and best sequence so far are kept in graph variables between the calls.
+    After the first population, iterations run while the next one (timed by a running average)
+    is expected to end before the deadline, up to max_iters. The plan returns the best sequence
+    found, the number of iterations of every plan is kept in anytime_iterations.
+    """
+
+    def __init__(self, probcoll_model, params, dtype=tf.float32):
+        self.warm_start = params['cem'].get('warm_start', {}).get('enabled', False)
+        self._warm_valid = False
+        self.anytime = params['cem'].get('anytime', {}).get('enabled', False)
+        self.anytime_iterations = []
+        self._anytime_iter_time = None
+        self.last_cost = None
+        Planner.__init__(self, probcoll_model, params, dtype=dtype)
+
     def _setup(self):
+        cem_params = self.params['cem']
+        control_range = self.params['control_range']
+        self._d = len(control_range['lower'])
+        T = self.probcoll_model.T
+        self._covariance = get_cem_covariance(cem_params, T * self._d, dtype=self.dtype)
         with tf.name_scope('cem_planner'):
-            control_list = []
-            init_m = self.params['cem']['init_M']
-            m = self.params['cem']['M']
-            k = self.params['cem']['K']
-            num_iters = self.params['cem']['num_iters']
-            control_range = self.params['control_range']
-            d = len(control_range['lower'])
-            T = self.probcoll_model.T
-            control_cost_fn = CostDesired(self.params['cost']['control_cost']) 
-            coll_cost_fn = CostColl(self.params['cost']['coll_cost'])
-            self.X_inputs = self.probcoll_model.d_eval['X_inputs']
-            self.O_input = self.probcoll_model.d_eval['O_input']
-            
+            self._setup_eval()
+
+            init_distribution = tf.contrib.distributions.Uniform(
+                control_range['lower'],
+                control_range['upper'])
+            init_u_samples = tf.cast(init_distribution.sample(sample_shape=(cem_params['init_M'], T)), self.dtype)
+            self.action, self.cost, top_mean, top_covariance = self._cem(
+                init_u_samples,
+                cem_params['num_iters'],
+                cem_params['M'],
+                cem_params['K'])
+            self.samples_per_plan = cem_params['init_M'] + cem_params['num_iters'] * cem_params['M']
+
+        if self.warm_start:
+            self._setup_warm_start(top_mean, top_covariance)
+        if self.anytime:
+            self._setup_anytime()
+
+    def _setup_warm_start(self, top_mean, top_covariance):
+        warm_params = self.params['cem']['warm_start']
+        control_range = self.params['control_range']
+        d = self._d
+        T = self.probcoll_model.T
+        lower = np.array(control_range['lower'], dtype=np.float64)
+        upper = np.array(control_range['upper'], dtype=np.float64)
+        # distribution of the step shifted in, the same as the uniform initial samples
+        step_mean = np.tile((lower + upper) / 2., T)
+        self._step_mean = step_mean[-d:]
+        self._step_var = (upper - lower) ** 2 / 12.
+        with tf.name_scope('cem_warm_start'):
+            # not in any collection, so not saved or restored with the model
+            self._warm_mean = tf.Variable(tf.constant(step_mean, dtype=self.dtype),
+                                          trainable=False,
+                                          collections=[],
+                                          name='mean')
+            self._warm_covariance = [tf.Variable(tf.constant(value, dtype=self.dtype),
+                                                 trainable=False,
+                                                 collections=[],
+                                                 name='covariance_{0}'.format(i))
+                                     for i, value in enumerate(self._covariance.initial(np.tile(self._step_var, T)))]
+            warm_u_samples = self._clip(self._covariance.sample(self._warm_mean, self._warm_covariance,
+                                                                warm_params['M']))
+            self._warm_action, self._warm_cost, warm_top_mean, warm_top_covariance = self._cem(
+                warm_u_samples,
+                warm_params['num_iters'],
+                warm_params['M'],
+                warm_params['K'])
+            self.warm_samples_per_plan = (warm_params['num_iters'] + 1) * warm_params['M']
+
+            self._cold_shift = self._shift(top_mean, top_covariance)
+            self._warm_shift = self._shift(warm_top_mean, warm_top_covariance)
+        self.probcoll_model.sess.run(tf.variables_initializer([self._warm_mean] + self._warm_covariance))
+
+    def _shift(self, mean, covariance):
+        """ :return: op storing mean and covariance shifted by one step as the warm start distribution """
+        d = self._d
+        shifted_mean = tf.concat(0, [mean[d:], tf.constant(self._step_mean, dtype=self.dtype)])
+        shifted_covariance = self._covariance.shift(covariance, d, self._step_var)
+        return tf.group(tf.assign(self._warm_mean, shifted_mean),
+                        *[tf.assign(var, value) for var, value in zip(self._warm_covariance, shifted_covariance)])
+
+    def _setup_anytime(self):
+        cem_params = self.params['cem']
+        control_range = self.params['control_range']
+        d = self._d
+        T = self.probcoll_model.T
+        with tf.name_scope('cem_anytime'):
+            # state of the running plan, not in any collection, so not saved or restored with the model
+            def state(value, name):
+                return tf.Variable(tf.constant(value, dtype=self.dtype), trainable=False, collections=[], name=name)
+            self._anytime_mean = state(np.zeros(T * d), 'mean')
+            self._anytime_covariance = [state(value, 'covariance_{0}'.format(i))
+                                        for i, value in enumerate(self._covariance.initial(np.ones(T * d)))]
+            self._anytime_u = state(np.zeros((T, d)), 'u')
+            self._anytime_cost = state(np.inf, 'cost')
+
+            def step(u_samples, k, first):
+                """ :return: op evaluating u_samples, refitting and keeping the best sequence """
+                total_cost = self._eval_cost(u_samples)
+                top_mean, covariance = self._refit(u_samples, total_cost, k)
+                index = tf.cast(tf.argmin(total_cost, axis=0), tf.int32)
+                if first:
+                    best_u, best_cost = u_samples[index], total_cost[index]
+                else:
+                    improved = tf.cast(total_cost[index] < self._anytime_cost, self.dtype)
+                    best_u = improved * u_samples[index] + (1. - improved) * self._anytime_u
+                    best_cost = tf.minimum(total_cost[index], self._anytime_cost)
+                # the state is read before any of it is assigned
+                with tf.control_dependencies([top_mean, best_u, best_cost] + covariance):
+                    return tf.group(tf.assign(self._anytime_mean, top_mean),
+                                    tf.assign(self._anytime_u, best_u),
+                                    tf.assign(self._anytime_cost, best_cost),
+                                    *[tf.assign(var, value) for var, value in zip(self._anytime_covariance, covariance)])
+
             init_distribution = tf.contrib.distributions.Uniform(
                 control_range['lower'],
                 control_range['upper'])
-            init_u_samples = tf.cast(init_distribution.sample(sample_shape=(init_m, T)), self.dtype)
-            flat_u_samples = tf.reshape(init_u_samples, (init_m, T * d))
-            init_stack_u = tf.concat(0, [init_u_samples]*self.params['num_dp'])
-            stack_x = tf.concat(0, [self.X_inputs]*self.params['num_dp'])
-            embeddings = [
-                    self.probcoll_model.get_embedding(
-                        self.O_input,
-                        batch_size=1,
-                        reuse=True,
-                        scope="observation_graph_b{0}".format(b)) for b in xrange(self.probcoll_model.num_bootstrap)
-                ]
-            init_output_pred_mean, _, _, _ = self.probcoll_model.graph_eval_inference(
-                stack_x,
-                init_stack_u,
-#                O_input=self.O_input,
-                bootstrap_initial_states=embeddings,
-                reuse=True) 
-
-            init_pred_mean = tf.reduce_mean(
-                tf.split(0, self.params['num_dp'], init_output_pred_mean), axis=0)
-
-            init_control_cost = control_cost_fn.eval(init_u_samples)
-            init_coll_cost = coll_cost_fn.eval(init_pred_mean, init_u_samples)
-
-            total_cost = init_control_cost + init_coll_cost
-            
-            for _ in xrange(num_iters):
-            
-                _, init_top_indices = tf.nn.top_k(-1 * total_cost, k=k)
-
-                top_controls = tf.gather(flat_u_samples, indices=init_top_indices)
-
-                flat_top_controls = tf.reshape(top_controls, (k, T * d)) 
-                top_mean = tf.reduce_mean(flat_top_controls, axis=0)
-                top_covar = tf.matmul(tf.transpose(flat_top_controls), flat_top_controls) / k
-                sigma = top_covar + tf.eye(T * d) * self.params['cem']['eps']
-                distribution = tf.contrib.distributions.MultivariateNormalFull(
-                    mu=top_mean,
-                    sigma=sigma)
-                flat_u_samples_preclip = distribution.sample((m,))
-                flat_u_samples = tf.clip_by_value(
-                    flat_u_samples_preclip,
-                    control_range['lower'] * T,
-                    control_range['upper'] * T)
-                u_samples = tf.reshape(flat_u_samples, (m, T, d))
-
-                stack_u = tf.concat(0, [u_samples]*self.params['num_dp'])
-                # TODO incorporate std later
-                output_pred_mean, _, _, _ = self.probcoll_model.graph_eval_inference(
-                    stack_x,
-                    stack_u,
-    #                O_input=self.O_input,
-                    bootstrap_initial_states=embeddings,
-                    reuse=True) 
-
-                pred_mean = tf.reduce_mean(
-                    tf.split(0, self.params['num_dp'], output_pred_mean), axis=0)
-
-                control_cost = control_cost_fn.eval(u_samples)
-                coll_cost = coll_cost_fn.eval(pred_mean, u_samples)
-
-                total_cost = control_cost + coll_cost
-
-            index = tf.cast(tf.argmin(total_cost, axis=0), tf.int32)
-            self.action = u_samples[index, 0]
+            init_u_samples = tf.cast(init_distribution.sample(sample_shape=(cem_params['init_M'], T)), self.dtype)
+            self._anytime_start = step(init_u_samples, cem_params['K'], True)
+            if self.warm_start:
+                warm_params = cem_params['warm_start']
+                warm_u_samples = self._clip(self._covariance.sample(self._warm_mean, self._warm_covariance,
+                                                                    warm_params['M']))
+                self._anytime_warm_start = step(warm_u_samples, warm_params['K'], True)
+                self._anytime_shift = self._shift(self._anytime_mean, self._anytime_covariance)
+            u_samples = self._clip(self._covariance.sample(self._anytime_mean, self._anytime_covariance,
+                                                           cem_params['M']))
+            self._anytime_iter = step(u_samples, cem_params['K'], False)
+            self._anytime_action = self._anytime_u[0]
+        self.probcoll_model.sess.run(tf.variables_initializer(
+            [self._anytime_mean, self._anytime_u, self._anytime_cost] + self._anytime_covariance))
+
+    def _setup_noise(self):
+        Planner._setup_noise(self)
+        if self.warm_start:
+            self._warm_action_noisy = self._add_noise(self._warm_action)
+        if self.anytime:
+            self._anytime_action_noisy = self._add_noise(self._anytime_action)
+
+    def _clip(self, flat_u_samples):
+        """ :return: flattened samples clipped to control_range, reshaped to (# samples x T x dU) """
+        control_range = self.params['control_range']
+        T = self.probcoll_model.T
+        flat_u_samples = tf.clip_by_value(
+            flat_u_samples,
+            control_range['lower'] * T,
+            control_range['upper'] * T)
+        return tf.reshape(flat_u_samples, (-1, T, self._d))
+
+    def _refit(self, u_samples, total_cost, k):
+        """ :return: mean and covariance of the k lowest cost samples, flattened """
+        T = self.probcoll_model.T
+        _, top_indices = tf.nn.top_k(-1 * total_cost, k=k)
+        flat_top_controls = tf.reshape(tf.gather(u_samples, indices=top_indices), (k, T * self._d))
+        top_mean = tf.reduce_mean(flat_top_controls, axis=0)
+        if self.params['cem'].get('centered_covariance', False):
+            return top_mean, self._covariance.fit(flat_top_controls - top_mean)
+        else:
+            # second moment of the elites, as the refit always did
+            return top_mean, self._covariance.fit(flat_top_controls)
+
+    def _cem(self, u_samples, num_iters, m, k):
+        """
+        :param u_samples: first population (# samples x T x dU)
+        :param num_iters: refits after the first population
+        :return: first action and cost of the best sequence, elite mean and covariance of the last population
+        """
+        total_cost = self._eval_cost(u_samples)
+        for _ in xrange(num_iters):
+            top_mean, covariance = self._refit(u_samples, total_cost, k)
+            u_samples = self._clip(self._covariance.sample(top_mean, covariance, m))
+            total_cost = self._eval_cost(u_samples)
+
+        index = tf.cast(tf.argmin(total_cost, axis=0), tf.int32)
+        top_mean, covariance = self._refit(u_samples, total_cost, k)
+        return u_samples[index, 0], total_cost[index], top_mean, covariance
+
+    def reset(self):
+        self._warm_valid = False
+
+    def plan(self, x, o, t, only_noise, visualize=False):
+        if self.anytime:
+            return self._plan_anytime(o, t, only_noise)
+        feed_dict = self._feed_dict(o)
+        if self.warm_start and self._warm_valid:
+            fetches = [self._warm_action_noisy, self._warm_action, self._warm_cost, self._warm_shift]
+        elif self.warm_start:
+            fetches = [self.action_noisy, self.action, self.cost, self._cold_shift]
+        else:
+            fetches = [self.action_noisy, self.action, self.cost]
+        outputs = self.probcoll_model.sess.run(fetches, feed_dict)
+        action_noisy, action, self.last_cost = outputs[:3]
+        self._warm_valid = self.warm_start
+        if only_noise:
+            action = None
+        return action_noisy, action
+
+    def _plan_anytime(self, o, t, only_noise):
+        anytime_params = self.params['cem']['anytime']
+        sess = self.probcoll_model.sess
+        start = time.time()
+        deadline = start + anytime_params['deadline']
+        feed_dict = self._feed_dict(o)
+        warm = self.warm_start and self._warm_valid
+        sess.run(self._anytime_warm_start if warm else self._anytime_start, feed_dict)
+        if self._anytime_iter_time is None:
+            # the first population is at least as large as an iteration
+            self._anytime_iter_time = time.time() - start
+
+        iterations = 0
+        while iterations < anytime_params['max_iters'] and time.time() + self._anytime_iter_time < deadline:
+            iter_start = time.time()
+            sess.run(self._anytime_iter, feed_dict)
+            self._anytime_iter_time = 0.8 * self._anytime_iter_time + 0.2 * (time.time() - iter_start)
+            iterations += 1
+
+        fetches = [self._anytime_action_noisy, self._anytime_action, self._anytime_cost]
+        if self.warm_start:
+            fetches.append(self._anytime_shift)
+        outputs = sess.run(fetches, feed_dict)
+        action_noisy, action, self.last_cost = outputs[:3]
+        self._warm_valid = self.warm_start
+
+        plan_time = time.time() - start
+        self.anytime_iterations.append(iterations)
+        self.probcoll_model._telemetry.write('plan', iterations=iterations, time=plan_time,
+                                             overrun=plan_time > anytime_params['deadline'])
+        if only_noise:
+            action = None
+        return action_noisy, action
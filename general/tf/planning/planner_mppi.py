@@ -0,0 +1,42 @@
+import numpy as np
+import tensorflow as tf
+from general.tf.planning.planner import Planner
+
+class PlannerMppi(Planner):
+    """
+    Model predictive path integral control: every round samples M sequences around the nominal
+    sequence (the first sample is the nominal itself), evaluates them in one batch and moves the
+    nominal to their average weighted by exp(-(cost - min cost) / temperature). The noise std and
+    the temperature are multiplied by std_decay and temperature_decay after every round.
+    The first nominal is the middle of control_range.
+    """
+
+    def _setup(self):
+        mppi_params = self.params['mppi']
+        control_range = self.params['control_range']
+        lower = np.array(control_range['lower'], dtype=np.float64)
+        upper = np.array(control_range['upper'], dtype=np.float64)
+        d = len(lower)
+        T = self.probcoll_model.T
+        m = mppi_params['M']
+        with tf.name_scope('mppi_planner'):
+            self._setup_eval()
+
+            nominal = tf.constant(np.tile((lower + upper) / 2., (T, 1)), dtype=self.dtype)
+            std = np.array(mppi_params['std'], dtype=np.float64)
+            temperature = float(mppi_params['temperature'])
+            for _ in xrange(mppi_params['num_iters']):
+                noise = tf.random_normal((m - 1, T, d), dtype=self.dtype) * tf.constant(std, dtype=self.dtype)
+                u_samples = tf.concat(0, [tf.expand_dims(nominal, 0), tf.expand_dims(nominal, 0) + noise])
+                u_samples = tf.clip_by_value(u_samples, control_range['lower'], control_range['upper'])
+                total_cost = self._eval_cost(u_samples)
+
+                weights = tf.nn.softmax(-(total_cost - tf.reduce_min(total_cost)) / temperature)
+                nominal = tf.reduce_sum(tf.reshape(weights, (m, 1, 1)) * u_samples, axis=0)
+                std *= mppi_params['std_decay']
+                temperature *= mppi_params['temperature_decay']
+
+            self.action = nominal[0]
+            # only evaluated if fetched
+            self.cost = self._eval_cost(tf.expand_dims(nominal, 0))[0]
+            self.samples_per_plan = mppi_params['num_iters'] * m
@@ -13,8 +13,14 @@ class PlannerPrimitives(Planner):
         self.probcoll_model = probcoll_model
         self.params = params
         self.dtype = self.probcoll_model.dtype
-        self._create_primitives()
-        self._setup()
+        self.eval_mode = self.params['primitives'].get('eval_mode', 'flat')
+        if self.eval_mode == 'flat':
+            self._create_primitives()
+            self._setup()
+        elif self.eval_mode == 'tree':
+            self._setup_tree()
+        else:
+            raise Exception('{0} is not valid primitives eval mode'.format(self.eval_mode))
         self._setup_noise()
 
     @abc.abstractmethod
@@ -24,6 +30,25 @@ class PlannerPrimitives(Planner):
         """
         raise NotImplementedError('Implement in subclass')
 
+    def _create_primitive_tree(self):
+        """
+        Primitives as a tree: every primitive is a sequence of segments, each segment one of the actions
+        held for the segment length
+        :return: actions (# actions x dU), segment lengths (sum to T)
+        """
+        raise NotImplementedError('Implement in subclass')
+
+    def _cost(self, pred_mean):
+        control_cost_fn = CostDesired(self.params['cost']['control_cost']) 
+        coll_cost_fn = CostColl(self.params['cost']['coll_cost'])
+        
+        control_cost = control_cost_fn.eval(self.primitives)
+        coll_cost = coll_cost_fn.eval(pred_mean, self.primitives)
+
+        total_cost = control_cost + coll_cost
+        index = tf.cast(tf.argmin(total_cost, axis=0), tf.int32)
+        self.action = self.primitives[index, 0]
+
     def _setup(self):
         with tf.name_scope('primitives_planner'):
             self.X_inputs = self.probcoll_model.d_eval['X_inputs']
@@ -39,12 +64,76 @@ class PlannerPrimitives(Planner):
             pred_mean = tf.reduce_mean(
                 tf.split(0, self.params['num_dp'], output_pred_mean), axis=0)
 
-            control_cost_fn = CostDesired(self.params['cost']['control_cost']) 
-            coll_cost_fn = CostColl(self.params['cost']['coll_cost'])
-            
-            control_cost = control_cost_fn.eval(self.primitives)
-            coll_cost = coll_cost_fn.eval(pred_mean, self.primitives)
+            self._cost(pred_mean)
+
+    def _setup_tree(self):
+        """
+        Evaluates the primitives level by level: the recurrent state of every unique prefix is computed
+        once and branched into every action of the next segment. Without dropout num_dp is not needed.
+        """
+        actions, segment_lens = self._create_primitive_tree()
+        actions = np.asarray(actions)
+        num_actions = len(actions)
+        num_primitives = num_actions ** len(segment_lens)
+        T = self.probcoll_model.T
+        assert(sum(segment_lens) == T)
+
+        ### primitives in tree order, the first segment is the most significant digit
+        controls = []
+        for n in xrange(num_primitives):
+            control = []
+            for i, segment_len in enumerate(segment_lens):
+                action_index = (n // num_actions ** (len(segment_lens) - 1 - i)) % num_actions
+                control += [actions[action_index]] * segment_len
+            controls.append(control)
+        self.primitives = tf.constant(np.array(controls), dtype=self.probcoll_model.dtype)
+
+        ### recurrent steps, the same per step graph in both modes
+        self.rnn_steps_flat = num_primitives * T
+        self.rnn_steps_tree = sum([num_actions ** (i + 1) * segment_len for i, segment_len in enumerate(segment_lens)])
+
+        with tf.name_scope('primitives_tree_planner'):
+            self.X_inputs = self.probcoll_model.d_eval['X_inputs']
+            self.O_input = self.probcoll_model.d_eval['O_input']
+            dU = actions.shape[1]
+            actions = tf.constant(actions, dtype=self.probcoll_model.dtype)
+
+            states = self.probcoll_model.get_bootstrap_embeddings(self.O_input, batch_size=1, reuse=True)
+            output_mats = None
+            num_prefixes = 1
+            for segment_len in segment_lens:
+                num_branches = num_prefixes * num_actions
+                # branch index is prefix index * num_actions + action index
+                u_segment = tf.tile(tf.reshape(actions, (1, num_actions, 1, dU)), (num_prefixes, 1, segment_len, 1))
+                u_segment = tf.reshape(u_segment, (num_branches, segment_len, dU))
+                branch_states = [self._branch(state, num_actions) for state in states]
+                segment_mats, states = self.probcoll_model.graph_eval_inference_segment(
+                    u_segment,
+                    branch_states,
+                    reuse=True)
+                if output_mats is None:
+                    output_mats = segment_mats
+                else:
+                    output_mats = [tf.concat(1, [self._branch(mat, num_actions), segment_mat])
+                                   for mat, segment_mat in zip(output_mats, segment_mats)]
+                num_prefixes = num_branches
+
+            pred_mean, _, _, _ = self.probcoll_model.graph_eval_inference_from_segments(output_mats)
+
+            self._cost(pred_mean)
+
+    @staticmethod
+    def _branch(tensor, num_branches):
+        """ Repeats every row num_branches times, in place """
+        static_shape = tensor.get_shape().as_list()
+        shape = tf.shape(tensor)
+        tiled = tf.tile(tf.expand_dims(tensor, 1), [1, num_branches] + [1] * (len(static_shape) - 1))
+        branched = tf.reshape(tiled, tf.concat(0, [[shape[0] * num_branches], shape[1:]]))
+        # the rnn needs the static state size
+        branched.set_shape([static_shape[0] * num_branches if static_shape[0] is not None else None] + static_shape[1:])
+        return branched
 
-            total_cost = control_cost + coll_cost
-            index = tf.cast(tf.argmin(total_cost, axis=0), tf.int32)
-            self.action = self.primitives[index, 0]
+    @property
+    def flop_reduction(self):
+        """ Recurrent steps (action and output graph FLOPs) of the flat enumeration over the tree """
+        return self.rnn_steps_flat / float(self.rnn_steps_tree)
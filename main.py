@@ -23,9 +23,45 @@ except:
 #try:
 from robots.rccar.algorithm.probcoll_rccar import ProbcollRCcar
 from robots.rccar.algorithm.analyze_rccar import AnalyzeRCcar
+from robots.rccar.algorithm.probcoll_model_rccar import ProbcollModelRCcar
+from general.algorithm.record_schema import parse_dtypes
 #except:
 #    print('main.py: not importing RC car')
 
+from general.benchmark import benchmark_save_type
+from general.benchmark import benchmark_record_schema
+from general.benchmark import benchmark_data_source
+from general.benchmark import benchmark_balanced_sampler
+from general.benchmark import benchmark_bootstrap_mode
+from general.benchmark import benchmark_ensemble
+from general.benchmark import benchmark_shared_trunk
+from general.benchmark import benchmark_weight_swap
+from general.benchmark import benchmark_data_parallel
+from general.benchmark import benchmark_graph_cache
+from general.benchmark import benchmark_primitives_tree
+from general.benchmark import benchmark_cem_warm_start
+from general.benchmark import benchmark_cem_covariance
+from general.benchmark import benchmark_mppi
+from general.benchmark import benchmark_anytime
+
+BENCHMARKS = {
+    'save_type': benchmark_save_type,
+    'record_schema': benchmark_record_schema,
+    'data_source': benchmark_data_source,
+    'balanced_sampler': benchmark_balanced_sampler,
+    'bootstrap_mode': benchmark_bootstrap_mode,
+    'ensemble': benchmark_ensemble,
+    'shared_trunk': benchmark_shared_trunk,
+    'weight_swap': benchmark_weight_swap,
+    'data_parallel': benchmark_data_parallel,
+    'graph_cache': benchmark_graph_cache,
+    'primitives_tree': benchmark_primitives_tree,
+    'cem_warm_start': benchmark_cem_warm_start,
+    'cem_covariance': benchmark_cem_covariance,
+    'mppi': benchmark_mppi,
+    'anytime': benchmark_anytime,
+}
+
 if __name__ == '__main__':
     parser = argparse.ArgumentParser()
     subparsers = parser.add_subparsers()
@@ -36,9 +72,23 @@ if __name__ == '__main__':
     parser_analyze.set_defaults(run='analyze')
     parser_replay_probcoll = subparsers.add_parser('replay_prediction')
     parser_replay_probcoll.set_defaults(run='replay_prediction')
+    parser_benchmark = subparsers.add_parser('benchmark')
+    parser_benchmark.set_defaults(run='benchmark')
+    parser_convert_ensemble = subparsers.add_parser('convert_ensemble')
+    parser_convert_ensemble.set_defaults(run='convert_ensemble')
+    parser_trainer = subparsers.add_parser('trainer')
+    parser_trainer.set_defaults(run='trainer')
+    parser_dp_worker = subparsers.add_parser('dp_worker')
+    parser_dp_worker.set_defaults(run='dp_worker')
+    parser_convert_records = subparsers.add_parser('convert_records')
+    parser_convert_records.set_defaults(run='convert_records')
+    parser_collect_conversions = subparsers.add_parser('collect_conversions')
+    parser_collect_conversions.set_defaults(run='collect_conversions')
 
     ### arguments common to all
-    for subparser in (parser_probcoll, parser_analyze, parser_replay_probcoll):
+    for subparser in (parser_probcoll, parser_analyze, parser_replay_probcoll, parser_benchmark,
+                      parser_convert_ensemble, parser_trainer, parser_dp_worker, parser_convert_records,
+                      parser_collect_conversions):
         subparser.add_argument('robot', type=str, choices=('quadrotor', 'pointquad', 'bebop2d', 'rccar', 'point2d', 'point1d'),
                                help='robot type')
         subparser.add_argument('-exp_name', type=str, default=None,
@@ -57,6 +107,35 @@ if __name__ == '__main__':
     parser_analyze.add_argument('--plot_samples', action='store_true')
     parser_analyze.add_argument('--plot_groundtruth', action='store_true')
 
+    ### benchmark specific arguments
+    parser_benchmark.add_argument('name', type=str, choices=sorted(BENCHMARKS.keys()),
+                                  help='benchmark to run')
+    parser_benchmark.add_argument('-data', type=str, default=None,
+                                  help='folder of samples to benchmark on, defaults to init_data')
+    parser_benchmark.add_argument('-steps', type=int, default=100,
+                                  help='number of timed steps')
+
+    ### convert ensemble specific arguments
+    parser_convert_ensemble.add_argument('checkpoint', type=str,
+                                         help='checkpoint saved with ensemble_mode separate')
+    parser_convert_ensemble.add_argument('out', type=str,
+                                         help='where to save the fused checkpoint')
+
+    ### convert records specific arguments
+    parser_convert_records.add_argument('-src_dtypes', type=str, nargs='*', default=None,
+                                        help='field=dtype (e.g. X=float32 U=float32 O=uint8) of the existing records, '
+                                             'none for float lists. They are converted to the record_dtypes of the yaml')
+
+    ### trainer specific arguments
+    parser_trainer.add_argument('-parent_pid', type=int, default=None,
+                                help='stop training once this process is gone')
+
+    ### data parallel worker specific arguments
+    parser_dp_worker.add_argument('-rank', type=int, required=True,
+                                  help='rank of the worker, 0 is the process running train')
+    parser_dp_worker.add_argument('-parent_pid', type=int, default=None,
+                                  help='stop once this process is gone')
+
     args = parser.parse_args()
     run = args.run
     robot = args.robot
@@ -74,6 +153,10 @@ if __name__ == '__main__':
             yaml_path = os.path.join(os.path.dirname(__file__), 'robots/{0}'.format(robot), yaml_name)
     load_params(yaml_path)
     params['yaml_path'] = yaml_path
+    if run == 'dp_worker':
+        # own batches and bootstrap weights for every worker
+        params['model']['data_parallel_rank'] = args.rank
+        params['random_seed'] += args.rank
 
     np.random.seed(params['random_seed'])
     random.seed(params['random_seed'])
@@ -124,5 +207,72 @@ if __name__ == '__main__':
         else:
             replay_prediction.replay_itr(itr)
 
+    elif run == 'benchmark':
+        if robot == 'rccar':
+            model_cls = ProbcollModelRCcar
+        else:
+            raise Exception('Cannot run {0} for robot {1}'.format(run, robot))
+
+        data_folder = args.data
+        if data_folder is None:
+            data_folder = params['probcoll'].get('init_data', None)
+        if data_folder is not None:
+            npz_fnames = [os.path.join(data_folder, fname) for fname in sorted(os.listdir(data_folder))
+                          if os.path.splitext(fname)[-1] == '.npz']
+        else:
+            npz_fnames = []
+
+        BENCHMARKS[args.name].run(model_cls, npz_fnames, steps=args.steps)
+
+    elif run == 'convert_ensemble':
+        if robot == 'rccar':
+            model_cls = ProbcollModelRCcar
+        else:
+            raise Exception('Cannot run {0} for robot {1}'.format(run, robot))
+
+        params['model']['ensemble_mode'] = 'fused'
+        model = model_cls()
+        model.load_per_head(args.checkpoint)
+        model.save(args.out)
+        model.close()
+
+    elif run == 'trainer':
+        if robot == 'rccar':
+            # the planning process adds the data
+            model = ProbcollModelRCcar(read_only=True)
+        else:
+            raise Exception('Cannot run {0} for robot {1}'.format(run, robot))
+
+        model.run_trainer(parent_pid=args.parent_pid)
+        model.close()
+
+    elif run == 'dp_worker':
+        if robot == 'rccar':
+            model = ProbcollModelRCcar()
+        else:
+            raise Exception('Cannot run {0} for robot {1}'.format(run, robot))
+
+        model.run_data_parallel_worker(parent_pid=args.parent_pid)
+        model.close()
+
+    elif run == 'convert_records':
+        if robot == 'rccar':
+            model = ProbcollModelRCcar(read_only=True)
+        else:
+            raise Exception('Cannot run {0} for robot {1}'.format(run, robot))
+
+        model.convert_records(parse_dtypes(args.src_dtypes))
+        model.close()
+
+    elif run == 'collect_conversions':
+        if robot == 'rccar':
+            model = ProbcollModelRCcar(read_only=True)
+        else:
+            raise Exception('Cannot run {0} for robot {1}'.format(run, robot))
+
+        # deletes the tfrecords converted with any other data params of the experiment
+        model.collect_conversions()
+        model.close()
+
     else:
         raise Exception('Action {0} not valid'.format(run))
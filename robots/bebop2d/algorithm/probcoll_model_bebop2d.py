@@ -6,6 +6,7 @@ import numpy as np
 import tensorflow as tf
 
 from general.algorithm.probcoll_model import ProbcollModel
+from general.algorithm.balanced_sampler import BalancedSampler
 
 from config import params
 import IPython
@@ -139,70 +140,39 @@ class ProbcollModelBebop2d(ProbcollModel):
             start_idxs_by_train_sample = start_idxs_by_sample[num_val:]
             output_by_train_sample = output_by_sample[num_val:]
 
-            ### separate by collision / no collision
-            def separate_collision(start_idxs_by_sample, output_by_sample):
-                coll_start_idxs_by_sample = []
-                nocoll_start_idxs_by_sample = []
-                for start_idxs, output in zip(start_idxs_by_sample, output_by_sample):
-                    coll_start_idxs = []
-                    nocoll_start_idxs = []
-                    for start_idx in start_idxs:
-                        idxs = range(start_idx, start_idx + self.T)
-                        if np.sum(output[idxs]) >= 1:
-                            coll_start_idxs.append(start_idx)
-                        else:
-                            nocoll_start_idxs.append(start_idx)
-                    coll_start_idxs_by_sample.append(coll_start_idxs)
-                    nocoll_start_idxs_by_sample.append(nocoll_start_idxs)
-
-                return coll_start_idxs_by_sample, nocoll_start_idxs_by_sample
-
-            coll_start_idxs_by_train_sample, nocoll_start_idxs_by_train_sample = \
-                separate_collision(start_idxs_by_train_sample, output_by_train_sample)
-            coll_start_idxs_by_val_sample, nocoll_start_idxs_by_val_sample = \
-                separate_collision(start_idxs_by_val_sample, output_by_val_sample)
-
-            assert(len(coll_start_idxs_by_train_sample) > 0)
-            assert(len(nocoll_start_idxs_by_train_sample) > 0)
-            assert(len(coll_start_idxs_by_val_sample) > 0)
-            assert(len(nocoll_start_idxs_by_val_sample) > 0)
-
-            ### idxs to resample from (sample, start_idx)
-            def resample_idxs(start_idxs_by_sample):
-                return [(i, j) for i in xrange(len(start_idxs_by_sample))
-                        for j in start_idxs_by_sample[i]]
-
-            coll_train_resample_idxs = resample_idxs(coll_start_idxs_by_train_sample)
-            nocoll_train_resample_idxs = resample_idxs(nocoll_start_idxs_by_train_sample)
-            coll_val_resample_idxs = resample_idxs(coll_start_idxs_by_val_sample)
-            nocoll_val_resample_idxs = resample_idxs(nocoll_start_idxs_by_val_sample)
+            ### flatten to (sample, start_idx, collision) for every window
+            def window_idxs(start_idxs_by_sample, output_by_sample):
+                # comprehension variables leak in python 2, so none of them is named start_idxs
+                sample_idxs = np.concatenate([[i] * len(sample_starts)
+                                              for i, sample_starts in enumerate(start_idxs_by_sample)]).astype(np.int64)
+                start_idxs = np.concatenate(start_idxs_by_sample).astype(np.int64)
+                colls = np.concatenate([BalancedSampler.window_collisions(sample_output, sample_starts, self.T)
+                                        for sample_starts, sample_output in zip(start_idxs_by_sample, output_by_sample)])
+                assert(np.any(colls == 1))
+                assert(np.any(colls == 0))
+                return sample_idxs, start_idxs, colls
 
             ### do resampling
-            def resample(coll_resample_idxs, nocoll_resample_idxs, num_samples):
-                num_coll = len(coll_resample_idxs)
-                num_nocoll = len(nocoll_resample_idxs)
-
-                N = num_coll + num_nocoll
+            def resample(start_idxs_by_sample, output_by_sample):
+                sample_idxs, start_idxs, colls = window_idxs(start_idxs_by_sample, output_by_sample)
+                num_samples = len(start_idxs_by_sample)
 
-                new_num_coll = int(pct_coll * N)
-                new_num_nocoll = N - new_num_coll
+                sampler = BalancedSampler([1. - pct_coll, pct_coll])
+                sampler.set_data(colls)
+                bootstrap_idxs = sampler.sample(len(colls), num_bootstrap=self.num_bootstrap)
 
                 ### [# train/val samples, # bootstrap, start idxs]
-                bootstrap_start_idxs_by_sample = [[[] for _ in xrange(self.num_bootstrap)] for _ in xrange(num_samples)]
-                for b in xrange(self.num_bootstrap):
-                    for _ in xrange(new_num_coll):
-                        sample_idx, start_idx = random.choice(coll_resample_idxs)
-                        bootstrap_start_idxs_by_sample[sample_idx][b].append(start_idx)
-                    for _ in xrange(new_num_nocoll):
-                        sample_idx, start_idx = random.choice(nocoll_resample_idxs)
-                        bootstrap_start_idxs_by_sample[sample_idx][b].append(start_idx)
+                bootstrap_start_idxs_by_sample = [[None] * self.num_bootstrap for _ in xrange(num_samples)]
+                for b, idxs in enumerate(bootstrap_idxs):
+                    order = np.argsort(sample_idxs[idxs], kind='mergesort')
+                    splits = np.cumsum(np.bincount(sample_idxs[idxs], minlength=num_samples))[:-1]
+                    for i, sample_start_idxs in enumerate(np.split(start_idxs[idxs][order], splits)):
+                        bootstrap_start_idxs_by_sample[i][b] = sample_start_idxs.tolist()
 
                 return bootstrap_start_idxs_by_sample
 
-            bootstrap_start_idxs_by_train_sample = resample(coll_train_resample_idxs, nocoll_train_resample_idxs,
-                                                            len(start_idxs_by_train_sample))
-            bootstrap_start_idxs_by_val_sample = resample(coll_val_resample_idxs, nocoll_val_resample_idxs,
-                                                          len(start_idxs_by_val_sample))
+            bootstrap_start_idxs_by_train_sample = resample(start_idxs_by_train_sample, output_by_train_sample)
+            bootstrap_start_idxs_by_val_sample = resample(start_idxs_by_val_sample, output_by_val_sample)
 
             return bootstrap_start_idxs_by_train_sample, X_by_sample[num_val:], U_by_sample[num_val:], O_by_sample[num_val:], output_by_sample[num_val:], \
                    bootstrap_start_idxs_by_val_sample, X_by_sample[:num_val], U_by_sample[:num_val], O_by_sample[:num_val], output_by_sample[:num_val]
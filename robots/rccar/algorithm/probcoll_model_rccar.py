@@ -26,6 +26,10 @@ class ProbcollModelRCcar(ProbcollModel):
     def _this_file(self):
         return os.path.abspath(__file__.replace('.pyc', '.py'))
 
+    @property
+    def _robot(self):
+        return 'rccar'
+
     ############
     ### Data ###
     ############
@@ -39,6 +43,9 @@ class ProbcollModelRCcar(ProbcollModel):
     ################
 
     def async_training(self):
+        if params['probcoll'].get('async_training_mode', 'thread') == 'process':
+            self.start_training_process()
+            return
         t = threading.Thread(
             target=ProbcollModelRCcar.async_train_func,
             args=(self,))
@@ -10,6 +10,7 @@ import time
 from robots.rccar.tf.planning.planner_primitives_rccar import PlannerPrimitivesRCcar
 from general.tf.planning.planner_random import PlannerRandom
 from general.tf.planning.planner_cem import PlannerCem
+from general.tf.planning.planner_mppi import PlannerMppi
 from general.algorithm.probcoll import Probcoll
 from general.policy.open_loop_policy import OpenLoopPolicy
 from robots.rccar.algorithm.probcoll_model_rccar import ProbcollModelRCcar
@@ -115,7 +116,9 @@ class ProbcollRCcar(Probcoll):
                     x0 = self._conditions.get_cond(0)
                     sample_T = Sample(meta_data=params, T=T)
                     sample_T.set_X(x0, t=0)
+                    self._mpc_policy.reset()
                     for t in xrange(T):
+                        self._probcoll_model.swap_published()
                         x0 = sample_T.get_X(t=t)
 
                         rollout, rollout_no_noise = self._agent.sample_policy(x0, self._mpc_policy, T=1, use_noise=False)
@@ -151,10 +154,11 @@ class ProbcollRCcar(Probcoll):
 
                     assert(samples[-1].isfinite())
                     elapsed = time.time() - start
-                    self._logger.info('\t\t\tFinished cond {0} of testing ({1:.1f}s, {2:.3f}x real-time)'.format(
+                    self._logger.info('\t\t\tFinished cond {0} of testing ({1:.1f}s, {2:.3f}x real-time, {3:.1f} steps/s)'.format(
                         cond,
                         elapsed,
-                        t*params['dt']/elapsed))
+                        t*params['dt']/elapsed,
+                        (t + 1)/elapsed))
 
                 self._itr_save_samples(itr, samples, prefix='testing_')
                 self._agent.execute_control(None, reset=True, pos=reset_pos, quat=reset_quat)
@@ -224,6 +228,9 @@ class ProbcollRCcar(Probcoll):
         elif self._planner_type == 'cem':
             planner = PlannerCem(self._probcoll_model, params['planning'])
             mpc_policy = OpenLoopPolicy(planner)
+        elif self._planner_type == 'mppi':
+            planner = PlannerMppi(self._probcoll_model, params['planning'])
+            mpc_policy = OpenLoopPolicy(planner)
         else:
             raise NotImplementedError('planner_type {0} not implemented for rccar'.format(self._planner_type))
 
@@ -26,3 +26,16 @@ class PlannerPrimitivesRCcar(PlannerPrimitives):
             controls.append(np.array(control))
         controls = np.array(controls)
         self.primitives = tf.constant(controls, dtype=self.probcoll_model.dtype)
+
+    def _create_primitive_tree(self):
+        steers = self.params['primitives']['steers']
+        speeds = self.params['primitives']['speeds']
+        num_splits = self.params['primitives']['num_splits']
+        actions = [[steer, speed] for speed in speeds for steer in steers]
+        segment_lens = []
+        horizon_left = self.probcoll_model.T
+        for i in xrange(num_splits):
+            cur_len = horizon_left // (num_splits - i)
+            segment_lens.append(cur_len)
+            horizon_left -= cur_len
+        return np.array(actions), segment_lens